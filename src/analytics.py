@@ -0,0 +1,408 @@
+"""
+销售分析引擎 (NumPy 列存)
+
+店长报表不再分别发多条 GROUP BY：把 sales 流水按列读成 NumPy 数组 (id、商品、数量、价格快照、时间)，
+一次向量化计算出总额、利润、分类占比、热销排行、商品报表和今日走势。
+分类按成交时的分类快照 (category_snapshot，旧数据没有时取商品当前分类)，与汇总表口径一致；
+分类名在列里存为整数编码，编码表记在 meta.json。
+
+数组以 .npy 文件缓存在磁盘上并以内存映射方式打开，预留容量，刷新时只追加 id 大于高水位的新流水；
+修改订单 (改数量) 通过 modification_logs 的高水位找到被改的流水，重读这几行覆盖。
+自增 id 的提交顺序和分配顺序不一定一致，两个高水位以下缺的 id 都记为空洞 (同 sales_stats)，之后每次刷新
+再查一遍，超过 GAP_TIMEOUT 仍未出现的才放弃；一次刷新的全部查询在同一个一致性快照里执行。
+金额一律按 "分" 存为整数，避免浮点累加误差。
+"""
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from pymysql.cursors import SSCursor
+
+from backend import product_cache, STATS_GAP_SCAN
+from db_setup import DatabaseManager, DB_NAME
+from sales_stats import GAP_TIMEOUT
+
+CACHE_DIR = os.environ.get(
+    'STORE_ANALYTICS_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analytics_cache'))
+# 只分析最近多少天的流水，0 表示全部历史 (与原报表口径一致)
+WINDOW_DAYS = int(os.environ.get('STORE_ANALYTICS_DAYS', 0))
+# 窗口起点比缓存起点晚这么多天以上时，压缩掉窗口外的旧数据
+COMPACT_SLACK_DAYS = 7
+MIN_CAPACITY = 1 << 16
+LOAD_CHUNK = 50000
+
+# 磁盘缓存的格式版本，列有增减时加一，旧缓存会整体重建
+CACHE_FORMAT = 2
+# 时间列存为相对 2000-01-01 的秒数 (与时区无关)
+EPOCH = datetime(2000, 1, 1)
+COLUMNS = (
+    ('id', np.int64),
+    ('product_id', np.int32),
+    ('qty', np.int32),
+    ('buy', np.int64),  # 进价快照 (分)
+    ('sell', np.int64),  # 售价快照 (分)
+    ('total', np.int64),  # 小计 (分)
+    ('ts', np.int64),
+    ('category', np.int32),  # 分类快照的编码 (meta['categories'] 的下标)
+)
+
+# 最后一列是分类名 (与 ROLLUP_SOURCES 一样取 COALESCE(s.category_snapshot, p.category))，读出后换成编码
+SALE_COLUMNS = """s.id, s.product_id, s.quantity,
+       CAST(ROUND(s.buy_price_snapshot * 100) AS SIGNED), CAST(ROUND(s.sell_price_snapshot * 100) AS SIGNED),
+       CAST(ROUND(s.total_price * 100) AS SIGNED), TIMESTAMPDIFF(SECOND, '2000-01-01', s.sale_time),
+       COALESCE(s.category_snapshot, p.category, '其他')
+FROM sales s
+LEFT JOIN products p ON p.id = s.product_id"""
+SQL_NEW_SALES = f"SELECT {SALE_COLUMNS} WHERE s.id > %s AND s.id <= %s AND s.sale_time >= %s ORDER BY s.id"
+SQL_GAP_SALES = f"SELECT {SALE_COLUMNS} WHERE s.id IN ({{marks}})"
+SQL_HIGH_WATER = """
+SELECT (SELECT COALESCE(MAX(id), 0) FROM sales), (SELECT COALESCE(MAX(id), 0) FROM modification_logs)
+"""
+SQL_IDS_BETWEEN = "SELECT id FROM {table} WHERE id > %s AND id <= %s"
+SQL_NEW_MODIFICATIONS = "SELECT id, sale_id FROM modification_logs WHERE id > %s AND id <= %s"
+SQL_GAP_MODIFICATIONS = "SELECT id, sale_id FROM modification_logs WHERE id IN ({marks})"
+SQL_SALES_BY_IDS = "SELECT id, quantity, CAST(ROUND(total_price * 100) AS SIGNED) FROM sales WHERE id IN ({marks})"
+
+
+def _seconds(dt):
+    return int((dt - EPOCH).total_seconds())
+
+
+def _in_marks(ids):
+    return ", ".join(["%s"] * len(ids))
+
+
+def _missing_ids(cursor, table, low, high, now):
+    """(low, high] 内还没有提交的 id (只看最后 STATS_GAP_SCAN 个)，返回 {id: 发现时间}"""
+    low = max(low, high - STATS_GAP_SCAN)
+    if high <= low:
+        return {}
+    cursor.execute(SQL_IDS_BETWEEN.format(table=table), (low, high))
+    seen = {row[0] for row in cursor.fetchall()}
+    return {i: now for i in range(low + 1, high + 1) if i not in seen}
+
+
+class SalesColumns:
+    """
+    sales 流水的列存缓存 (线程安全)
+    磁盘上每列一个 .npy (容量 capacity，前 count 行有效)，meta.json 记录行数、两个高水位及其空洞、分类编码表
+    空洞里的流水晚到时追加在末尾，所以 id 列不保证有序
+    """
+
+    def __init__(self, db=None, path=CACHE_DIR, window_days=WINDOW_DAYS):
+        self.db = db or DatabaseManager(DB_NAME)
+        self.path = path
+        self.window_days = window_days
+        self._lock = threading.Lock()
+        self._arrays = None
+        self.meta = None
+        self._category_codes = {}  # 分类名 -> 编码
+
+    # ---------- 磁盘文件 ----------
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _window_start(self):
+        if not self.window_days:
+            return EPOCH
+        return datetime.combine(date.today() - timedelta(days=self.window_days), datetime.min.time())
+
+    def _save_meta(self):
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def _open(self):
+        """打开已有缓存；没有或与当前库不匹配时返回 False"""
+        try:
+            with open(os.path.join(self.path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != CACHE_FORMAT or meta.get('db') != self.db.db_name:
+                return False
+            if datetime.fromisoformat(meta['window_start']) > self._window_start():
+                return False  # 窗口放宽了，缓存里缺更早的数据
+            self._arrays = {name: open_memmap(self._file(name), mode='r+') for name, _ in COLUMNS}
+        except (OSError, ValueError):
+            return False
+        # JSON 的键都是字符串
+        for key in ('sales_gaps', 'log_gaps'):
+            meta[key] = {int(i): found_at for i, found_at in meta.get(key, {}).items()}
+        self.meta = meta
+        self._category_codes = {name: code for code, name in enumerate(meta['categories'])}
+        return True
+
+    def _create(self, capacity, keep=None):
+        """按新容量重写所有列文件，keep 为要保留的行 (默认前 count 行)"""
+        os.makedirs(self.path, exist_ok=True)
+        count = self.meta['count'] if self.meta else 0
+        old = self._arrays or {}
+        new_count = count if keep is None else int(keep.sum())
+        for name, dtype in COLUMNS:
+            tmp = self._file(name) + '.tmp'
+            column = open_memmap(tmp, mode='w+', dtype=dtype, shape=(capacity,))
+            if name in old and new_count:
+                column[:new_count] = old[name][:count] if keep is None else old[name][:count][keep]
+            column.flush()
+            del column
+        self._arrays = None  # 先释放旧的映射再替换文件
+        old.clear()
+        for name, _ in COLUMNS:
+            os.replace(self._file(name) + '.tmp', self._file(name))
+        self._arrays = {name: open_memmap(self._file(name), mode='r+') for name, _ in COLUMNS}
+        return new_count
+
+    def _reset(self):
+        self.meta = None
+        self._arrays = None
+        self._create(MIN_CAPACITY)
+        # log_hw 为 None：首次刷新时取同一快照里的最大改单 id，加载的流水已经是改后的数量
+        self.meta = {'format': CACHE_FORMAT, 'db': self.db.db_name, 'count': 0, 'capacity': MIN_CAPACITY,
+                     'sales_hw': 0, 'log_hw': None, 'sales_gaps': {}, 'log_gaps': {}, 'categories': [],
+                     'window_start': self._window_start().isoformat()}
+        self._category_codes = {}
+
+    # ---------- 增量刷新 ----------
+    def _encode(self, rows):
+        """查询结果 -> 整数矩阵，最后一列的分类名换成编码 (新分类追加到编码表末尾)"""
+        codes = self._category_codes
+        categories = self.meta['categories']
+
+        def code_of(name):
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(categories)
+                categories.append(name)
+            return code
+
+        block = np.empty((len(rows), len(COLUMNS)), dtype=np.int64)
+        block[:, :-1] = [row[:-1] for row in rows]
+        block[:, -1] = [code_of(row[-1]) for row in rows]
+        return block
+
+    def _append(self, block):
+        count, n = self.meta['count'], len(block)
+        if count + n > self.meta['capacity']:
+            capacity = max(self.meta['capacity'] * 2, count + n)
+            self._create(capacity)
+            self.meta['capacity'] = capacity
+        for i, (name, _) in enumerate(COLUMNS):
+            self._arrays[name][count:count + n] = block[:, i]
+        self.meta['count'] = count + n
+
+    def _load_new_sales(self, cursor, top, now):
+        """追加空洞里新提交的流水和 (高水位, top] 内的新流水，返回新增行数"""
+        window_start = datetime.fromisoformat(self.meta['window_start'])
+        start = _seconds(window_start)
+        gaps = self.meta['sales_gaps']
+        added = 0
+        if gaps:
+            gap_ids = sorted(gaps)
+            cursor.execute(SQL_GAP_SALES.format(marks=_in_marks(gap_ids)), gap_ids)
+            rows = cursor.fetchall()
+            for row in rows:
+                del gaps[row[0]]
+            block = [row for row in rows if row[6] >= start]  # 第 7 列是 ts
+            if block:
+                self._append(self._encode(block))
+                added += len(block)
+
+        prev_hw = self.meta['sales_hw']
+        cursor.execute(SQL_NEW_SALES, (prev_hw, top, window_start))
+        while True:
+            chunk = cursor.fetchmany(LOAD_CHUNK)
+            if not chunk:
+                break
+            self._append(self._encode(chunk))
+            added += len(chunk)
+        gaps.update(_missing_ids(cursor, 'sales', prev_hw, top, now))
+        self.meta['sales_hw'] = top
+        return added
+
+    def _apply_modifications(self, cursor, top, now):
+        """重读被改过数量的流水 (空洞里新提交的和 (高水位, top] 内的改单) 并覆盖，返回覆盖行数"""
+        prev_hw = self.meta['log_hw']
+        gaps = self.meta['log_gaps']
+        if prev_hw is None:
+            gaps.update(_missing_ids(cursor, 'modification_logs', 0, top, now))
+            self.meta['log_hw'] = top
+            return 0
+
+        sale_ids = set()
+        if gaps:
+            gap_ids = sorted(gaps)
+            cursor.execute(SQL_GAP_MODIFICATIONS.format(marks=_in_marks(gap_ids)), gap_ids)
+            for log_id, sale_id in cursor.fetchall():
+                del gaps[log_id]
+                sale_ids.add(sale_id)
+        cursor.execute(SQL_NEW_MODIFICATIONS, (prev_hw, top))
+        sale_ids.update(sale_id for _, sale_id in cursor.fetchall())
+        gaps.update(_missing_ids(cursor, 'modification_logs', prev_hw, top, now))
+        self.meta['log_hw'] = top
+        if not sale_ids:
+            return 0
+
+        sale_ids = sorted(sale_ids)
+        cursor.execute(SQL_SALES_BY_IDS.format(marks=_in_marks(sale_ids)), sale_ids)
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+        patch = np.array(rows, dtype=np.int64)
+        patch = patch[np.argsort(patch[:, 0])]
+        ids = self._arrays['id'][:self.meta['count']]
+        hit = np.flatnonzero(np.isin(ids, patch[:, 0]))  # 窗口外的流水不在缓存里
+        src = np.searchsorted(patch[:, 0], ids[hit])
+        self._arrays['qty'][hit] = patch[src, 1]
+        self._arrays['total'][hit] = patch[src, 2]
+        return len(hit)
+
+    def _expire_gaps(self, now):
+        for key in ('sales_gaps', 'log_gaps'):
+            gaps = self.meta[key]
+            for gap_id, found_at in list(gaps.items()):
+                if now - found_at > GAP_TIMEOUT:
+                    del gaps[gap_id]
+
+    def _compact(self):
+        """窗口前移较多时丢掉窗口外的旧行"""
+        start = self._window_start()
+        if start - datetime.fromisoformat(self.meta['window_start']) < timedelta(days=COMPACT_SLACK_DAYS):
+            return
+        keep = self._arrays['ts'][:self.meta['count']] >= _seconds(start)
+        self.meta['count'] = self._create(self.meta['capacity'], keep)
+        self.meta['window_start'] = start.isoformat()
+
+    def refresh(self):
+        """
+        同步到最新流水
+        :return: (各列前 count 行的副本, 分类编码表)，计算期间不受下一次刷新影响
+        """
+        with self._lock:
+            if self._arrays is None and not self._open():
+                self._reset()
+            self._compact()
+            now = time.time()
+            # 高水位、新流水、空洞、改单记录和被改的流水都在同一个快照里读，彼此一致
+            with self.db.snapshot(SSCursor) as cursor:
+                cursor.execute(SQL_HIGH_WATER)
+                sales_top, log_top = cursor.fetchone()
+                self._load_new_sales(cursor, sales_top, now)
+                self._apply_modifications(cursor, log_top, now)
+            self._expire_gaps(now)
+            for column in self._arrays.values():
+                column.flush()
+            self._save_meta()  # 最后写元数据：中途崩溃时下次按旧水位重新追加，覆盖同样的位置
+            count = self.meta['count']
+            columns = {name: np.array(self._arrays[name][:count]) for name, _ in COLUMNS}
+            return columns, list(self.meta['categories'])
+
+    def rebuild(self):
+        """丢弃磁盘缓存，从数据库重新加载"""
+        with self._lock:
+            self._arrays = None
+            self.meta = None
+            self._reset()
+        return self.refresh()
+
+
+def compute_dashboard(columns, categories, products, window_start=None, day=None, granularity=5, top_n=5):
+    """
+    一次遍历算出报表需要的全部数据
+    :param columns: SalesColumns.refresh() 返回的各列
+    :param categories: 分类编码表 (category 列的值是它的下标)，分类按成交时的快照统计，与汇总表口径一致
+    :param products: {product_id: 商品记录}，只用于显示商品名
+    :param day: 走势图的日期，默认今天
+    :return: 与 ManagerDashboard._load_report_data 相同结构的 dict，另有 'report' (按销售额排序的商品报表)
+    """
+    ts = columns['ts']
+    if window_start is not None and window_start > EPOCH:
+        mask = ts >= _seconds(window_start)
+        columns = {name: col[mask] for name, col in columns.items()}
+        ts = columns['ts']
+    pid = columns['product_id']
+    qty = columns['qty'].astype(np.int64)
+    total = columns['total']
+    profit = (columns['sell'] - columns['buy']) * qty
+
+    # 按商品聚合
+    size = int(pid.max()) + 1 if len(pid) else 1
+    qty_by_p = np.bincount(pid, weights=qty, minlength=size).astype(np.int64)
+    rev_by_p = np.bincount(pid, weights=total, minlength=size)
+    sold = np.flatnonzero(qty_by_p)
+
+    def name_of(p_id):
+        product = products.get(int(p_id))
+        return product['name'] if product else f"#{p_id}"
+
+    top = sold[np.argsort(-qty_by_p[sold], kind='stable')[:top_n]]
+    report_order = sold[np.argsort(-rev_by_p[sold], kind='stable')]
+
+    # 按分类快照聚合，按分类名排序输出
+    rev_by_cat = np.bincount(columns['category'], weights=total, minlength=len(categories))
+    cat_order = [i for i in sorted(range(len(categories)), key=categories.__getitem__) if rev_by_cat[i]]
+
+    # 今日走势
+    day = day or date.today()
+    day_start = _seconds(datetime.combine(day, datetime.min.time()))
+    step = granularity * 60
+    bucket_count = 24 * 60 // granularity
+    in_day = (ts >= day_start) & (ts < day_start + 86400)
+    buckets = (ts[in_day] - day_start) // step
+    totals = np.bincount(buckets, weights=total[in_day], minlength=bucket_count) / 100
+
+    return {
+        "stats": {'total_revenue': int(total.sum()) / 100, 'total_profit': int(profit.sum()) / 100},
+        "top5": [{'name': name_of(p), 'total_qty': int(qty_by_p[p])} for p in top],
+        "labels": [categories[i] for i in cat_order],
+        "sizes": (rev_by_cat[cat_order] / 100).tolist(),
+        "x_minutes": list(range(0, 24 * 60, granularity)),
+        "totals": totals.tolist(),
+        "report": [{'name': name_of(p), 'total_qty': int(qty_by_p[p]), 'total_revenue': rev_by_p[p] / 100}
+                   for p in report_order],
+    }
+
+
+class SalesAnalytics:
+    """店长报表入口：刷新列存缓存并计算"""
+
+    def __init__(self, db=None, path=CACHE_DIR, window_days=WINDOW_DAYS):
+        self.columns = SalesColumns(db, path, window_days)
+
+    def dashboard(self, granularity=5, top_n=5):
+        columns, categories = self.columns.refresh()
+        products = {r.id: r for r in product_cache.all()}
+        data = compute_dashboard(columns, categories, products, self.columns._window_start(),
+                                 granularity=granularity, top_n=top_n)
+        data['rows'] = len(columns['id'])
+        data['window_days'] = self.columns.window_days
+        return data
+
+
+if __name__ == '__main__':
+    # 基准：100 万行流水的一次完整计算
+    rng = np.random.default_rng(1)
+    n = 1_000_000
+    now = _seconds(datetime.now())
+    fake = {
+        'id': np.arange(1, n + 1, dtype=np.int64),
+        'product_id': rng.integers(1, 2000, n).astype(np.int32),
+        'qty': rng.integers(1, 5, n).astype(np.int32),
+        'buy': rng.integers(100, 1000, n),
+        'ts': rng.integers(now - 90 * 86400, now, n),
+    }
+    fake['sell'] = fake['buy'] + rng.integers(0, 500, n)
+    fake['total'] = fake['sell'] * fake['qty']
+    fake['category'] = (fake['product_id'] % 12).astype(np.int32)
+    categories = [f"分类{i}" for i in range(12)]
+    products = {i: {'name': f"商品{i}"} for i in range(1, 2000)}
+    start = time.perf_counter()
+    data = compute_dashboard(fake, categories, products)
+    print(f"{n:,} 行：{(time.perf_counter() - start) * 1e3:.0f} ms，销售额 ¥{data['stats']['total_revenue']:,.2f}")
+    assert data['stats']['total_revenue'] == int(fake['total'].sum()) / 100
+    assert data['top5'][0]['total_qty'] == max(r['total_qty'] for r in data['report'])
+    assert round(sum(data['sizes']), 2) == data['stats']['total_revenue']
@@ -0,0 +1,374 @@
+"""
+异步版业务逻辑 (asyncio + aiomysql)
+
+给多收银台共用的 HTTP/JSON 服务使用：一个进程里成百上千个并发请求共用一个异步连接池，
+等待数据库时不占线程。SQL 语句和业务规则 (合并数量、库存校验、订单明细、汇总表、积分)
+全部来自 backend.py 的共用函数，这里只负责用 await 执行，两边不会各写一套。
+
+aiomysql 为可选依赖，只有用到异步版时才需要安装：pip install aiomysql
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+
+import pymysql
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from backend import (
+    Cart, ProductCache, SalesLogic, HOT_PRODUCT_IDS, SQL_CATALOG_VERSION, SQL_BUMP_CATALOG_VERSION, SQL_ALL_PRODUCTS,
+    SQL_STOCK_CHANGES, STOCK_POLL_LAG,
+    SQL_PRODUCT_ROW, SQL_INSERT_PRODUCT, SQL_UPDATE_PRODUCT, SQL_DELETE_PRODUCT, SQL_MEMBER_BY_PHONE,
+    SQL_INSERT_MEMBER, SQL_INSERT_POINTS, SQL_DEDUCT_HOT_STOCK, _merge_quantities, _product_queries, _checkout_lines,
+    _order_statements, _hot_stock_params, _checkout_result, TX_METRICS, TX_MAX_ATTEMPTS, _lock_error_code, _backoff,
+    member_cache,
+)
+from db_setup import DB_CONFIG, DB_NAME
+from order_id import next_order_id
+
+# 异步连接池参数
+ASYNC_POOL_MIN_SIZE = 2
+ASYNC_POOL_MAX_SIZE = 32
+
+
+async def _run(cursor, statements):
+    """异步执行 backend 中 *_statements 生成的语句"""
+    for many, sql, params in statements:
+        if many:
+            await cursor.executemany(sql, params)
+        else:
+            await cursor.execute(sql, params)
+
+
+async def _bump_catalog_version(cursor):
+    await cursor.execute(SQL_BUMP_CATALOG_VERSION)
+    return cursor.lastrowid
+
+
+async def run_transaction(db, func, name='tx', attempts=TX_MAX_ATTEMPTS):
+    """backend.run_transaction 的异步版：死锁 / 锁等待超时时整体重做 await func(cursor)"""
+    for attempt in range(1, attempts + 1):
+        try:
+            async with db.transaction() as cursor:
+                result = await func(cursor)
+        except Exception as e:
+            code = _lock_error_code(e)
+            if code is None:
+                raise
+            TX_METRICS.record(name, 'deadlocks' if code == 1213 else 'lock_timeouts')
+            if attempt == attempts:
+                TX_METRICS.record(name, 'gave_up')
+                raise
+            TX_METRICS.record(name, 'retries')
+            await asyncio.sleep(_backoff(attempt))
+        else:
+            TX_METRICS.record(name, 'commits')
+            return result
+
+
+class AsyncDatabase:
+    """
+    aiomysql 连接池的简单封装，用法与 DatabaseManager 的 get_cursor / transaction 一致
+    """
+
+    def __init__(self, db_name=DB_NAME, min_size=ASYNC_POOL_MIN_SIZE, max_size=ASYNC_POOL_MAX_SIZE):
+        if aiomysql is None:
+            raise Exception("异步版需要安装 aiomysql：pip install aiomysql")
+        self.db_name = db_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self):
+        if self.pool is None:
+            config = DB_CONFIG.copy()
+            config['db'] = self.db_name
+            self.pool = await aiomysql.create_pool(minsize=self.min_size, maxsize=self.max_size, **config)
+        return self
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    @asynccontextmanager
+    async def get_cursor(self):
+        """借一个连接，返回字典游标，退出时自动归还"""
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                yield cursor
+
+    @asynccontextmanager
+    async def transaction(self):
+        """事务上下文：正常退出提交，异常回滚"""
+        async with self.pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    yield cursor
+                await conn.commit()
+            except BaseException:
+                try:
+                    await conn.rollback()
+                except Exception:
+                    pass
+                raise
+
+
+class AsyncProductCache(ProductCache):
+    """
+    异步版商品缓存：索引和查询沿用 ProductCache，
+    版本检查与加载改由 refresh() 通过 aiomysql 完成，查询前先 await refresh()
+    """
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._refresh_lock = asyncio.Lock()
+
+    def _ensure_fresh(self):
+        self.hits += 1  # 新鲜度由 refresh() 保证，查询本身不再访问数据库
+
+    def _stale(self):
+        return self.version is None or time.monotonic() - self._checked_at >= self.CHECK_INTERVAL
+
+    async def refresh(self):
+        if not self._stale():
+            return
+        async with self._refresh_lock:
+            # 多个请求同时发现过期时，只有第一个去查数据库
+            if not self._stale():
+                return
+            if self.version is not None:
+                async with self.db.get_cursor() as cursor:
+                    await cursor.execute(SQL_CATALOG_VERSION)
+                    marks = await cursor.fetchone()
+                    await cursor.execute(SQL_STOCK_CHANGES, (self._synced_at - STOCK_POLL_LAG,))
+                    stock_rows = await cursor.fetchall()
+                with self._lock:
+                    merged = self._merge_poll(marks, stock_rows)
+                if merged:
+                    self._checked_at = time.monotonic()
+                    return
+
+            self.misses += 1
+            async with self.db.transaction() as cursor:
+                await cursor.execute(SQL_CATALOG_VERSION)
+                marks = await cursor.fetchone()
+                await cursor.execute(SQL_ALL_PRODUCTS)
+                rows = await cursor.fetchall()
+            with self._lock:
+                self._install(marks, rows)
+            self._checked_at = time.monotonic()
+
+
+class AsyncProductLogic:
+    """异步版 ProductLogic"""
+
+    def __init__(self, db, cache=None):
+        self.db = db
+        self.cache = cache or AsyncProductCache(db)
+
+    async def _write_product(self, sql, params, product_id=None, deleted=False):
+        """执行一条商品写语句，读回最新数据 (删除时为 None) 同步到缓存"""
+        async with self.db.transaction() as cursor:
+            await cursor.execute(sql, params)
+            if product_id is None:
+                product_id = cursor.lastrowid
+            row = None
+            if not deleted:
+                await cursor.execute(SQL_PRODUCT_ROW, (product_id,))
+                row = await cursor.fetchone()
+            catalog_version = await _bump_catalog_version(cursor)
+        self.cache.apply_change(product_id, row, catalog_version)
+        return True
+
+    async def add_product(self, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date,
+                          barcode=None):
+        return await self._write_product(SQL_INSERT_PRODUCT, (name, category, buy_price, sell_price, stock,
+                                                              min_stock_alert, expire_date, barcode or None))
+
+    async def update_product(self, product_id, name, category, buy_price, sell_price, stock, min_stock_alert,
+                             expire_date, barcode=None):
+        return await self._write_product(SQL_UPDATE_PRODUCT, (name, category, buy_price, sell_price, stock,
+                                                              min_stock_alert, expire_date, barcode or None,
+                                                              product_id), product_id)
+
+    async def delete_product(self, product_id):
+        return await self._write_product(SQL_DELETE_PRODUCT, (product_id,), product_id, deleted=True)
+
+    async def get_all_products(self, limit=None, after_key=None):
+        await self.cache.refresh()
+        return self.cache.all(limit, after_key)
+
+    async def get_products_by_ids(self, product_ids):
+        await self.cache.refresh()
+        return self.cache.get_many(product_ids)
+
+    async def get_by_barcode(self, barcode):
+        await self.cache.refresh()
+        return self.cache.get_by_barcode(barcode.strip())
+
+    async def get_expiring_products(self, days=7):
+        await self.cache.refresh()
+        return self.cache.expiring(date.today() + timedelta(days=days))
+
+    async def search_products(self, keyword):
+        await self.cache.refresh()
+        return self.cache.search(keyword)
+
+    async def get_low_stock_products(self):
+        await self.cache.refresh()
+        return self.cache.low_stock()
+
+
+class AsyncSalesLogic:
+    """异步版 SalesLogic (结账)"""
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+        self.hot_ids = HOT_PRODUCT_IDS
+
+    async def _write_checkout(self, cursor, order_id, clerk_id, member_id, sale_time, quantities):
+        """
+        在当前事务中完成一笔结账，步骤与 SalesLogic.checkout 相同
+        :return: (订单总额, 新增积分, {id: 扣减后的库存})
+        """
+        product_ids = sorted(quantities)
+        hot_ids = self.hot_ids.intersection(product_ids)
+        products = {}
+        for sql, params in _product_queries(product_ids, hot_ids):
+            await cursor.execute(sql, params)
+            products.update((row['id'], row) for row in await cursor.fetchall())
+
+        lines = _checkout_lines(products, quantities, hot_ids)
+        statements, total_amount, points_added = _order_statements(
+            order_id, clerk_id, member_id, sale_time, lines, hot_ids)
+        await _run(cursor, statements)
+
+        # 热门商品最后按条件扣库存
+        stocks = {p_id: products[p_id]['stock'] - quantities[p_id] for p_id in product_ids if p_id not in hot_ids}
+        for name, params in _hot_stock_params(products, quantities, hot_ids):
+            await cursor.execute(SQL_DEDUCT_HOT_STOCK, params)
+            if cursor.rowcount != 1:
+                raise Exception(f"商品 {name} 库存不足")
+            stocks[params[1]] = cursor.lastrowid
+        return total_amount, points_added, stocks
+
+    async def checkout(self, clerk_id, cart_items, member_id=None):
+        """与 SalesLogic.checkout 相同：返回 (是否成功, 提示信息, 小票数据)"""
+        if isinstance(cart_items, Cart):
+            cart_items = cart_items.to_checkout_items()
+        if not cart_items:
+            return False, "购物车为空", None
+
+        order_id = next_order_id()
+        sale_time = datetime.now().replace(microsecond=0)
+        quantities = _merge_quantities(cart_items)
+
+        async def write(cursor):
+            return await self._write_checkout(cursor, order_id, clerk_id, member_id, sale_time, quantities)
+
+        try:
+            total_amount, points_added, stocks = await run_transaction(self.db, write, 'checkout')
+        except Exception as e:
+            return False, str(e), None
+
+        self.cache.apply_stock(stocks)
+        if member_id and points_added:
+            member_cache.add_points(member_id, points_added)
+        msg, receipt_data = _checkout_result(order_id, cart_items, total_amount, points_added, member_id, sale_time)
+        return True, msg, receipt_data
+
+    async def get_all_orders(self, clerk_id=None, limit=None, after_key=None):
+        """与 SalesLogic.get_all_orders 相同 (按时间倒序，键集分页)"""
+        sql, params = SalesLogic._orders_query(clerk_id, limit, after_key)
+        async with self.db.get_cursor() as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchall()
+
+    async def checkout_many(self, orders):
+        """
+        组提交：一批订单在同一个事务里写入，只提交 (落盘) 一次
+        每笔订单用 SAVEPOINT 隔开，某一笔库存不足只回滚这一笔；数据库本身出错则整批失败
+        :param orders: [(clerk_id, cart_items, member_id)]
+        :return: 与 orders 一一对应的 (是否成功, 提示信息, 小票数据)
+        """
+        sale_time = datetime.now().replace(microsecond=0)
+
+        async def write(cursor):
+            # 整批可能因死锁重做，每次都从头开始
+            results = [None] * len(orders)
+            written = []  # (下标, 订单号, 购物车, 总额, 积分, 会员ID)
+            stocks = {}
+            for i, (clerk_id, cart_items, member_id) in enumerate(orders):
+                if isinstance(cart_items, Cart):
+                    cart_items = cart_items.to_checkout_items()
+                if not cart_items:
+                    results[i] = (False, "购物车为空", None)
+                    continue
+
+                order_id = next_order_id()
+                quantities = _merge_quantities(cart_items)
+                await cursor.execute(f"SAVEPOINT order_{i}")
+                try:
+                    total_amount, points_added, order_stocks = await self._write_checkout(
+                        cursor, order_id, clerk_id, member_id, sale_time, quantities)
+                except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                    raise  # 连接断开、死锁：整个事务已不可用
+                except Exception as e:
+                    await cursor.execute(f"ROLLBACK TO SAVEPOINT order_{i}")
+                    results[i] = (False, str(e), None)
+                    continue
+                await cursor.execute(f"RELEASE SAVEPOINT order_{i}")
+
+                # 同一批里后面的订单读到的是已扣减后的库存，直接覆盖即可
+                stocks.update(order_stocks)
+                written.append((i, order_id, cart_items, total_amount, points_added, member_id))
+            return results, written, stocks
+
+        try:
+            results, written, stocks = await run_transaction(self.db, write, 'checkout_batch')
+        except Exception as e:
+            return [(False, str(e), None)] * len(orders)
+
+        self.cache.apply_stock(stocks)
+        for i, order_id, cart_items, total_amount, points_added, member_id in written:
+            if member_id and points_added:
+                member_cache.add_points(member_id, points_added)
+            msg, receipt_data = _checkout_result(order_id, cart_items, total_amount, points_added, member_id,
+                                                 sale_time)
+            results[i] = (True, msg, receipt_data)
+        return results
+
+
+class AsyncMemberLogic:
+    """异步版 MemberLogic"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get_member_by_phone(self, phone):
+        async with self.db.get_cursor() as cursor:
+            await cursor.execute(SQL_MEMBER_BY_PHONE, (phone,))
+            return await cursor.fetchone()
+
+    async def register_member(self, phone, name):
+        try:
+            async with self.db.get_cursor() as cursor:
+                await cursor.execute(SQL_INSERT_MEMBER, (phone, name))
+                member_cache.put(cursor.lastrowid, phone, name, 0)
+            return True
+        except Exception:
+            return False
+
+    async def update_points(self, member_id, points_delta, reason='adjust'):
+        async with self.db.get_cursor() as cursor:
+            await cursor.execute(SQL_INSERT_POINTS, (member_id, points_delta, reason, None))
+        member_cache.add_points(member_id, points_delta)
+        return True
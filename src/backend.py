@@ -1,7 +1,836 @@
-import pymysql
-from db_setup import DatabaseManager, DB_NAME
-from datetime import datetime
+import bisect
+import os
+import random
+import threading
 import time
+import pymysql
+from db_setup import DatabaseManager, DB_NAME, LOCK_ERROR_CODES
+from order_id import next_order_id
+from offline_journal import OfflineJournal, JournalReplayer, PENDING, APPLIED, CONFLICT
+from search_index import SearchIndex
+from member_directory import MemberDirectory
+from credentials import SessionCache, hash_password, verify_password, burn_time
+from sales_stats import SalesAggregator
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# 销售走势支持的分桶粒度 (分钟)
+SALES_GRANULARITIES = (1, 5, 15, 60)
+
+# 结账模式：online 直接写 MySQL (连不上时自动转离线)；queued 先写本地日志立即返回，后台补录
+CHECKOUT_MODE = os.environ.get('STORE_CHECKOUT_MODE', 'online')
+
+# 热门商品 id (如促销时所有收银台都在卖的可口可乐)，用逗号分隔，默认没有
+# 热门商品结账时不加锁读，库存用带条件的 UPDATE 在事务最后扣减，行锁只持有到紧接着的提交；
+# 所有收银台和收银服务的配置必须一致，否则加锁顺序不同可能互相死锁
+HOT_PRODUCT_IDS = frozenset(int(p) for p in os.environ.get('STORE_HOT_PRODUCTS', '').split(',') if p.strip())
+
+# 库存轮询往回多看的时间：updated_at 是语句执行的时刻而不是提交的时刻，
+# 执行后过一会儿才提交的事务也要被下一次轮询看到 (结账事务远短于此)
+STOCK_POLL_LAG = timedelta(seconds=60)
+
+# 汇总表每个键拆成的分片数：每个事务随机累加到其中一片，并发结账很少争同一行 (读时按键求和)
+ROLLUP_SHARDS = 16
+
+# 连不上数据库的错误码：结账时遇到这些才转离线，其余错误照常报给收银员
+DB_CONNECTION_ERROR_CODES = (2003, 2006, 2013, 2055)
+
+# 积分流水折算进会员余额的周期 (秒) 与每批条数
+POINTS_FOLD_INTERVAL = 5.0
+POINTS_FOLD_BATCH = 2000
+
+# 事务遇到死锁 / 锁等待超时时的重做次数与退避时间 (秒)
+TX_MAX_ATTEMPTS = 4
+TX_BACKOFF_BASE = 0.02
+
+
+class TxMetrics:
+    """按事务名统计提交、重做、放弃的次数 (线程安全)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, key, count=1):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'commits': 0, 'retries': 0, 'deadlocks': 0,
+                                                  'lock_timeouts': 0, 'gave_up': 0})
+            stats[key] += count
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+TX_METRICS = TxMetrics()
+
+def _lock_error_code(e):
+    """死锁 / 锁等待超时返回错误码，其他异常返回 None"""
+    if isinstance(e, pymysql.err.OperationalError) and e.args and e.args[0] in LOCK_ERROR_CODES:
+        return e.args[0]
+    return None
+
+def _backoff(attempt):
+    """第 attempt 次重做前的等待：指数退避 + 全随机抖动，避免冲突双方同时重来"""
+    return random.uniform(0, TX_BACKOFF_BASE * 2 ** (attempt - 1))
+
+def run_transaction(db, func, name='tx', attempts=TX_MAX_ATTEMPTS):
+    """
+    在事务中执行 func(cursor) 并返回其结果
+    遇到死锁 / 锁等待超时，MySQL 已回滚整个事务，这里稍等后整体重做，最多 attempts 次；
+    func 可能执行多次，所以事务外的副作用 (改缓存等) 要放在返回之后
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with db.transaction() as cursor:
+                result = func(cursor)
+        except Exception as e:
+            code = _lock_error_code(e)
+            if code is None:
+                raise
+            TX_METRICS.record(name, 'deadlocks' if code == 1213 else 'lock_timeouts')
+            if attempt == attempts:
+                TX_METRICS.record(name, 'gave_up')
+                raise
+            TX_METRICS.record(name, 'retries')
+            time.sleep(_backoff(attempt))
+        else:
+            TX_METRICS.record(name, 'commits')
+            return result
+
+def _is_connection_error(e):
+    if isinstance(e, (pymysql.err.InterfaceError, TimeoutError)):
+        return True
+    return isinstance(e, pymysql.err.OperationalError) and bool(e.args) and e.args[0] in DB_CONNECTION_ERROR_CODES
+
+def _is_replay_retryable(e):
+    """回放离线订单时可以稍后重试的异常 (连接断开、连接池满、死锁、锁等待超时)，其余的记为冲突"""
+    return _is_connection_error(e) or _lock_error_code(e) is not None
+
+# ================= SQL 与业务规则 (同步 / 异步版本共用) =================
+# 下面的 *_statements 函数只生成 [(是否 executemany, sql, 参数)]，不执行；
+# 同步版用 _run 执行，async_backend 用 await 执行，保证两边的 SQL 和业务规则一致
+
+# 版本号连同数据库当前时间一起读，作为下一次库存轮询的起点
+SQL_CATALOG_VERSION = "SELECT NOW(6) AS now, COALESCE((SELECT version FROM catalog_version WHERE id = 1), 0) AS version"
+# 结账 / 改单只改库存，不动版本号；各收银台按 products.updated_at 轮询最近变过的库存
+SQL_STOCK_CHANGES = "SELECT id, stock FROM products WHERE updated_at >= %s"
+# LAST_INSERT_ID(expr) 让新值随 OK 包返回，不需要再查一次
+SQL_BUMP_CATALOG_VERSION = "UPDATE catalog_version SET version = LAST_INSERT_ID(version + 1) WHERE id = 1"
+SQL_INSERT_PRODUCT = """
+INSERT INTO products (name, category, buy_price, sell_price, stock, min_stock_alert, expire_date, barcode)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_UPDATE_PRODUCT = """
+UPDATE products
+SET name=%s, category=%s, buy_price=%s, sell_price=%s, stock=%s, min_stock_alert=%s, expire_date=%s, barcode=%s
+WHERE id=%s
+"""
+SQL_DELETE_PRODUCT = "DELETE FROM products WHERE id=%s"
+SQL_INSERT_SALES = """
+INSERT INTO sales (order_id, product_id, user_id, quantity, buy_price_snapshot, sell_price_snapshot, total_price, sale_time,
+                   member_id, category_snapshot)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+# LAST_INSERT_ID(expr) 顺便带回扣减后的库存；stock >= %s 保证不会超卖
+SQL_DEDUCT_HOT_STOCK = "UPDATE products SET stock = LAST_INSERT_ID(stock - %s) WHERE id = %s AND stock >= %s"
+SQL_ORDER_EXISTS = "SELECT 1 FROM sales WHERE order_id = %s LIMIT 1"
+# 积分只追加流水，不直接改 members.points；余额 = members.points (已折算的快照) + 未折算流水之和
+SQL_INSERT_POINTS = "INSERT INTO points_ledger (member_id, delta, reason, order_id) VALUES (%s, %s, %s, %s)"
+SQL_MEMBER_BY_PHONE = """
+SELECT m.id, m.phone, m.name, m.created_at,
+       CAST(m.points + COALESCE((SELECT SUM(l.delta) FROM points_ledger l
+                                 WHERE l.folded = 0 AND l.member_id = m.id), 0) AS SIGNED) AS points
+FROM members m
+WHERE m.phone = %s
+"""
+SQL_INSERT_MEMBER = "INSERT INTO members (phone, name, points) VALUES (%s, %s, 0)"
+SQL_ALL_MEMBERS = """
+SELECT m.id, m.phone, m.name, CAST(m.points + COALESCE(p.delta, 0) AS SIGNED) AS points
+FROM members m
+LEFT JOIN (SELECT member_id, SUM(delta) AS delta FROM points_ledger WHERE folded = 0 GROUP BY member_id) p
+       ON p.member_id = m.id
+"""
+SQL_NEW_MEMBERS = SQL_ALL_MEMBERS + " WHERE m.id > %s ORDER BY m.id"
+SQL_POINTS_HISTORY = """
+SELECT id, delta, reason, order_id, created_at FROM points_ledger
+WHERE member_id = %s ORDER BY id DESC LIMIT %s
+"""
+SQL_PENDING_POINTS = "SELECT id, member_id, delta FROM points_ledger WHERE folded = 0 ORDER BY id LIMIT %s"
+# [start, end) 内按 %s 秒分桶的销售额
+SQL_SALES_BUCKETS = """
+SELECT FLOOR(TIMESTAMPDIFF(SECOND, %s, sale_time) / %s) as b, SUM(total_price) as total
+FROM sales
+WHERE sale_time >= %s AND sale_time < %s
+GROUP BY b
+"""
+# 看板增量统计
+# 分类按销售时的分类快照，与 sales_hourly_category 汇总表口径一致
+STATS_CATEGORY = "COALESCE(s.category_snapshot, p.category, '其他') as category"
+STATS_SALE_COLUMNS = ("s.id, s.product_id, s.quantity, s.total_price, s.buy_price_snapshot, s.sell_price_snapshot, "
+                      f"s.sale_time, {STATS_CATEGORY}")
+STATS_GAP_SCAN = 1000  # 初始化时在最大 id 以下这么多行里找还没提交的空洞
+SQL_STATS_NEW_SALES = f"""
+SELECT {STATS_SALE_COLUMNS} FROM sales s LEFT JOIN products p ON p.id = s.product_id
+WHERE s.id > %s ORDER BY s.id
+"""
+SQL_STATS_GAP_SALES = f"""
+SELECT {STATS_SALE_COLUMNS} FROM sales s LEFT JOIN products p ON p.id = s.product_id
+WHERE s.id IN ({{marks}})
+"""
+SQL_STATS_NEW_LOGS = f"""
+SELECT l.id, l.sale_id, l.old_qty, l.new_qty, s.product_id, s.buy_price_snapshot, s.sell_price_snapshot, s.sale_time,
+       {STATS_CATEGORY}
+FROM modification_logs l JOIN sales s ON s.id = l.sale_id LEFT JOIN products p ON p.id = s.product_id
+WHERE l.id > %s ORDER BY l.id
+"""
+SQL_STATS_GAP_LOGS = f"""
+SELECT l.id, l.sale_id, l.old_qty, l.new_qty, s.product_id, s.buy_price_snapshot, s.sell_price_snapshot, s.sale_time,
+       {STATS_CATEGORY}
+FROM modification_logs l JOIN sales s ON s.id = l.sale_id LEFT JOIN products p ON p.id = s.product_id
+WHERE l.id IN ({{marks}})
+"""
+SQL_STATS_HIGH_WATER = """
+SELECT (SELECT COALESCE(MAX(id), 0) FROM sales) as sales_hw,
+       (SELECT COALESCE(MAX(id), 0) FROM modification_logs) as log_hw
+"""
+SQL_STATS_BY_PRODUCT = """
+SELECT product_id, SUM(qty) as qty, SUM(revenue) as revenue, SUM(profit) as profit
+FROM sales_daily_product GROUP BY product_id
+"""
+SQL_STATS_BY_CATEGORY = "SELECT category, SUM(revenue) as revenue FROM sales_hourly_category GROUP BY category"
+SQL_STATS_MINUTES = """
+SELECT HOUR(sale_time) * 60 + MINUTE(sale_time) as m, SUM(total_price) as total
+FROM sales WHERE sale_time >= %s AND sale_time < %s AND id <= %s
+GROUP BY m
+"""
+SQL_STATS_RECENT_IDS = "SELECT id FROM sales WHERE id > %s AND id <= %s"
+SQL_STATS_RECENT_LOG_IDS = "SELECT id FROM modification_logs WHERE id > %s AND id <= %s"
+SQL_ROLLUP_UPSERT = """
+INSERT INTO {table} ({keys}, shard, qty, revenue, profit) VALUES ({marks}, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE qty = qty + VALUES(qty), revenue = revenue + VALUES(revenue), profit = profit + VALUES(profit)
+"""
+
+
+def _run(cursor, statements):
+    """同步执行 *_statements 生成的语句"""
+    for many, sql, params in statements:
+        if many:
+            cursor.executemany(sql, params)
+        else:
+            cursor.execute(sql, params)
+
+def _rollup_statements(deltas):
+    """
+    把销售增量累加到汇总表的语句 (整个事务写同一个随机分片)
+    :param deltas: [(sale_time, product_id, category, qty, revenue, profit)]，退货/改单时为负数
+    """
+    by_product, by_category, by_store = {}, {}, {}
+    for sale_time, p_id, category, qty, revenue, profit in deltas:
+        day = sale_time.date()
+        hour = sale_time.replace(minute=0, second=0, microsecond=0)
+        for bucket, key in ((by_product, (day, p_id)), (by_category, (hour, category)), (by_store, (day,))):
+            old = bucket.get(key, (0, 0, 0))
+            bucket[key] = (old[0] + qty, old[1] + revenue, old[2] + profit)
+
+    shard = random.randrange(ROLLUP_SHARDS)
+    statements = []
+    for table, keys, bucket in (('sales_daily_product', 'sale_date, product_id', by_product),
+                                ('sales_hourly_category', 'sale_hour, category', by_category),
+                                ('sales_daily_store', 'sale_date', by_store)):
+        if bucket:
+            marks = ", ".join(["%s"] * (keys.count(",") + 1))
+            statements.append((True, SQL_ROLLUP_UPSERT.format(table=table, keys=keys, marks=marks),
+                               [key + (shard,) + values for key, values in sorted(bucket.items())]))
+    return statements
+
+def _apply_rollups(cursor, deltas):
+    """在当前事务中把销售增量累加到汇总表"""
+    _run(cursor, _rollup_statements(deltas))
+
+def _merge_quantities(cart_items):
+    """同一商品合并数量，返回 {id: 数量}"""
+    quantities = {}
+    for item in cart_items:
+        p_id = int(item['id'])
+        quantities[p_id] = quantities.get(p_id, 0) + int(item['buy_qty'])
+    return quantities
+
+def _product_queries(product_ids, hot_ids=()):
+    """
+    结账时读取商品的语句：普通商品一条语句加行锁 (FOR UPDATE)，热门商品只做不加锁的一致性读
+    :return: [(sql, 参数)]
+    """
+    queries = []
+    for ids, suffix in (([p for p in product_ids if p not in hot_ids], " FOR UPDATE"),
+                        ([p for p in product_ids if p in hot_ids], "")):
+        if ids:
+            id_marks = ", ".join(["%s"] * len(ids))
+            queries.append((f"SELECT id, name, category, stock, buy_price, sell_price FROM products "
+                            f"WHERE id IN ({id_marks}) ORDER BY id{suffix}", ids))
+    return queries
+
+def _load_products(cursor, product_ids, hot_ids=()):
+    """读取 (并锁住普通) 商品行，返回 {id: 行}"""
+    products = {}
+    for sql, params in _product_queries(product_ids, hot_ids):
+        cursor.execute(sql, params)
+        products.update((row['id'], row) for row in cursor.fetchall())
+    return products
+
+def _checkout_lines(products, quantities, hot_ids=()):
+    """
+    校验库存并生成订单明细，库存不足直接抛异常
+    热门商品没有加锁，这里读到的库存不作数，由 _deduct_hot_stock 的条件更新把关
+    :return: [(product_id, category, qty, buy_price, sell_price)]，按 product_id 升序
+    """
+    lines = []
+    for p_id in sorted(quantities):
+        product = products.get(p_id)
+        if not product or (p_id not in hot_ids and product['stock'] < quantities[p_id]):
+            raise Exception(f"商品 {product['name'] if product else p_id} 库存不足")
+        lines.append((p_id, product['category'], quantities[p_id], product['buy_price'], product['sell_price']))
+    return lines
+
+def _order_statements(order_id, clerk_id, member_id, sale_time, lines, hot_ids=()):
+    """
+    写入一笔订单的语句：扣库存 (热门商品除外)、写销售记录、更新汇总表、追加会员积分流水
+    :param lines: [(product_id, category, qty, buy_price, sell_price)]，按 product_id 升序
+    :return: (语句列表, 订单总额, 新增积分)
+    """
+    statements = []
+    locked = [line for line in lines if line[0] not in hot_ids]
+    if locked:
+        # 一条语句扣减所有 (已加锁的) 库存
+        product_ids = [line[0] for line in locked]
+        id_marks = ", ".join(["%s"] * len(product_ids))
+        cases = " ".join(["WHEN %s THEN %s"] * len(locked))
+        case_params = []
+        for p_id, _, qty, _, _ in locked:
+            case_params += [p_id, qty]
+        statements.append((False, f"UPDATE products SET stock = stock - CASE id {cases} END WHERE id IN ({id_marks})",
+                           case_params + product_ids))
+
+    # 多行插入销售记录
+    total_amount = Decimal('0')
+    sale_rows = []
+    rollup_deltas = []
+    for p_id, category, qty, buy_price, sell_price in lines:
+        item_total = sell_price * qty
+        sale_rows.append((order_id, p_id, clerk_id, qty, buy_price, sell_price, item_total, sale_time, member_id,
+                          category))
+        rollup_deltas.append((sale_time, p_id, category, qty, item_total, (sell_price - buy_price) * qty))
+        total_amount += item_total
+    statements.append((True, SQL_INSERT_SALES, sale_rows))
+
+    # 同一事务内更新汇总表
+    statements += _rollup_statements(rollup_deltas)
+
+    # --- 积分逻辑 ---
+    points_added = 0
+    if member_id:
+        # 1元 = 1分；只追加流水，不锁会员行，同一会员在多台收银机同时结账也不会互相等待
+        points_added = int(total_amount)
+        if points_added:
+            statements.append((False, SQL_INSERT_POINTS, (member_id, points_added, 'checkout', order_id)))
+    return statements, total_amount, points_added
+
+def _write_order(cursor, order_id, clerk_id, member_id, sale_time, lines, hot_ids=()):
+    """在当前事务中写入一笔订单，返回 (订单总额, 新增积分)"""
+    statements, total_amount, points_added = _order_statements(
+        order_id, clerk_id, member_id, sale_time, lines, hot_ids)
+    _run(cursor, statements)
+    return total_amount, points_added
+
+def _hot_stock_params(products, quantities, hot_ids):
+    """热门商品扣库存的 [(商品名, SQL_DEDUCT_HOT_STOCK 参数)]，按 id 升序"""
+    return [(products[p_id]['name'], (quantities[p_id], p_id, quantities[p_id]))
+            for p_id in sorted(hot_ids)]
+
+def _deduct_hot_stock(cursor, products, quantities, hot_ids):
+    """
+    热门商品扣库存 (放在事务最后，紧接着提交)
+    条件不满足 (库存不够) 时更新 0 行，抛异常让整个事务回滚
+    :return: {id: 扣减后的库存}
+    """
+    stocks = {}
+    for name, params in _hot_stock_params(products, quantities, hot_ids):
+        cursor.execute(SQL_DEDUCT_HOT_STOCK, params)
+        if cursor.rowcount != 1:
+            raise Exception(f"商品 {name} 库存不足")
+        stocks[params[1]] = cursor.lastrowid
+    return stocks
+
+def _checkout_result(order_id, cart_items, total_amount, points_added, member_id, sale_time, queued=False):
+    """结账成功后返回给收银台的 (提示信息, 小票数据)"""
+    msg = f"结账成功! 订单号:{order_id} 总额:¥{total_amount:.2f}"
+    if member_id:
+        msg += f"\n会员积分 +{points_added}"
+    if queued:
+        msg += "\n(离线订单，已存入本地，联网后自动同步)"
+
+    receipt_data = {
+        "order_id": order_id,
+        "items": cart_items,
+        "total": total_amount,
+        "time": sale_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "member_points": points_added,
+        "offline": queued
+    }
+    return msg, receipt_data
+
+def _bump_catalog_version(cursor):
+    """
+    商品目录版本号 +1，返回新版本号 (在当前事务内，应尽量放在提交前最后执行)
+    只用于商品增删改、导入；结账等只改库存的操作不要调用，否则所有收银台都要整体重新加载
+    """
+    cursor.execute(SQL_BUMP_CATALOG_VERSION)
+    return cursor.lastrowid
+
+
+PRODUCT_FIELDS = ('id', 'barcode', 'name', 'category', 'buy_price', 'sell_price', 'stock', 'min_stock_alert',
+                  'expire_date')
+SQL_ALL_PRODUCTS = f"SELECT {', '.join(PRODUCT_FIELDS)} FROM products"
+SQL_PRODUCT_ROW = SQL_ALL_PRODUCTS + " WHERE id=%s"
+
+
+class ProductRecord:
+    """
+    缓存中的商品记录，比 dict 省内存
+    支持 p['name'] 的取值方式，界面代码不用改
+    """
+    __slots__ = PRODUCT_FIELDS
+
+    def __init__(self, row):
+        for field in PRODUCT_FIELDS:
+            setattr(self, field, row[field])
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return PRODUCT_FIELDS
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in PRODUCT_FIELDS}
+
+    def replace(self, **changes):
+        """返回修改了部分字段的新记录 (记录本身不可变，已经交出去的列表不受影响)"""
+        row = self.to_dict()
+        row.update(changes)
+        return ProductRecord(row)
+
+
+class ProductCache:
+    """
+    进程内商品目录缓存
+    按 id / 条形码 / 分类 / 临期日期建索引；最多每 CHECK_INTERVAL 秒轮询一次：
+    catalog_version 变了 (商品增删改、导入) 整体重新加载，否则只取回这段时间里变过的库存；
+    本机的改动则立即生效
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.RLock()
+        self.version = None
+        self._checked_at = 0.0
+        self._synced_at = None  # 上次同步时的数据库时间
+        self.by_id = {}
+        self.by_barcode = {}
+        self.by_category = {}
+        self._ids = []  # 升序 id，用于分页
+        self._by_expire = []  # 按 (临期日期, id) 排序
+        self.search_index = SearchIndex()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- 失效与加载 ----------
+    def _poll(self):
+        """:return: (版本号行, 上次同步以来变过的 [(id, stock)])"""
+        with self.db.get_cursor() as cursor:
+            cursor.execute(SQL_CATALOG_VERSION)
+            marks = cursor.fetchone()
+            cursor.execute(SQL_STOCK_CHANGES, (self._synced_at - STOCK_POLL_LAG,))
+            return marks, cursor.fetchall()
+
+    def _load(self):
+        # 同一个事务 (一致性快照) 里读版本号和商品，保证二者对应
+        with self.db.transaction() as cursor:
+            cursor.execute(SQL_CATALOG_VERSION)
+            marks = cursor.fetchone()
+            cursor.execute(SQL_ALL_PRODUCTS)
+            rows = cursor.fetchall()
+        self._install(marks, rows)
+
+    def _install(self, marks, rows):
+        """用整份商品数据替换缓存"""
+        self.by_id = {r.id: r for r in map(ProductRecord, rows)}
+        self._reindex()
+        self.version = marks['version']
+        self._synced_at = marks['now']
+
+    def _merge_poll(self, marks, stock_rows):
+        """
+        合并一次轮询的结果 (库存是绝对值，重复合并也没关系)
+        :return: False 表示版本号变了，需要整体重新加载
+        """
+        if marks['version'] != self.version:
+            return False
+        self._set_stocks((row['id'], row['stock']) for row in stock_rows)
+        self._synced_at = marks['now']
+        return True
+
+    def _set_stocks(self, stocks):
+        for p_id, stock in stocks:
+            record = self.by_id.get(p_id)
+            if record is not None and record.stock != stock:
+                self.by_id[p_id] = record.replace(stock=stock)
+
+    def _reindex(self):
+        self._ids = sorted(self.by_id)
+        self.by_barcode = {r.barcode: r.id for r in self.by_id.values() if r.barcode}
+        self.by_category = {}
+        for p_id in self._ids:
+            self.by_category.setdefault(self.by_id[p_id].category, []).append(p_id)
+        self._by_expire = sorted((r.expire_date, r.id) for r in self.by_id.values() if r.expire_date)
+        self.search_index.rebuild((r.id, r.name, r.category) for r in self.by_id.values())
+
+    def _put(self, record):
+        """增量加入/替换一条记录，各索引同步更新"""
+        self._drop(record.id)
+        self.by_id[record.id] = record
+        bisect.insort(self._ids, record.id)
+        if record.barcode:
+            self.by_barcode[record.barcode] = record.id
+        bisect.insort(self.by_category.setdefault(record.category, []), record.id)
+        if record.expire_date:
+            bisect.insort(self._by_expire, (record.expire_date, record.id))
+        self.search_index.add(record.id, record.name, record.category)
+
+    def _drop(self, p_id):
+        record = self.by_id.pop(p_id, None)
+        if record is None:
+            return
+        self._ids.pop(bisect.bisect_left(self._ids, p_id))
+        if record.barcode:
+            self.by_barcode.pop(record.barcode, None)
+        siblings = self.by_category[record.category]
+        siblings.pop(bisect.bisect_left(siblings, p_id))
+        if not siblings:
+            del self.by_category[record.category]
+        if record.expire_date:
+            self._by_expire.pop(bisect.bisect_left(self._by_expire, (record.expire_date, p_id)))
+        self.search_index.remove(p_id)
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self.version is not None and (now - self._checked_at < self.CHECK_INTERVAL or not offline_queue.online()):
+            # 离线期间不去连数据库 (界面线程上每次都要等连接超时)，回放线程重新连上后再检查
+            self.hits += 1
+            return
+        try:
+            polled = self._poll() if self.version is not None else None
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            # 数据库不可用时继续用已有数据 (离线收银)，等下个周期再检查
+            self._checked_at = now
+            self.hits += 1
+            return
+        self._checked_at = now
+        if polled is not None and self._merge_poll(*polled):
+            self.hits += 1
+            return
+        self.misses += 1
+        self._load()
+        self._checked_at = time.monotonic()
+
+    def dump(self):
+        """当前缓存的整份商品和对应的 {'version', 'now'} (不检查是否过期)，给收银台客户端的本地缓存"""
+        with self._lock:
+            return {'version': self.version, 'now': self._synced_at}, list(self.by_id.values())
+
+    def invalidate(self):
+        """下次读取时重新加载"""
+        with self._lock:
+            self.version = None
+
+    def apply_change(self, product_id, row, new_version):
+        """
+        本机增删改商品后同步缓存和搜索索引
+        :param row: 商品最新数据，None 表示已删除
+        """
+        with self._lock:
+            if self.version is None or self.version != new_version - 1:
+                self.version = None
+                return
+            if row is None:
+                self._drop(int(product_id))
+            else:
+                self._put(ProductRecord(row))
+            self.version = new_version
+
+    def apply_stock(self, stocks):
+        """
+        本机结账 / 改单后直接写入缓存中的库存 (事务里读到的扣减后库存)
+        别的收银台同时改过的库存由下一次轮询带回
+        """
+        with self._lock:
+            self._set_stocks(stocks.items())
+
+    def deduct_offline(self, quantities):
+        """
+        离线结账后扣减缓存中的库存
+        订单补录到数据库后，以数据库里的库存为准 (由轮询带回)
+        """
+        with self._lock:
+            for p_id, qty in quantities.items():
+                record = self.by_id.get(p_id)
+                if record is not None:
+                    self.by_id[p_id] = record.replace(stock=record.stock - qty)
+
+    # ---------- 查询 ----------
+    def all(self, limit=None, after_key=None):
+        """按 id 倒序返回商品，after_key 为上一页最后一个 id"""
+        with self._lock:
+            self._ensure_fresh()
+            end = len(self._ids) if after_key is None else bisect.bisect_left(self._ids, int(after_key))
+            start = max(end - limit, 0) if limit else 0
+            return [self.by_id[p_id] for p_id in reversed(self._ids[start:end])]
+
+    def get_many(self, product_ids):
+        with self._lock:
+            self._ensure_fresh()
+            return self.peek_many(product_ids)
+
+    def peek_many(self, product_ids):
+        """只查缓存，不检查是否过期 (离线结账用，不访问数据库)"""
+        with self._lock:
+            return [self.by_id[int(p_id)] for p_id in product_ids if int(p_id) in self.by_id]
+
+    def get_by_barcode(self, barcode):
+        with self._lock:
+            self._ensure_fresh()
+            p_id = self.by_barcode.get(barcode)
+            return self.by_id[p_id] if p_id is not None else None
+
+    def expiring(self, until):
+        """临期日期 <= until 的商品，按日期升序"""
+        with self._lock:
+            self._ensure_fresh()
+            end = bisect.bisect_right(self._by_expire, (until, float('inf')))
+            return [self.by_id[p_id] for _, p_id in self._by_expire[:end]]
+
+    def low_stock(self):
+        with self._lock:
+            self._ensure_fresh()
+            return [self.by_id[p_id] for p_id in self._ids if self.by_id[p_id].stock < self.by_id[p_id].min_stock_alert]
+
+    def search(self, keyword, limit=None):
+        """按相关度返回匹配的商品 (支持拼音首字母)"""
+        with self._lock:
+            self._ensure_fresh()
+            return [self.by_id[p_id] for p_id in self.search_index.search(keyword, limit)]
+
+    def stats(self):
+        """缓存命中统计"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'version': self.version, 'size': len(self.by_id)}
+
+
+# 登录会话缓存 (进程内)
+sessions = SessionCache()
+
+# 进程内所有 ProductLogic / SalesLogic 共用一份商品缓存
+product_cache = ProductCache(DatabaseManager(DB_NAME))
+
+
+class MemberCache:
+    """
+    进程内会员目录 (手机号前缀 / 尾号联想)
+    首次使用时流式加载全部会员，之后最多每 REFRESH_INTERVAL 秒按 id 增量加载一次新注册的会员；
+    本机的注册和积分变动立即生效
+    """
+
+    REFRESH_INTERVAL = 5.0
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self.directory = MemberDirectory()
+        self._loaded = False
+        self._checked_at = 0.0
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded and (now - self._checked_at < self.REFRESH_INTERVAL or not offline_queue.online()):
+            return
+        try:
+            if not self._loaded:
+                self.directory.rebuild(self.db.stream(SQL_ALL_MEMBERS))
+                self._loaded = True
+            else:
+                for row in self.db.stream(SQL_NEW_MEMBERS, (self.directory.max_id,)):
+                    self.directory.put(*row)
+                    self.directory.max_id = row.id
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            # 数据库不可用时继续用已有数据，等下个周期再试
+        self._checked_at = now
+
+    def suggest(self, digits, limit=8):
+        with self._lock:
+            self._ensure_fresh()
+            return self.directory.suggest(digits, limit)
+
+    def get(self, phone):
+        with self._lock:
+            self._ensure_fresh()
+            return self.directory.get(phone)
+
+    def put(self, m_id, phone, name, points):
+        with self._lock:
+            self.directory.put(m_id, phone, name, points)
+
+    def add_points(self, m_id, delta):
+        with self._lock:
+            self.directory.add_points(m_id, delta)
+
+
+member_cache = MemberCache(DatabaseManager(DB_NAME))
+
+
+class OfflineQueue:
+    """
+    离线订单队列：本地日志 + 后台回放线程，首次使用时才打开日志文件
+    数据库连不上之后，后续结账直接走离线，直到回放线程重新连上数据库
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.journal = None
+        self.replayer = None
+
+    def _start(self):
+        with self._lock:
+            if self.replayer is None:
+                self.journal = OfflineJournal()
+                self.replayer = JournalReplayer(self.journal, SalesLogic().replay_offline_order,
+                                                retry_if=_is_replay_retryable)
+                self.replayer.start()
+        return self.replayer
+
+    def online(self):
+        return self.replayer is None or self.replayer.online
+
+    def went_offline(self, error):
+        replayer = self._start()
+        replayer.online = False
+        replayer.last_error = str(error)
+
+    def append(self, entry):
+        replayer = self._start()
+        self.journal.append(entry)
+        replayer.notify()
+
+    def status(self):
+        replayer = self.replayer
+        if replayer is None:
+            # 从没离线过：不为了查状态去建日志文件、起回放线程
+            return {PENDING: 0, APPLIED: 0, CONFLICT: 0, 'online': True, 'last_error': None}
+        status = self.journal.counts()
+        status['online'] = replayer.online
+        status['last_error'] = replayer.last_error
+        return status
+
+    def conflicts(self, limit=100):
+        return self.journal.conflicts(limit) if self.journal is not None else []
+
+
+offline_queue = OfflineQueue()
+
+
+class PointsMaterializer(threading.Thread):
+    """
+    积分折算线程：定期把未折算的积分流水按会员汇总，一个事务里加到 members.points 并标记为已折算
+    多个收银台都会启动本线程，用 GET_LOCK 保证同一时刻只有一个在折算，避免同一条流水被折算两次
+    """
+
+    LOCK_NAME = 'points_materialize'
+
+    def __init__(self, interval=POINTS_FOLD_INTERVAL, batch_size=POINTS_FOLD_BATCH):
+        super().__init__(name="points-materializer", daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.db = DatabaseManager(DB_NAME)
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._start_lock:
+            if not self.is_alive():
+                self.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                while self.fold() == self.batch_size:
+                    pass  # 积压较多时连续折算
+            except Exception:
+                pass  # 数据库不可用等，下个周期再试
+
+    def fold(self, batch_size=None):
+        """折算一批流水，返回折算条数；其他进程正在折算时直接返回 0"""
+        batch_size = batch_size or self.batch_size
+        # 锁要持有到事务提交之后，所以用另一条连接加锁
+        with self.db.get_cursor() as lock_cursor:
+            lock_cursor.execute("SELECT GET_LOCK(%s, 0) AS locked", (self.LOCK_NAME,))
+            if not lock_cursor.fetchone()['locked']:
+                return 0
+            try:
+                return run_transaction(self.db, lambda cursor: _fold_points(cursor, batch_size), 'materialize_points')
+            finally:
+                lock_cursor.execute("SELECT RELEASE_LOCK(%s)", (self.LOCK_NAME,))
+
+
+def _fold_points(cursor, batch_size):
+    # 流水只追加不修改，普通的一致性读即可，不加锁，不挡住结账写入新流水
+    cursor.execute(SQL_PENDING_POINTS, (batch_size,))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    deltas = {}
+    for row in rows:
+        deltas[row['member_id']] = deltas.get(row['member_id'], 0) + row['delta']
+
+    member_ids = sorted(deltas)
+    cases = " ".join(["WHEN %s THEN %s"] * len(member_ids))
+    case_params = []
+    for m_id in member_ids:
+        case_params += [m_id, deltas[m_id]]
+    id_marks = ", ".join(["%s"] * len(member_ids))
+    cursor.execute(f"UPDATE members SET points = points + CASE id {cases} END WHERE id IN ({id_marks})",
+                   case_params + member_ids)
+
+    ledger_ids = [row['id'] for row in rows]
+    cursor.execute(f"UPDATE points_ledger SET folded = 1 WHERE folded = 0 AND id IN "
+                   f"({', '.join(['%s'] * len(ledger_ids))})", ledger_ids)
+    if cursor.rowcount != len(ledger_ids):
+        raise Exception("积分流水已被其他进程折算")  # 回滚，不重复加分
+    return len(ledger_ids)
+
+
+points_materializer = PointsMaterializer()
+
 
 class AuthLogic:
     """
@@ -14,116 +843,113 @@ class AuthLogic:
     def login(self, username, password):
         """
         验证登录
+        每次都查一遍账号：会话未过期、且库里的密码哈希和当时一致时，只核对口令的 HMAC (交班、退出后再登录
+        不必再跑 scrypt)；否则校验密码哈希，成功后记下会话
+        :return: 用户信息字典 {'id', 'username', 'role'}，失败返回 None
         """
-        self.db.connect()
-        sql = "SELECT id, username, role FROM users WHERE username=%s AND password=%s"
         try:
-            self.db.cursor.execute(sql, (username, password))
-            user = self.db.cursor.fetchone()
-            return user  # 成功返回用户信息字典，失败返回 None
+            with self.db.get_cursor() as cursor:
+                cursor.execute("SELECT id, username, role, password FROM users WHERE username=%s", (username,))
+                row = cursor.fetchone()
+                if row is None:
+                    sessions.forget(username)
+                    burn_time(password)
+                    return None
+                stored = row.pop('password')
+                cached = sessions.login(username, password, stored)
+                if cached:
+                    return cached
+                ok, needs_rehash = verify_password(password, stored)
+                if not ok:
+                    return None
+                if needs_rehash:
+                    # 明文或旧成本参数的密码，登录成功时顺便升级
+                    stored = hash_password(password)
+                    cursor.execute("UPDATE users SET password=%s WHERE id=%s", (stored, row['id']))
         except Exception as e:
             print(f"[Login Error] {e}")
             return None
-        finally:
-            self.db.close()
+        sessions.remember(row, password, stored)
+        return row
 
 
 class ProductLogic:
     """
     负责商品增删查改
+    读操作走进程内缓存，写操作落库后让缓存失效
     """
 
     def __init__(self):
         self.db = DatabaseManager(DB_NAME)
-
-    def add_product(self, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date):
-
-        self.db.connect()
-        sql = """
-        INSERT INTO products (name, category, buy_price, sell_price, stock, min_stock_alert, expire_date)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        try:
-            success = self.db.execute_query(sql, (name, category, buy_price, sell_price, stock, min_stock_alert, expire_date))
-            return success
-        finally:
-            self.db.close()
+        self.cache = product_cache
+
+    def add_product(self, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date, barcode=None):
+        with self.db.transaction() as cursor:
+            cursor.execute(SQL_INSERT_PRODUCT, (name, category, buy_price, sell_price, stock, min_stock_alert, expire_date,
+                                 barcode or None))
+            product_id = cursor.lastrowid
+            row = self._read_row(cursor, product_id)
+            catalog_version = _bump_catalog_version(cursor)
+        self.cache.apply_change(product_id, row, catalog_version)
+        return True
 
     def delete_product(self, product_id):
         """删除商品"""
-        self.db.connect()
-        sql = "DELETE FROM products WHERE id=%s"
-        try:
-            return self.db.execute_query(sql, (product_id,))
-        finally:
-            self.db.close()
-
-    def update_product(self, product_id, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date):
-        self.db.connect()
-        sql = """
-        UPDATE products 
-        SET name=%s, category=%s, buy_price=%s, sell_price=%s, stock=%s, min_stock_alert=%s, expire_date=%s
-        WHERE id=%s
+        with self.db.transaction() as cursor:
+            cursor.execute(SQL_DELETE_PRODUCT, (product_id,))
+            catalog_version = _bump_catalog_version(cursor)
+        self.cache.apply_change(product_id, None, catalog_version)
+        return True
+
+    def update_product(self, product_id, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date,
+                       barcode=None):
+        with self.db.transaction() as cursor:
+            cursor.execute(SQL_UPDATE_PRODUCT, (name, category, buy_price, sell_price, stock, min_stock_alert, expire_date,
+                                 barcode or None, product_id))
+            row = self._read_row(cursor, product_id)
+            catalog_version = _bump_catalog_version(cursor)
+        self.cache.apply_change(product_id, row, catalog_version)
+        return True
+
+    @staticmethod
+    def _read_row(cursor, product_id):
+        """事务内读回商品最新数据 (含数据库默认值)，用于同步缓存"""
+        cursor.execute(SQL_PRODUCT_ROW, (product_id,))
+        return cursor.fetchone()
+
+    def get_all_products(self, limit=None, after_key=None):
         """
-        try:
-            return self.db.execute_query(sql, (name, category, buy_price, sell_price, stock, min_stock_alert, expire_date, product_id))
-        finally:
-            self.db.close()
+        获取所有商品 (按 id 倒序)
+        :param limit: 每页条数，None 表示不分页
+        :param after_key: 上一页最后一行的 id，键集分页
+        """
+        return self.cache.all(limit, after_key)
 
-    def get_all_products(self):
-        """获取所有商品"""
-        self.db.connect()
-        try:
-            self.db.cursor.execute("SELECT * FROM products ORDER BY id DESC")
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+    def get_products_by_ids(self, product_ids):
+        """按 id 批量获取商品"""
+        return self.cache.get_many(product_ids)
+
+    def get_by_barcode(self, barcode):
+        """扫码查商品 (内存哈希表，O(1))，找不到返回 None"""
+        return self.cache.get_by_barcode(barcode.strip())
 
     def get_expiring_products(self, days=7):
         """查询即将过期（包含已经过期）的商品"""
-        self.db.connect()
-        sql = """
-        SELECT * FROM products 
-        WHERE expire_date IS NOT NULL 
-        AND expire_date <= DATE_ADD(CURDATE(), INTERVAL %s DAY)
-        ORDER BY expire_date ASC
-        """
-        try:
-            self.db.cursor.execute(sql, (days,))
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+        return self.cache.expiring(date.today() + timedelta(days=days))
 
     def search_products(self, keyword):
         """
         搜索功能
         """
-        self.db.connect()
-
-        sql = """
-        SELECT * FROM products 
-        WHERE 
-            name LIKE %s 
-            OR category LIKE %s 
-        """
-
-        pattern = f"%{keyword}%"
-
-        try:
-            self.db.cursor.execute(sql, (pattern, pattern))
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+        return self.cache.search(keyword)
 
     def get_low_stock_products(self):
         """获取低库存预警列表"""
-        self.db.connect()
-        sql = "SELECT * FROM products WHERE stock < min_stock_alert"
-        try:
-            self.db.cursor.execute(sql)
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+        return self.cache.low_stock()
+
+    def get_cache_stats(self):
+        """商品缓存命中统计"""
+        return self.cache.stats()
 
 class UserLogic:
     """负责用户/员工管理"""
@@ -133,186 +959,368 @@ class UserLogic:
 
     def get_all_clerks(self):
         """获取所有售货员"""
-        self.db.connect()
-        try:
+        with self.db.get_cursor() as cursor:
             # 只获取售货员，不显示管理员
-            self.db.cursor.execute("SELECT id, username, role, created_at FROM users WHERE role='Clerk'")
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+            cursor.execute("SELECT id, username, role, created_at FROM users WHERE role='Clerk'")
+            return cursor.fetchall()
 
     def add_clerk(self, username, password):
-        """添加新售货员"""
-        self.db.connect()
-        try:
-            sql = "INSERT INTO users (username, password, role) VALUES (%s, %s, 'Clerk')"
-            return self.db.execute_query(sql, (username, password))
-        finally:
-            self.db.close()
+        """添加新售货员 (密码只保存哈希)"""
+        sql = "INSERT INTO users (username, password, role) VALUES (%s, %s, 'Clerk')"
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql, (username, hash_password(password)))
+            return True
 
     def delete_user(self, user_id):
         """删除用户"""
-        self.db.connect()
         try:
-            self.db.cursor.execute("DELETE FROM users WHERE id=%s", (user_id,))
+            with self.db.get_cursor() as cursor:
+                cursor.execute("DELETE FROM users WHERE id=%s", (user_id,))
+            sessions.forget(user_id=user_id)
             return True, "删除成功"
         except pymysql.Error as e:
 
             if e.args[0] == 1451:
                 return False, "删除失败：该员工已处理过订单，\n数据库存在关联记录，无法物理删除！"
             return False, f"数据库错误: {e}"
-        finally:
-            self.db.close()
+
+class Cart:
+    """
+    收银台购物车
+    按商品 id 存放，加购 / 移除 / 改数量 / 撤销都是 O(1)，合计金额用 Decimal 增量维护
+    """
+
+    def __init__(self):
+        self._lines = {}  # 商品 id -> 行 (dict 保持加入顺序)
+        self._undo = []  # [(商品 id, 修改前的行副本或 None)]
+        self.total = Decimal('0')
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self):
+        return iter(self._lines.values())
+
+    def __contains__(self, p_id):
+        return int(p_id) in self._lines
+
+    def get(self, p_id):
+        return self._lines.get(int(p_id))
+
+    # ---------- 修改 ----------
+    def _put(self, p_id, line):
+        """写入/删除一行并维护合计 (line 为 None 表示删除)"""
+        old = self._lines.get(p_id)
+        if old is not None:
+            self.total -= old['total']
+        if line is None:
+            self._lines.pop(p_id, None)
+        else:
+            line['total'] = line['sell_price'] * line['buy_qty']
+            self._lines[p_id] = line
+            self.total += line['total']
+
+    def _remember(self, p_id):
+        old = self._lines.get(p_id)
+        self._undo.append((p_id, dict(old) if old is not None else None))
+
+    def add(self, p_id, name, price, qty=1, max_stock=None):
+        """加购，已在购物车里的商品累加数量；超出库存抛 ValueError"""
+        p_id = int(p_id)
+        old = self._lines.get(p_id)
+        new_qty = (old['buy_qty'] if old else 0) + int(qty)
+        if max_stock is not None and new_qty > max_stock:
+            raise ValueError(f"库存不足！最多只能购买 {max_stock} 件")
+        self._remember(p_id)
+        if old:
+            line = dict(old, buy_qty=new_qty)
+        else:
+            line = {'id': p_id, 'name': name, 'sell_price': Decimal(str(price)),
+                    'buy_qty': new_qty, 'max_stock': max_stock}
+        self._put(p_id, line)
+        return line
+
+    def set_qty(self, p_id, qty):
+        """修改数量，0 表示移除"""
+        p_id = int(p_id)
+        old = self._lines.get(p_id)
+        if old is None:
+            raise KeyError(p_id)
+        qty = int(qty)
+        if qty <= 0:
+            return self.remove(p_id)
+        if old['max_stock'] is not None and qty > old['max_stock']:
+            raise ValueError(f"库存不足！最多只能购买 {old['max_stock']} 件")
+        self._remember(p_id)
+        self._put(p_id, dict(old, buy_qty=qty))
+
+    def remove(self, p_id):
+        p_id = int(p_id)
+        if p_id in self._lines:
+            self._remember(p_id)
+            self._put(p_id, None)
+
+    def undo(self):
+        """撤销上一步操作，返回受影响的商品 id，没有可撤销的返回 None"""
+        if not self._undo:
+            return None
+        p_id, previous = self._undo.pop()
+        self._put(p_id, previous)
+        return p_id
+
+    def clear(self):
+        self._lines = {}
+        self._undo = []
+        self.total = Decimal('0')
+
+    # ---------- 结账 ----------
+    def to_checkout_items(self):
+        """SalesLogic.checkout 需要的批量数据 (每个商品一行，数量已合并)"""
+        return [dict(line) for line in self._lines.values()]
+
 
 class SalesLogic:
     def __init__(self):
         self.db = DatabaseManager(DB_NAME)
+        self.hot_ids = HOT_PRODUCT_IDS
+        # 店长看板的增量统计状态 (见 get_dashboard_stats)
+        self.stats = SalesAggregator()
+        self._stats_lock = threading.Lock()
 
     def checkout(self, clerk_id, cart_items, member_id=None):
         """
         处理结账事务
         :param clerk_id: 收银员ID
-        :param cart_items: 购物车列表
+        :param cart_items: 购物车列表，或 Cart 对象
         :param member_id: 会员ID (新增参数，默认为None)
         """
+        if isinstance(cart_items, Cart):
+            cart_items = cart_items.to_checkout_items()
         if not cart_items:
             #如果失败也需要返回3个值 (False, 消息, None)
             return False, "购物车为空", None
 
-        # 生成唯一订单号 (时间戳)
-        order_id = time.strftime('%Y%m%d%H%M%S')
-
-        self.db.connect()
-        conn = self.db.conn
-        cursor = self.db.cursor
-        try:
-            conn.begin()
-            total_amount = 0
-
-            for item in cart_items:
-                p_id = item['id']
-                buy_qty = int(item['buy_qty'])
-
-                # 获取当前库存和进价 (悲观锁)
-                cursor.execute("SELECT name, stock, buy_price, sell_price FROM products WHERE id=%s FOR UPDATE",
-                               (p_id,))
-                product = cursor.fetchone()
-
-                if not product or product['stock'] < buy_qty:
-                    raise Exception(f"商品 {product['name']} 库存不足")
-
-                # 扣库存
-                cursor.execute("UPDATE products SET stock = stock - %s WHERE id=%s", (buy_qty, p_id))
-
-                # 插入销售记录
-                item_total = float(product['sell_price']) * buy_qty
-
-
-                sql = """
-                INSERT INTO sales (order_id, product_id, user_id, quantity, buy_price_snapshot, sell_price_snapshot, total_price, sale_time)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
-                """
-                cursor.execute(sql, (
-                order_id, p_id, clerk_id, buy_qty, product['buy_price'], product['sell_price'], item_total))
-
-                total_amount += item_total
-
-            # --- 积分逻辑 ---
-            points_added = 0
-            if member_id:
-                # 1元 = 1分
-                points_added = int(total_amount)
-                cursor.execute("UPDATE members SET points = points + %s WHERE id=%s", (points_added, member_id))
-
-            conn.commit()
-
-            # 构建成功消息
-            msg = f"结账成功! 订单号:{order_id} 总额:¥{total_amount:.2f}"
-            if member_id:
-                msg += f"\n会员积分 +{points_added}"
-
-            # 构建小票数据字典
-            receipt_data = {
-                "order_id": order_id,
-                "items": cart_items,
-                "total": total_amount,
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "member_points": points_added
-            }
-
-            return True, msg, receipt_data
-
-        except Exception as e:
-            conn.rollback()
-            return False, str(e), None
-        finally:
-            self.db.close()
+        # 生成唯一订单号 (时间戳 + 收银台 + 进程 + 序号)
+        order_id = next_order_id()
+        sale_time = datetime.now().replace(microsecond=0)
+
+        # 同一商品合并数量，按 id 排序，保证所有收银台加锁顺序一致
+        quantities = _merge_quantities(cart_items)
+        product_ids = sorted(quantities)
+        hot_ids = self.hot_ids.intersection(product_ids)
+
+        def write(cursor):
+            # 1. 一条语句按 id 顺序锁住购物车里的所有普通商品 (悲观锁)，热门商品不加锁
+            products = _load_products(cursor, product_ids, hot_ids)
+
+            # 2. 扣库存、写销售记录、汇总表、积分
+            lines = _checkout_lines(products, quantities, hot_ids)
+            total_amount, points_added = _write_order(cursor, order_id, clerk_id, member_id, sale_time,
+                                                      lines, hot_ids)
+
+            # 3. 热门商品最后按条件扣库存，行锁只持有到提交
+            stocks = _deduct_hot_stock(cursor, products, quantities, hot_ids)
+            stocks.update((p_id, products[p_id]['stock'] - quantities[p_id])
+                          for p_id in product_ids if p_id not in hot_ids)
+            return total_amount, points_added, stocks
+
+        queued = CHECKOUT_MODE == 'queued' or not offline_queue.online()
+        if not queued:
+            try:
+                total_amount, points_added, stocks = run_transaction(self.db, write, 'checkout')
+            except Exception as e:
+                if not _is_connection_error(e):
+                    return False, str(e), None
+                # 数据库连不上：转为离线结账
+                offline_queue.went_offline(e)
+                queued = True
+            else:
+                product_cache.apply_stock(stocks)
+
+        if queued:
+            try:
+                total_amount, points_added = self._checkout_offline(
+                    order_id, clerk_id, member_id, sale_time, quantities)
+            except Exception as e:
+                return False, str(e), None
+
+        if member_id and points_added:
+            member_cache.add_points(member_id, points_added)
+        msg, receipt_data = _checkout_result(order_id, cart_items, total_amount, points_added, member_id,
+                                             sale_time, queued)
+        return True, msg, receipt_data
+
+    def _checkout_offline(self, order_id, clerk_id, member_id, sale_time, quantities):
+        """
+        离线结账：按缓存中的价格和库存结算，订单写入本地日志后立即返回
+        :return: (订单总额, 预计新增积分)
+        """
+        products = {r.id: r for r in product_cache.peek_many(quantities)}
+        total_amount = Decimal('0')
+        items = []
+        for p_id, _, qty, buy_price, sell_price in _checkout_lines(products, quantities):
+            total_amount += sell_price * qty
+            items.append({'id': p_id, 'name': products[p_id].name, 'category': products[p_id].category, 'qty': qty,
+                          'buy_price': str(buy_price), 'sell_price': str(sell_price)})
+
+        offline_queue.append({
+            'order_id': order_id,
+            'clerk_id': clerk_id,
+            'member_id': member_id,
+            'sale_time': sale_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'items': items,
+        })
+        product_cache.deduct_offline(quantities)
+        return total_amount, int(total_amount) if member_id else 0
+
+    def replay_offline_order(self, entry):
+        """
+        把一笔离线订单补录到数据库 (幂等：订单号已存在则跳过)
+        允许库存扣成负数 (货已经卖出去了)，此时返回冲突说明交给店长核对
+        :return: 冲突说明列表
+        """
+        order_id = entry['order_id']
+        sale_time = datetime.strptime(entry['sale_time'], "%Y-%m-%d %H:%M:%S")
+        quantities = {int(item['id']): int(item['qty']) for item in entry['items']}
+        product_ids = sorted(quantities)
+        prices = {int(item['id']): (Decimal(item['buy_price']), Decimal(item['sell_price'])) for item in entry['items']}
+        names = {int(item['id']): item['name'] for item in entry['items']}
+        categories = {int(item['id']): item.get('category') for item in entry['items']}  # 旧版日志没有分类
+
+        def write(cursor):
+            cursor.execute(SQL_ORDER_EXISTS, (order_id,))
+            if cursor.fetchone():
+                return []  # 之前已补录过 (例如补录后、标记前进程退出)
+
+            products = _load_products(cursor, product_ids)
+            conflicts = []
+            lines = []
+            for p_id in product_ids:
+                product = products.get(p_id)
+                if product is None:
+                    conflicts.append(f"商品 {names[p_id]} 已被删除，未补录")
+                    continue
+                if product['stock'] < quantities[p_id]:
+                    conflicts.append(f"商品 {product['name']} 库存不足，补录后库存为 "
+                                     f"{product['stock'] - quantities[p_id]}")
+                lines.append((p_id, categories[p_id] or product['category'], quantities[p_id]) + prices[p_id])
+
+            if lines:
+                _write_order(cursor, order_id, entry['clerk_id'], entry.get('member_id'), sale_time, lines)
+            return conflicts
+
+        return run_transaction(self.db, write, 'replay_offline_order')
+
+    def get_offline_status(self):
+        """离线日志状态：{'online', 'pending', 'applied', 'conflict', 'last_error'}"""
+        return offline_queue.status()
+
+    def get_offline_conflicts(self, limit=100):
+        return offline_queue.conflicts(limit)
 
     def get_sales_report(self):
         """
-        获取销售报表 (按商品分组统计)
+        获取销售报表 (按商品分组统计，读汇总表)
         """
-        self.db.connect()
         sql = """
-        SELECT p.name, SUM(s.quantity) as total_qty, SUM(s.total_price) as total_revenue 
-        FROM sales s
-        JOIN products p ON s.product_id = p.id
+        SELECT p.name, SUM(r.qty) as total_qty, SUM(r.revenue) as total_revenue
+        FROM sales_daily_product r
+        JOIN products p ON r.product_id = p.id
         GROUP BY p.id, p.name
         ORDER BY total_revenue DESC
         """
-        try:
-            self.db.cursor.execute(sql)
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchall()
 
     # --- 查询订单 ---
-    def get_all_orders(self, clerk_id=None):
-        """店长看所有，店员看自己"""
-        self.db.connect()
+    @staticmethod
+    def _orders_query(clerk_id=None, limit=None, after_key=None):
         sql = """
-        SELECT s.id, s.order_id, p.name as product_name, u.username as clerk_name, 
+        SELECT s.id, s.order_id, p.name as product_name, u.username as clerk_name,
                s.quantity, s.total_price, s.sale_time, s.buy_price_snapshot
         FROM sales s
         JOIN products p ON s.product_id = p.id
         JOIN users u ON s.user_id = u.id
         """
+        conditions = []
         params = []
         if clerk_id:
-            sql += " WHERE s.user_id = %s"
+            conditions.append("s.user_id = %s")
             params.append(clerk_id)
-
-        sql += " ORDER BY s.sale_time DESC"
-        try:
-            self.db.cursor.execute(sql, params)
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+        if after_key is not None:
+            last_time, last_id = after_key
+            conditions.append("(s.sale_time < %s OR (s.sale_time = %s AND s.id < %s))")
+            params += [last_time, last_time, last_id]
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        sql += " ORDER BY s.sale_time DESC, s.id DESC"
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    def get_all_orders(self, clerk_id=None, limit=None, after_key=None):
+        """
+        店长看所有，店员看自己 (按时间倒序)
+        :param limit: 每页条数，None 表示不分页
+        :param after_key: 上一页最后一行的 (sale_time, id)，键集分页
+        """
+        sql, params = self._orders_query(clerk_id, limit, after_key)
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def iter_orders(self, clerk_id=None, after_key=None):
+        """get_all_orders 的流式版本：逐行产出具名元组，不把全部订单读进内存 (导出、全量统计用)"""
+        sql, params = self._orders_query(clerk_id, None, after_key)
+        return self.db.stream(sql, params)
+
+    def iter_sales(self, start=None, end=None):
+        """流式读取 [start, end) 区间内的销售流水 (按 id 顺序)，逐行产出具名元组"""
+        sql = """
+        SELECT id, order_id, product_id, user_id, member_id, quantity,
+               buy_price_snapshot, sell_price_snapshot, total_price, sale_time
+        FROM sales
+        """
+        conditions = []
+        params = []
+        if start:
+            conditions.append("sale_time >= %s")
+            params.append(start)
+        if end:
+            conditions.append("sale_time < %s")
+            params.append(end)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        return self.db.stream(sql, params)
 
     # --- 修改订单 (店员权限) ---
     def modify_order_qty(self, sale_id, new_qty, operator_id):
         """修改单个销售记录的数量"""
-        self.db.connect()
-        conn = self.db.conn
-        cursor = self.db.cursor
-        try:
-            conn.begin()
+        def write(cursor):
+            # 1. 先查出商品 (销售记录的商品不会变，不需要加锁)，
+            #    再按 "商品 -> 销售记录" 的顺序加锁，与结账的加锁顺序一致，避免互相死锁
+            cursor.execute("SELECT product_id FROM sales WHERE id=%s", (sale_id,))
+            sale_rec = cursor.fetchone()
+            if not sale_rec: raise Exception("订单不存在")
+            p_id = sale_rec['product_id']
 
-            # 1. 获取原订单信息
+            cursor.execute("SELECT stock, category FROM products WHERE id=%s FOR UPDATE", (p_id,))
+            product = cursor.fetchone()
             cursor.execute("SELECT * FROM sales WHERE id=%s FOR UPDATE", (sale_id,))
             sale_rec = cursor.fetchone()
-            if not sale_rec: raise Exception("订单不存在")
 
             old_qty = sale_rec['quantity']
-            p_id = sale_rec['product_id']
             diff = new_qty - old_qty  # 正数代表多买，负数代表退货
 
-            if diff == 0: return True, "数量未变更"
+            if diff == 0: return None
 
             # 2. 检查并更新库存
             # 如果是增加购买量，要检查库存；如果是减少，直接加回库存
-            cursor.execute("SELECT stock FROM products WHERE id=%s FOR UPDATE", (p_id,))
-            current_stock = cursor.fetchone()['stock']
+            current_stock = product['stock']
 
             if diff > 0 and current_stock < diff:
                 raise Exception("修改失败：库存不足")
@@ -320,145 +1328,207 @@ class SalesLogic:
             cursor.execute("UPDATE products SET stock = stock - %s WHERE id=%s", (diff, p_id))
 
             # 3. 更新销售记录
-            new_total = float(sale_rec['sell_price_snapshot']) * new_qty
+            new_total = sale_rec['sell_price_snapshot'] * new_qty
             cursor.execute("UPDATE sales SET quantity=%s, total_price=%s WHERE id=%s", (new_qty, new_total, sale_id))
 
-            # 4. 记录操作日志
+            # 汇总表记在原销售时间、原分类的桶里
+            unit_profit = sale_rec['sell_price_snapshot'] - sale_rec['buy_price_snapshot']
+            category = sale_rec['category_snapshot'] or product['category']  # 与 ROLLUP_SOURCES 的口径一致
+            _apply_rollups(cursor, [(sale_rec['sale_time'], p_id, category, diff,
+                                     new_total - sale_rec['total_price'], unit_profit * diff)])
+
+            # 4. 记录操作日志 (改前 / 改后数量供看板增量修正统计)
             log_msg = f"将数量从 {old_qty} 修改为 {new_qty}"
             cursor.execute(
-                "INSERT INTO modification_logs (sale_id, operator_id, action_type, details) VALUES (%s, %s, 'MODIFY', %s)",
-                (sale_id, operator_id, log_msg))
+                "INSERT INTO modification_logs (sale_id, operator_id, action_type, details, old_qty, new_qty) "
+                "VALUES (%s, %s, 'MODIFY', %s, %s, %s)",
+                (sale_id, operator_id, log_msg, old_qty, new_qty))
+
+            return {p_id: current_stock - diff}
 
-            conn.commit()
+        try:
+            changed = run_transaction(self.db, write, 'modify_order_qty')
+            if changed is None:
+                return True, "数量未变更"
+            product_cache.apply_stock(changed)
             return True, "修改成功"
         except Exception as e:
-            conn.rollback()
             return False, str(e)
-        finally:
-            self.db.close()
+
+    def get_tx_metrics(self):
+        """各类事务的提交 / 死锁 / 锁等待超时 / 重做次数"""
+        return TX_METRICS.snapshot()
 
     # --- 数据统计 (店长权限) ---
+    def get_dashboard_stats(self, granularity=5, top_n=5):
+        """
+        店长看板数据 (总销售额 / 利润、热销排行、分类占比、今日走势)
+        第一次全量读汇总表，之后只读上次之后的新流水和改单记录，在内存里累加差额
+        """
+        if granularity not in SALES_GRANULARITIES:
+            raise ValueError(f"不支持的统计粒度: {granularity} 分钟")
+        with self._stats_lock:
+            agg = self.stats
+            with self.db.snapshot() as cursor:
+                if agg.needs_reload:
+                    self._load_stats(cursor, agg)
+                else:
+                    sales = []
+                    if agg.gaps:
+                        gap_ids = sorted(agg.gaps)
+                        cursor.execute(SQL_STATS_GAP_SALES.format(marks=', '.join(['%s'] * len(gap_ids))), gap_ids)
+                        sales += cursor.fetchall()
+                    cursor.execute(SQL_STATS_NEW_SALES, (agg.sales_hw,))
+                    sales += cursor.fetchall()
+                    logs = []
+                    if agg.log_gaps:
+                        gap_ids = sorted(agg.log_gaps)
+                        cursor.execute(SQL_STATS_GAP_LOGS.format(marks=', '.join(['%s'] * len(gap_ids))), gap_ids)
+                        logs += cursor.fetchall()
+                    cursor.execute(SQL_STATS_NEW_LOGS, (agg.log_hw,))
+                    logs += cursor.fetchall()
+                    agg.fold(sales, logs)
+            if agg.needs_reload:  # 遇到旧版本写的改单日志
+                with self.db.snapshot() as cursor:
+                    self._load_stats(cursor, agg)
+            products = {r.id: r for r in product_cache.all()}
+            return agg.snapshot(products, granularity, top_n)
+
+    @staticmethod
+    def _load_stats(cursor, agg):
+        """全量初始化：商品 / 分类汇总表 + 今日流水按分钟，与高水位取自同一快照"""
+        cursor.execute(SQL_STATS_HIGH_WATER)
+        marks = cursor.fetchone()
+        sales_hw = marks['sales_hw']
+        cursor.execute(SQL_STATS_BY_PRODUCT)
+        products = [(r['product_id'], r['qty'], r['revenue'], r['profit']) for r in cursor.fetchall()]
+        cursor.execute(SQL_STATS_BY_CATEGORY)
+        categories = [(r['category'], r['revenue']) for r in cursor.fetchall()]
+        today = date.today()
+        day_start = datetime.combine(today, datetime.min.time())
+        cursor.execute(SQL_STATS_MINUTES, (day_start, day_start + timedelta(days=1), sales_hw))
+        minutes = [(r['m'], r['total']) for r in cursor.fetchall()]
+        scan_from = max(sales_hw - STATS_GAP_SCAN, 0)
+        cursor.execute(SQL_STATS_RECENT_IDS, (scan_from, sales_hw))
+        recent_ids = [r['id'] for r in cursor.fetchall()]
+        log_hw = marks['log_hw']
+        log_scan_from = max(log_hw - STATS_GAP_SCAN, 0)
+        cursor.execute(SQL_STATS_RECENT_LOG_IDS, (log_scan_from, log_hw))
+        recent_log_ids = [r['id'] for r in cursor.fetchall()]
+        agg.load(products, categories, minutes, sales_hw, log_hw, recent_ids, today, scan_from,
+                 recent_log_ids=recent_log_ids, log_scan_from=log_scan_from)
+
     def get_profit_stats(self):
-        """计算总销售额、总净利润"""
-        self.db.connect()
-        # 利润 = (售价快照 - 进价快照) * 数量
+        """计算总销售额、总净利润 (读每日汇总表)"""
+        # 利润 = (售价快照 - 进价快照) * 数量，结账时已累加进汇总表
         sql = """
-        SELECT 
-            SUM(total_price) as total_revenue,
-            SUM((sell_price_snapshot - buy_price_snapshot) * quantity) as total_profit
-        FROM sales
+        SELECT
+            SUM(revenue) as total_revenue,
+            SUM(profit) as total_profit
+        FROM sales_daily_store
         """
-        try:
-            self.db.cursor.execute(sql)
-            res = self.db.cursor.fetchone()
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql)
+            res = cursor.fetchone()
             return res if res['total_revenue'] else {'total_revenue': 0, 'total_profit': 0}
-        finally:
-            self.db.close()
 
     def get_category_pie_data(self):
-        """获取分类销售占比"""
-        self.db.connect()
+        """获取分类销售占比 (读分类汇总表)"""
         sql = """
-        SELECT p.category, SUM(s.total_price) as value
-        FROM sales s
-        JOIN products p ON s.product_id = p.id
-        GROUP BY p.category
+        SELECT category, SUM(revenue) as value
+        FROM sales_hourly_category
+        GROUP BY category
         """
-        try:
-            self.db.cursor.execute(sql)
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchall()
 
     def get_top_selling_products(self, limit=5):
-        """热销排行榜"""
-        self.db.connect()
+        """热销排行榜 (读商品汇总表)"""
         sql = """
-        SELECT p.name, SUM(s.quantity) as total_qty
-        FROM sales s
-        JOIN products p ON s.product_id = p.id
+        SELECT p.name, SUM(r.qty) as total_qty
+        FROM sales_daily_product r
+        JOIN products p ON r.product_id = p.id
         GROUP BY p.id, p.name
         ORDER BY total_qty DESC
         LIMIT %s
         """
-        try:
-            self.db.cursor.execute(sql, (limit,))
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
-
-    def get_modification_logs(self):
-        """获取修改记录"""
-        self.db.connect()
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql, (limit,))
+            return cursor.fetchall()
+
+    @staticmethod
+    def _logs_query(limit=None, after_key=None):
         sql = """
-        SELECT l.log_time, u.username as operator, p.name as product, l.details, s.order_id
+        SELECT l.id, l.log_time, u.username as operator, p.name as product, l.details, s.order_id
         FROM modification_logs l
         JOIN users u ON l.operator_id = u.id
         JOIN sales s ON l.sale_id = s.id
         JOIN products p ON s.product_id = p.id
-        ORDER BY l.log_time DESC
         """
-        try:
-            self.db.cursor.execute(sql)
-            return self.db.cursor.fetchall()
-        finally:
-            self.db.close()
-
-    def get_hourly_sales_stats(self):
-        """获取24小时销售趋势数据 (0-23点)"""
-        self.db.connect()
-        # 提取 sale_time 的小时部分 (HOUR函数) 进行分组求和
-        sql = """
-        SELECT HOUR(sale_time) as h, SUM(total_price) as total
-        FROM sales
-        GROUP BY h
-        ORDER BY h ASC
+        params = []
+        if after_key is not None:
+            last_time, last_id = after_key
+            sql += " WHERE (l.log_time < %s OR (l.log_time = %s AND l.id < %s))"
+            params += [last_time, last_time, last_id]
+        sql += " ORDER BY l.log_time DESC, l.id DESC"
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    def get_modification_logs(self, limit=None, after_key=None):
         """
-        try:
-            self.db.cursor.execute(sql)
-            data = self.db.cursor.fetchall()
-
-            # 数据清洗：确保 0-23 小时都有数据，没有的补 0
-            # 转成字典方便查询 {8: 100.0, 9: 200.0 ...}
-            data_dict = {item['h']: float(item['total']) for item in data}
+        获取修改记录 (按时间倒序)
+        :param limit: 每页条数，None 表示不分页
+        :param after_key: 上一页最后一行的 (log_time, id)，键集分页
+        """
+        sql, params = self._logs_query(limit, after_key)
+        with self.db.get_cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
 
-            hours = list(range(24))  # 0到23
-            totals = [data_dict.get(h, 0.0) for h in hours]  # 如果该小时没数据，填0
+    def iter_modification_logs(self, after_key=None):
+        """get_modification_logs 的流式版本，逐行产出具名元组"""
+        sql, params = self._logs_query(None, after_key)
+        return self.db.stream(sql, params)
 
-            return hours, totals
-        finally:
-            self.db.close()
+    def get_hourly_sales_stats(self, start=None, end=None):
+        """获取 [start, end) 区间内按小时分桶的销售趋势，默认今天 0-23 点"""
+        return self._get_sales_buckets(start, end, 60)
 
-    def get_minute_sales_stats(self):
-        """获取今日分钟级销售趋势"""
-        self.db.connect()
+    def get_minute_sales_stats(self, start=None, end=None, granularity=1):
+        """获取 [start, end) 区间内分钟级销售趋势，默认今天"""
+        return self._get_sales_buckets(start, end, granularity)
 
-        sql = """
-        SELECT HOUR(sale_time) as h, MINUTE(sale_time) as m, SUM(total_price) as total
-        FROM sales
-        WHERE DATE(sale_time) = CURDATE()
-        GROUP BY h, m
-        ORDER BY h ASC, m ASC
+    def _get_sales_buckets(self, start, end, granularity):
         """
-        try:
-            self.db.cursor.execute(sql)
-            data = self.db.cursor.fetchall()
+        按 granularity 分钟分桶统计销售额
+        WHERE 直接比较 sale_time 原始列，可以走 idx_sales_time 索引
+        :return: (每个桶的起始时间列表, 每个桶的销售额列表)，没有数据的桶补 0
+        """
+        if granularity not in SALES_GRANULARITIES:
+            raise ValueError(f"不支持的统计粒度: {granularity} 分钟")
+        if start is None or end is None:
+            today = datetime.combine(date.today(), datetime.min.time())
+            start = start or today
+            end = end or today + timedelta(days=1)
+        if end <= start:
+            return [], []
 
-            if not data:
-                return [], []
+        step = timedelta(minutes=granularity)
+        bucket_count = -(-(end - start) // step)  # 向上取整
 
-            times = []
-            totals = []
+        with self.db.get_cursor() as cursor:
+            cursor.execute(SQL_SALES_BUCKETS, (start, granularity * 60, start, end))
+            data = cursor.fetchall()
 
-            for item in data:
-                # :02d 表示不足两位补0
-                time_str = f"{item['h']:02d}:{item['m']:02d}"
-                times.append(time_str)
-                totals.append(float(item['total']))
+        buckets = [start + step * i for i in range(bucket_count)]
+        totals = [0.0] * bucket_count
+        for item in data:
+            totals[int(item['b'])] = float(item['total'])
 
-            return times, totals
-        finally:
-            self.db.close()
+        return buckets, totals
 
 class MemberLogic:
     """
@@ -468,30 +1538,51 @@ class MemberLogic:
         self.db = DatabaseManager(DB_NAME)
 
     def get_member_by_phone(self, phone):
-        """根据手机号查找会员"""
-        self.db.connect()
+        """
+        根据手机号查找会员
+        积分可能被其他收银台改过，以数据库为准；数据库连不上时用会员目录里的数据
+        """
+        if not offline_queue.online():
+            return member_cache.get(phone)
         try:
-            self.db.cursor.execute("SELECT * FROM members WHERE phone=%s", (phone,))
-            return self.db.cursor.fetchone()
-        finally:
-            self.db.close()
+            with self.db.get_cursor() as cursor:
+                cursor.execute(SQL_MEMBER_BY_PHONE, (phone,))
+                member = cursor.fetchone()
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            return member_cache.get(phone)
+        if member:
+            member_cache.put(member['id'], member['phone'], member['name'], member['points'])
+        return member
+
+    def suggest_members(self, digits, limit=8):
+        """输入手机号时的联想：前缀匹配，输入 4 位时也按尾号匹配 (只查内存)"""
+        return member_cache.suggest(digits, limit)
 
     def register_member(self, phone, name):
         """注册新会员"""
-        self.db.connect()
         try:
-            sql = "INSERT INTO members (phone, name, points) VALUES (%s, %s, 0)"
-            return self.db.execute_query(sql, (phone, name))
+            with self.db.get_cursor() as cursor:
+                cursor.execute(SQL_INSERT_MEMBER, (phone, name))
+                member_cache.put(cursor.lastrowid, phone, name, 0)
+            return True
         except Exception as e:
             return False
-        finally:
-            self.db.close()
 
-    def update_points(self, member_id, points_delta):
-        """更新积分（正数增加，负数扣除）"""
-        self.db.connect()
-        try:
-            sql = "UPDATE members SET points = points + %s WHERE id=%s"
-            return self.db.execute_query(sql, (points_delta, member_id))
-        finally:
-            self.db.close()
+    def update_points(self, member_id, points_delta, reason='adjust'):
+        """更新积分（正数增加，负数扣除），追加一条积分流水"""
+        with self.db.get_cursor() as cursor:
+            cursor.execute(SQL_INSERT_POINTS, (member_id, points_delta, reason, None))
+        member_cache.add_points(member_id, points_delta)
+        return True
+
+    def get_points_history(self, member_id, limit=50):
+        """会员积分流水 (按时间倒序)"""
+        with self.db.get_cursor() as cursor:
+            cursor.execute(SQL_POINTS_HISTORY, (member_id, limit))
+            return cursor.fetchall()
+
+    def materialize_points(self, batch_size=None):
+        """立即把未折算的积分流水并入会员余额，返回折算条数"""
+        return points_materializer.fold(batch_size)
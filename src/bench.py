@@ -0,0 +1,1076 @@
+"""
+性能基准与回归检查 (需要能连上的 MySQL)
+
+    python bench.py --list          列出全部基准
+    python bench.py pool            运行某一项，各项的参数见 python bench.py <名称> -h
+
+需要数据库的基准都在单独的测试库里运行 (环境变量 STORE_BENCH_DB，默认 convenience_store_bench)，
+每次运行前清空重建这个库，不会碰营业库。
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DB = os.environ.get('STORE_BENCH_DB', 'convenience_store_bench')
+# 必须在导入 db_setup / backend 之前设置：模块级的连接池、商品缓存都按这个库名创建
+os.environ['STORE_DB_NAME'] = BENCH_DB
+os.environ.setdefault('STORE_TERMINAL_ID', '999')
+
+import db_setup
+from db_setup import DatabaseManager, POOL_MAX_SIZE
+
+CLERK_ID = 2  # 种子数据里的售货员
+MEMBER_ID = 1
+MEMBER_PHONE = '13800138000'
+
+BENCHES = {}  # 名称 -> (函数, 说明, 参数)
+
+
+def bench(name, description, *arguments):
+    """注册一个基准；arguments 为 (选项名, argparse 参数 dict)"""
+    def register(func):
+        BENCHES[name] = (func, description, arguments)
+        return func
+    return register
+
+
+def fresh_db(stock=None):
+    """清空重建测试库 (种子数据)；stock 不为空时把所有商品库存改成这个数，避免压测中途卖光"""
+    manager = DatabaseManager(BENCH_DB)
+    manager.init_database(hard_reset=True)
+    if stock is not None:
+        manager.execute_query("UPDATE products SET stock = %s", (stock,))
+        manager.execute_query("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    return manager
+
+
+def seed_products(manager, count, stock=10 ** 6, names=None):
+    """
+    追加 count 个测试商品，返回它们的 id
+    :param names: 函数 i -> (商品名, 分类)，默认 "测试商品i" / "分类(i % 20)"
+    """
+    from backend import SQL_INSERT_PRODUCT
+
+    names = names or (lambda i: (f"测试商品{i}", f"分类{i % 20}"))
+    manager.connect()
+    manager.cursor.execute("SELECT COALESCE(MAX(id), 0) AS top FROM products")
+    first = manager.cursor.fetchone()['top'] + 1
+    rows = [(*names(i), 1.00, 2.00, stock, 10, None, None) for i in range(count)]
+    for start in range(0, count, 5000):
+        manager.cursor.executemany(SQL_INSERT_PRODUCT, rows[start:start + 5000])
+    manager.execute_query("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    return list(range(first, first + count))
+
+
+def seed_sales(count, days, product_ids=range(1, 8), batch=10000):
+    """
+    追加 count 行合成销售流水，均匀分布在最近 days 天里 (只写 sales，不维护汇总表)
+    :return: 第一行的 sales.id
+    """
+    import random
+    from datetime import datetime, timedelta
+    from backend import SQL_INSERT_SALES
+
+    rng = random.Random(count)
+    product_ids = list(product_ids)
+    db = DatabaseManager(BENCH_DB)
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS top FROM sales")
+        first = cursor.fetchone()['top'] + 1
+        cursor.execute("SELECT id, category FROM products")
+        categories = {row['id']: row['category'] for row in cursor.fetchall()}
+    end = datetime.now().replace(microsecond=0)
+    span = days * 86400
+    for start in range(0, count, batch):
+        rows = []
+        for i in range(start, min(start + batch, count)):
+            qty = rng.randint(1, 5)
+            p_id = rng.choice(product_ids)
+            rows.append((f"B{i:014d}", p_id, 1 + i % 2, qty, 1.00, 2.00, 2.00 * qty,
+                         end - timedelta(seconds=rng.randrange(span)), (None, 1, 2)[i % 3], categories.get(p_id)))
+        with db.transaction() as cursor:
+            cursor.executemany(SQL_INSERT_SALES, rows)
+    return first
+
+
+def seed_logs(count, first_sale_id, sale_count):
+    """追加 count 条改单记录，指向 [first_sale_id, first_sale_id + sale_count) 内随机的流水"""
+    import random
+    from datetime import datetime, timedelta
+
+    rng = random.Random(count)
+    end = datetime.now().replace(microsecond=0)
+    rows = [(first_sale_id + rng.randrange(sale_count), CLERK_ID, 'MODIFY', "基准测试",
+             end - timedelta(seconds=rng.randrange(365 * 86400))) for _ in range(count)]
+    with DatabaseManager(BENCH_DB).transaction() as cursor:
+        cursor.executemany("INSERT INTO modification_logs (sale_id, operator_id, action_type, details, log_time) "
+                           "VALUES (%s, %s, %s, %s, %s)", rows)
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+def report(rows, headers):
+    """按列对齐打印结果表"""
+    table = [headers] + [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(headers))]
+    for row in table:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def server_status(manager, name):
+    """MySQL 的一项全局状态计数 (SHOW GLOBAL STATUS)"""
+    manager.connect()
+    manager.cursor.execute("SHOW GLOBAL STATUS LIKE %s", (name,))
+    return int(manager.cursor.fetchone()['Value'])
+
+
+def server_connections(manager):
+    """MySQL 启动以来累计建立的连接数"""
+    return server_status(manager, 'Connections')
+
+
+# ================= 连接池 =================
+
+def _legacy_query(sql, params=None):
+    """改造前的做法：每次调用新建连接，用完关闭"""
+    manager = DatabaseManager(BENCH_DB)
+    manager.connect()
+    try:
+        manager.cursor.execute(sql, params)
+        return manager.cursor.fetchall()
+    finally:
+        manager.close()
+
+
+def _legacy_checkout(product_id):
+    from backend import SQL_MEMBER_BY_PHONE, SQL_ALL_PRODUCTS, _load_products, _checkout_lines, _write_order
+    from order_id import next_order_id
+    from datetime import datetime
+
+    # 收银台一单的典型调用：查会员、结账、刷新商品列表，每一步各开一条连接
+    _legacy_query(SQL_MEMBER_BY_PHONE, (MEMBER_PHONE,))
+    manager = DatabaseManager(BENCH_DB)
+    manager.connect()
+    try:
+        manager.conn.begin()
+        products = _load_products(manager.cursor, [product_id])
+        lines = _checkout_lines(products, {product_id: 1})
+        _write_order(manager.cursor, next_order_id(), CLERK_ID, MEMBER_ID, datetime.now().replace(microsecond=0),
+                     lines)
+        manager.conn.commit()
+    finally:
+        manager.close()
+    _legacy_query(SQL_ALL_PRODUCTS + " ORDER BY id DESC LIMIT 50")
+
+
+@bench('pool', "每笔结账新建的数据库连接数：每次调用 connect/close vs 连接池",
+       ('--checkouts', dict(type=int, default=200, help="结账笔数")))
+def bench_pool(args):
+    monitor = fresh_db(stock=10 ** 6)
+    from backend import ProductLogic, SalesLogic, MemberLogic
+
+    products, sales, members = ProductLogic(), SalesLogic(), MemberLogic()
+
+    def pooled_checkout(product_id):
+        members.get_member_by_phone(MEMBER_PHONE)
+        ok, msg, _ = sales.checkout(CLERK_ID, [{'id': product_id, 'buy_qty': 1}], MEMBER_ID)
+        assert ok, msg
+        products.get_all_products(limit=50)
+
+    rows = []
+    for label, checkout in (("connect/close", _legacy_checkout), ("连接池", pooled_checkout)):
+        before = server_connections(monitor)
+        start = time.perf_counter()
+        for i in range(args.checkouts):
+            checkout(1 + i % 7)
+        elapsed = time.perf_counter() - start
+        opened = server_connections(monitor) - before
+        rows.append((label, args.checkouts, opened, f"{opened / args.checkouts:.2f}",
+                     f"{elapsed / args.checkouts * 1000:.1f}"))
+    monitor.close()
+    report(rows, ("方式", "结账笔数", "新建连接", "每笔连接", "每笔耗时 ms"))
+    print(f"连接池统计: {db_setup.get_pool(BENCH_DB).stats()}")
+
+
+# ================= 批量结账 =================
+
+def _per_line_checkout(cursor, order_id, sale_time, quantities):
+    """改造前的结账：每行商品各一次 SELECT ... FOR UPDATE、UPDATE、INSERT"""
+    from backend import SQL_INSERT_SALES
+
+    for p_id, qty in quantities.items():
+        cursor.execute("SELECT stock, category, buy_price, sell_price FROM products WHERE id=%s FOR UPDATE", (p_id,))
+        product = cursor.fetchone()
+        if product['stock'] < qty:
+            raise Exception("库存不足")
+        cursor.execute("UPDATE products SET stock = stock - %s WHERE id=%s", (qty, p_id))
+        cursor.execute(SQL_INSERT_SALES, (order_id, p_id, CLERK_ID, qty, product['buy_price'], product['sell_price'],
+                                          product['sell_price'] * qty, sale_time, None, product['category']))
+
+
+def _set_based_checkout(cursor, order_id, sale_time, quantities):
+    """现在的结账：一条语句锁住全部商品，一条语句扣库存，一次多行插入"""
+    from backend import _load_products, _checkout_lines, _write_order
+
+    products = _load_products(cursor, sorted(quantities))
+    _write_order(cursor, order_id, CLERK_ID, None, sale_time, _checkout_lines(products, quantities))
+
+
+@bench('basket', "结账事务耗时 (即持锁时间) 随购物车行数的变化：逐行语句 vs 批量语句",
+       ('--sizes', dict(default="1,5,10,30,50,100", help="购物车行数，逗号分隔")),
+       ('--repeat', dict(type=int, default=50, help="每种行数结账次数")))
+def bench_basket(args):
+    from datetime import datetime
+    from order_id import next_order_id
+
+    sizes = [int(n) for n in args.sizes.split(',')]
+    manager = fresh_db()
+    product_ids = seed_products(manager, max(sizes))
+    manager.close()
+    db = DatabaseManager(BENCH_DB)
+
+    rows = []
+    for size in sizes:
+        quantities = {p_id: 1 for p_id in product_ids[:size]}
+        row = [size]
+        for checkout in (_per_line_checkout, _set_based_checkout):
+            samples = []
+            for _ in range(args.repeat):
+                sale_time = datetime.now().replace(microsecond=0)
+                start = time.perf_counter()
+                with db.transaction() as cursor:
+                    checkout(cursor, next_order_id(), sale_time, quantities)
+                samples.append(time.perf_counter() - start)
+            row += [f"{percentile(samples, 0.5) * 1000:.1f}", f"{percentile(samples, 0.95) * 1000:.1f}"]
+        rows.append(row)
+    report(rows, ("行数", "逐行 p50 ms", "逐行 p95 ms", "批量 p50 ms", "批量 p95 ms"))
+
+
+# ================= 订单号 =================
+
+def _orderid_till(terminal_id, clerk_id, threads, orders):
+    """子进程：模拟一台收银机，threads 个线程各结账 orders 次，返回成功笔数与失败原因"""
+    import threading
+
+    os.environ['STORE_TERMINAL_ID'] = str(terminal_id)  # 订单号生成器首次使用时才读取
+    from backend import SalesLogic
+
+    sales = SalesLogic()
+    done = []
+    failures = {}
+    lock = threading.Lock()
+
+    def run():
+        for i in range(orders):
+            cart = [{'id': 1 + i % 7, 'buy_qty': 1}, {'id': 1 + (i + 3) % 7, 'buy_qty': 1}]
+            ok, msg, _ = sales.checkout(clerk_id, cart)
+            with lock:
+                if ok:
+                    done.append(1)
+                else:
+                    failures[msg] = failures.get(msg, 0) + 1
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return len(done), failures
+
+
+@bench('orderid', "多台收银机 (进程，各自的 STORE_TERMINAL_ID 与店员) 同时结账，检查订单号没有重复、没有跨收银台合并",
+       ('--tills', dict(type=int, default=8, help="收银机 (进程) 数")),
+       ('--threads', dict(type=int, default=4, help=f"每台收银机的并发线程数，不超过连接池上限 {POOL_MAX_SIZE}")),
+       ('--orders', dict(type=int, default=500, help="每个线程的结账次数")))
+def bench_orderid(args):
+    import multiprocessing
+
+    if args.threads > POOL_MAX_SIZE:
+        sys.exit(f"--threads 不能超过连接池上限 {POOL_MAX_SIZE}")
+    manager = fresh_db(stock=10 ** 9)
+    manager.connect()
+    clerk_ids = []
+    for till in range(args.tills):
+        manager.cursor.execute("INSERT INTO users (username, password, role) VALUES (%s, 'bench', 'Clerk')",
+                               (f"bench-till-{till}",))
+        clerk_ids.append(manager.cursor.lastrowid)
+
+    # spawn：子进程不继承父进程里已经创建的连接池和订单号生成器
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with context.Pool(args.tills) as pool:
+        results = pool.starmap(_orderid_till, [(100 + till, clerk_ids[till], args.threads, args.orders)
+                                               for till in range(args.tills)])
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(done for done, _ in results)
+    failures = {}
+    for _, till_failures in results:
+        for msg, count in till_failures.items():
+            failures[msg] = failures.get(msg, 0) + count
+    marks = ", ".join(["%s"] * len(clerk_ids))
+    manager.cursor.execute(f"SELECT COUNT(DISTINCT order_id) AS orders, COUNT(*) AS lines FROM sales "
+                           f"WHERE user_id IN ({marks})", clerk_ids)
+    counts = manager.cursor.fetchone()
+    manager.cursor.execute("SELECT order_id, COUNT(DISTINCT user_id) AS tills FROM sales "
+                           "GROUP BY order_id HAVING tills > 1")
+    merged = manager.cursor.fetchall()
+    manager.close()
+
+    report([(args.tills, args.tills * args.threads, succeeded, sum(failures.values()),
+             f"{succeeded / elapsed:.0f}", counts['orders'], len(merged))],
+           ("收银机", "并发线程", "成功结账", "失败", "单/秒", "不同订单号", "跨收银台合并"))
+    if failures:
+        print(f"失败原因: {failures}")
+    assert not merged, f"订单号被多台收银机共用: {[r['order_id'] for r in merged[:5]]}"
+    assert counts['orders'] == succeeded, f"订单号数 {counts['orders']} != 成功结账数 {succeeded}"
+    assert counts['lines'] == succeeded * 2, "有订单的流水行数不对"
+    print("订单号无重复")
+
+
+# ================= 热门商品争用 =================
+
+@bench('hotsku', "所有收银台同时卖同一个商品：加锁读 vs 热门商品路径，汇总表 1 个分片 vs ROLLUP_SHARDS 个分片",
+       ('--tills', dict(type=int, default=POOL_MAX_SIZE, help=f"并发收银台 (线程) 数，不超过连接池上限 {POOL_MAX_SIZE}")),
+       ('--orders', dict(type=int, default=200, help="每个收银台的结账次数")),
+       ('--sku', dict(type=int, default=1, help="所有收银台都卖的商品 id")))
+def bench_hotsku(args):
+    import threading
+    import backend
+    from backend import SalesLogic, TX_METRICS
+
+    if args.tills > POOL_MAX_SIZE:
+        sys.exit(f"--tills 不能超过连接池上限 {POOL_MAX_SIZE}")
+    monitor = fresh_db(stock=10 ** 6)
+    default_shards = backend.ROLLUP_SHARDS
+    cart = [{'id': args.sku, 'buy_qty': 1}]
+
+    def stock():
+        monitor.connect()
+        monitor.cursor.execute("SELECT stock FROM products WHERE id = %s", (args.sku,))
+        return monitor.cursor.fetchone()['stock']
+
+    rows = []
+    try:
+        for hot in (False, True):
+            for shards in (1, default_shards):
+                backend.ROLLUP_SHARDS = shards
+                sales = SalesLogic()
+                sales.hot_ids = frozenset([args.sku]) if hot else frozenset()
+                stock_before = stock()
+                waits_before = server_status(monitor, 'Innodb_row_lock_waits')
+                tx_before = TX_METRICS.snapshot().get('checkout', {})
+                latencies = []
+                failures = []
+
+                def till():
+                    for _ in range(args.orders):
+                        start = time.perf_counter()
+                        ok, msg, _ = sales.checkout(CLERK_ID, cart)
+                        latencies.append(time.perf_counter() - start)
+                        if not ok:
+                            failures.append(msg)
+
+                threads = [threading.Thread(target=till) for _ in range(args.tills)]
+                start = time.perf_counter()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed = time.perf_counter() - start
+
+                sold = len(latencies) - len(failures)
+                assert stock_before - stock() == sold, "库存与成交数不符"
+                tx_after = TX_METRICS.snapshot().get('checkout', {})
+                rows.append(("热门商品路径" if hot else "加锁读", shards, len(latencies), len(failures),
+                             f"{len(latencies) / elapsed:.0f}", f"{percentile(latencies, 0.5) * 1000:.1f}",
+                             f"{percentile(latencies, 0.99) * 1000:.1f}",
+                             server_status(monitor, 'Innodb_row_lock_waits') - waits_before,
+                             tx_after.get('deadlocks', 0) - tx_before.get('deadlocks', 0)))
+    finally:
+        backend.ROLLUP_SHARDS = default_shards
+        monitor.close()
+    report(rows, ("库存扣减", "汇总分片", "结账笔数", "失败", "单/秒", "p50 ms", "p99 ms", "行锁等待", "死锁"))
+
+
+# ================= 异步结账 =================
+
+@bench('async', "异步版结账 (aiomysql，收银服务用) 的吞吐与延迟：大量收银台协程并发；--sku 时比较加锁读与热门商品路径",
+       ('--tills', dict(type=int, default=200, help="并发收银台 (协程) 数")),
+       ('--orders', dict(type=int, default=20, help="每个收银台的结账次数")),
+       ('--sku', dict(type=int, help="所有收银台只卖这个商品")))
+def bench_async(args):
+    import asyncio
+    import random
+    from async_backend import AsyncDatabase, AsyncProductLogic, AsyncSalesLogic
+
+    fresh_db(stock=10 ** 6).close()
+    rng = random.Random(15)
+
+    async def run(hot):
+        db = await AsyncDatabase(BENCH_DB).connect()
+        products = AsyncProductLogic(db)
+        sales = AsyncSalesLogic(db, products.cache)
+        sales.hot_ids = frozenset([args.sku]) if hot else frozenset()
+        in_stock = [p.id for p in await products.get_all_products() if p.stock > 0]
+
+        async def stock():
+            async with db.get_cursor() as cursor:
+                await cursor.execute("SELECT stock FROM products WHERE id = %s", (args.sku,))
+                return (await cursor.fetchone())['stock']
+
+        stock_before = await stock() if args.sku else None
+        latencies = []
+        failures = [0]
+
+        async def till():
+            for _ in range(args.orders):
+                if args.sku:
+                    cart = [{'id': args.sku, 'buy_qty': 1}]
+                else:
+                    cart = [{'id': p_id, 'buy_qty': 1} for p_id in rng.sample(in_stock, rng.randint(1, 3))]
+                start = time.perf_counter()
+                ok, _, _ = await sales.checkout(CLERK_ID, cart)
+                latencies.append(time.perf_counter() - start)
+                failures[0] += not ok
+
+        start = time.perf_counter()
+        await asyncio.gather(*(till() for _ in range(args.tills)))
+        elapsed = time.perf_counter() - start
+        if args.sku:
+            sold = len(latencies) - failures[0]
+            assert stock_before - await stock() == sold, "库存与成交数不符 (超卖)"
+        await db.close()
+        label = ("热门商品路径" if hot else "加锁读") if args.sku else "随机商品"
+        return (label, args.tills, len(latencies), failures[0], f"{len(latencies) / elapsed:.0f}",
+                f"{percentile(latencies, 0.5) * 1000:.1f}", f"{percentile(latencies, 0.99) * 1000:.1f}")
+
+    rows = [asyncio.run(run(hot)) for hot in ((False, True) if args.sku else (False,))]
+    report(rows, ("库存扣减", "收银台", "结账笔数", "失败", "单/秒", "p50 ms", "p99 ms"))
+
+
+# ================= 死锁 =================
+
+@bench('deadlock', "两组收银台按相反顺序买同一批商品：逐行加锁 (不排序、不重做) vs 现在的结账，统计死锁",
+       ('--tills', dict(type=int, default=POOL_MAX_SIZE, help=f"并发收银台 (线程) 数，不超过连接池上限 {POOL_MAX_SIZE}")),
+       ('--orders', dict(type=int, default=100, help="每个收银台的结账次数")),
+       ('--lines', dict(type=int, default=5, help="每单商品行数")))
+def bench_deadlock(args):
+    import threading
+    from datetime import datetime
+    from backend import SalesLogic, TX_METRICS, _lock_error_code
+    from order_id import next_order_id
+
+    if args.tills > POOL_MAX_SIZE:
+        sys.exit(f"--tills 不能超过连接池上限 {POOL_MAX_SIZE}")
+    manager = fresh_db()
+    product_ids = seed_products(manager, args.lines)
+    manager.close()
+    db = DatabaseManager(BENCH_DB)
+    sales = SalesLogic()
+
+    def naive(order):
+        # 改造前：按购物车里的顺序逐行锁商品，出错直接失败
+        quantities = {p_id: 1 for p_id in order}
+        with db.transaction() as cursor:
+            _per_line_checkout(cursor, next_order_id(), datetime.now().replace(microsecond=0), quantities)
+
+    def current(order):
+        ok, msg, _ = sales.checkout(CLERK_ID, [{'id': p_id, 'buy_qty': 1} for p_id in order])
+        if not ok:
+            raise Exception(msg)
+
+    rows = []
+    for label, checkout in (("逐行加锁", naive), ("现在的结账", current)):
+        tx_before = TX_METRICS.snapshot().get('checkout', {})
+        errors = {}
+        lock = threading.Lock()
+
+        def till(order):
+            for _ in range(args.orders):
+                try:
+                    checkout(order)
+                except Exception as e:
+                    key = _lock_error_code(e) or type(e).__name__
+                    with lock:
+                        errors[key] = errors.get(key, 0) + 1
+
+        # 一半收银台按 id 升序、一半按降序加购
+        threads = [threading.Thread(target=till, args=(product_ids if i % 2 else product_ids[::-1],))
+                   for i in range(args.tills)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        total = args.tills * args.orders
+        tx_after = TX_METRICS.snapshot().get('checkout', {})
+        rows.append((label, total, sum(errors.values()), errors.get(1213, 0),
+                     tx_after.get('deadlocks', 0) - tx_before.get('deadlocks', 0),
+                     tx_after.get('retries', 0) - tx_before.get('retries', 0),
+                     f"{total / elapsed:.0f}"))
+        other = {k: v for k, v in errors.items() if k != 1213}
+        if other:
+            print(f"{label} 其他错误: {other}")
+    report(rows, ("结账方式", "结账笔数", "失败", "失败于死锁 1213", "内部死锁", "内部重做", "单/秒"))
+    print("内部死锁 / 重做：run_transaction 捕获后自动重做的次数 (TX_METRICS)，不计入失败")
+
+
+# ================= 离线收银 =================
+
+@bench('outage', "结账中途反复断开数据库连接 (KILL)：检查离线转存与回放后每笔订单恰好入库一次、库存一致",
+       ('--tills', dict(type=int, default=4, help=f"并发收银台 (线程) 数，要给回放线程留连接，小于连接池上限 {POOL_MAX_SIZE}")),
+       ('--before', dict(type=float, default=3.0, help="断连前正常结账的秒数")),
+       ('--outage', dict(type=float, default=5.0, help="持续断连的秒数")),
+       ('--after', dict(type=float, default=5.0, help="恢复后继续结账的秒数")),
+       ('--drain-timeout', dict(type=float, default=120.0, help="等待离线订单全部补录的最长秒数")))
+def bench_outage(args):
+    import tempfile
+    import threading
+    import pymysql
+
+    if args.tills >= POOL_MAX_SIZE:
+        sys.exit(f"--tills 必须小于连接池上限 {POOL_MAX_SIZE}")
+    # 离线日志写到临时目录，不碰收银台的日志 (必须在导入 backend 之前设置)
+    os.environ['STORE_OFFLINE_JOURNAL'] = os.path.join(tempfile.mkdtemp(), 'offline_journal.db')
+    stock = 10 ** 6
+    monitor = fresh_db(stock=stock)
+    from backend import ProductLogic, SalesLogic, offline_queue
+
+    ProductLogic().get_all_products()  # 先把商品缓存加载好，断连期间按缓存离线结账
+    sales = SalesLogic()
+    orders = {}  # 成功的订单号 -> {商品 id: 数量}
+    offline = [0]
+    failures = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    killing = threading.Event()
+
+    def till(n):
+        i = 0
+        while not stop.is_set():
+            quantities = {1 + (n + i) % 7: 1, 1 + (n + i + 3) % 7: 2}
+            ok, msg, receipt = sales.checkout(CLERK_ID, [{'id': p, 'buy_qty': q} for p, q in quantities.items()])
+            with lock:
+                if ok:
+                    orders[receipt['order_id']] = quantities
+                    offline[0] += receipt['offline']
+                else:
+                    failures[msg] = failures.get(msg, 0) + 1
+            i += 1
+
+    def killer():
+        # 断连期间不停地杀掉测试库上除自己以外的所有连接：进行中的事务断开，重连上来的马上又被杀
+        conn = DatabaseManager(BENCH_DB)
+        conn.connect()
+        kills = 0
+        while killing.is_set():
+            conn.cursor.execute("SELECT id FROM information_schema.PROCESSLIST WHERE db = %s AND id <> CONNECTION_ID()",
+                                (BENCH_DB,))
+            for row in conn.cursor.fetchall():
+                try:
+                    conn.cursor.execute(f"KILL {int(row['id'])}")
+                    kills += 1
+                except pymysql.err.MySQLError:
+                    pass  # 连接已经自己断开了
+            time.sleep(0.01)
+        conn.close()
+        print(f"断连期间 KILL 了 {kills} 条连接")
+
+    monitor.connect()
+    monitor.cursor.execute("SELECT DISTINCT order_id FROM sales")
+    seeded = {row['order_id'] for row in monitor.cursor.fetchall()}  # 种子数据里原有的订单
+
+    threads = [threading.Thread(target=till, args=(n,)) for n in range(args.tills)]
+    for t in threads:
+        t.start()
+    time.sleep(args.before)
+    killing.set()
+    kill_thread = threading.Thread(target=killer)
+    kill_thread.start()
+    time.sleep(args.outage)
+    killing.clear()
+    kill_thread.join()
+    time.sleep(args.after)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    deadline = time.monotonic() + args.drain_timeout
+    while True:
+        status = offline_queue.status()
+        if not status['pending'] and status['online']:
+            break
+        if time.monotonic() > deadline:
+            sys.exit(f"{args.drain_timeout:.0f}s 内没有补录完：{status}")
+        time.sleep(0.5)
+
+    monitor.connect()
+    monitor.cursor.execute("SELECT order_id, product_id, quantity FROM sales")
+    landed = {}
+    for row in monitor.cursor.fetchall():
+        if row['order_id'] in seeded:
+            continue
+        lines = landed.setdefault(row['order_id'], {})
+        assert row['product_id'] not in lines, f"订单 {row['order_id']} 的商品 {row['product_id']} 重复入库"
+        lines[row['product_id']] = row['quantity']
+    monitor.cursor.execute("SELECT id, stock FROM products")
+    stocks = {row['id']: row['stock'] for row in monitor.cursor.fetchall()}
+    monitor.close()
+
+    sold = {}
+    for quantities in orders.values():
+        for p_id, qty in quantities.items():
+            sold[p_id] = sold.get(p_id, 0) + qty
+    report([(len(orders), offline[0], sum(failures.values()), status['applied'], status['conflict'],
+             len(set(orders) & set(landed)))],
+           ("成功结账", "其中离线", "失败", "补录", "冲突", "已入库"))
+    if failures:
+        print(f"失败原因: {failures}")
+    missing = [order_id for order_id in orders if landed.get(order_id) != orders[order_id]]
+    assert not missing, f"{len(missing)} 笔订单没有入库或行数不对，例如 {missing[:3]}"
+    phantom = set(landed) - set(orders)
+    assert not phantom, f"{len(phantom)} 笔订单收银台报失败却已入库，例如 {sorted(phantom)[:3]}"
+    assert not status['conflict'], f"回放出现冲突: {offline_queue.conflicts(5)}"
+    wrong = {p_id: (stock - stocks[p_id], qty) for p_id, qty in sold.items() if stock - stocks[p_id] != qty}
+    assert not wrong, f"库存扣减与成交数量不符 (扣减, 成交): {wrong}"
+    assert offline[0], "断连期间没有订单转为离线，调大 --outage"
+    print("每笔订单恰好入库一次，库存一致")
+
+
+# ================= 索引 =================
+
+@bench('explain', "大数据量下热点查询的执行计划：确认 EXPLAIN 选中预期索引，否则以非零状态退出",
+       ('--rows', dict(type=int, default=10 ** 6, help="合成销售流水行数")),
+       ('--days', dict(type=int, default=365, help="流水分布的天数")))
+def bench_explain(args):
+    from datetime import date, datetime, timedelta
+    from backend import SalesLogic, SQL_ORDER_EXISTS, SQL_SALES_BUCKETS, SQL_STATS_MINUTES
+
+    fresh_db().close()
+    start = time.perf_counter()
+    first = seed_sales(args.rows, args.days)
+    seed_logs(args.rows // 100, first, args.rows)
+    db = DatabaseManager(BENCH_DB)
+    with db.get_cursor() as cursor:
+        for table in ('sales', 'modification_logs'):
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+    print(f"已生成 {args.rows:,} 行流水，耗时 {time.perf_counter() - start:.0f}s")
+
+    today = datetime.combine(date.today(), datetime.min.time())
+    middle = today - timedelta(days=args.days // 2)
+    orders_sql, orders_params = SalesLogic._orders_query(None, 50)
+    page_sql, page_params = SalesLogic._orders_query(None, 50, (middle, 10 ** 9))
+    clerk_sql, clerk_params = SalesLogic._orders_query(CLERK_ID, 50)
+    logs_sql, logs_params = SalesLogic._logs_query(50)
+    # (说明, sql, 参数, 表别名, 预期索引)
+    checks = [
+        ("订单列表首页", orders_sql, orders_params, 's', 'idx_sales_time'),
+        ("订单列表翻页", page_sql, page_params, 's', 'idx_sales_time'),
+        ("店员自己的订单", clerk_sql, clerk_params, 's', 'idx_sales_user_time'),
+        ("按订单号查流水", SQL_ORDER_EXISTS, (f"B{args.rows // 2:014d}",), 'sales', 'idx_sales_order'),
+        ("今日分时走势", SQL_SALES_BUCKETS, (today, 300, today, today + timedelta(days=1)), 'sales',
+         'idx_sales_time'),
+        ("看板分钟走势", SQL_STATS_MINUTES, (today, today + timedelta(days=1), first + args.rows), 'sales',
+         'idx_sales_time'),
+        ("修改记录首页", logs_sql, logs_params, 'l', 'idx_logs_time'),
+    ]
+
+    rows = []
+    failed = 0
+    with db.get_cursor() as cursor:
+        for label, sql, params, table, expected in checks:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = next(r for r in cursor.fetchall() if r['table'] == table)
+            begin = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            elapsed = (time.perf_counter() - begin) * 1000
+            ok = plan['key'] == expected
+            failed += not ok
+            rows.append((label, plan['type'], plan['key'], expected, plan['rows'], f"{elapsed:.1f}",
+                         "OK" if ok else "FAIL"))
+    report(rows, ("查询", "type", "实际索引", "预期索引", "估计行数", "耗时 ms", "结果"))
+    if failed:
+        sys.exit(f"{failed} 条查询没有走预期索引")
+
+
+# ================= 走势查询 =================
+
+# 改造前的两条走势查询：对列套函数，sale_time 上的索引用不上
+LEGACY_MINUTE_SQL = """
+SELECT HOUR(sale_time) as h, MINUTE(sale_time) as m, SUM(total_price) as total
+FROM sales
+WHERE DATE(sale_time) = CURDATE()
+GROUP BY h, m
+ORDER BY h ASC, m ASC
+"""
+LEGACY_HOURLY_SQL = """
+SELECT HOUR(sale_time) as h, SUM(total_price) as total
+FROM sales
+GROUP BY h
+ORDER BY h ASC
+"""
+
+
+@bench('trend', "多年历史数据下的今日走势查询：DATE()/HOUR() 过滤 vs sale_time 范围过滤",
+       ('--rows', dict(type=int, default=10 ** 6, help="合成销售流水行数")),
+       ('--years', dict(type=int, default=3, help="历史跨度 (年)")),
+       ('--repeat', dict(type=int, default=20, help="每条查询执行次数")))
+def bench_trend(args):
+    from datetime import date, datetime, timedelta
+    from backend import SalesLogic, SQL_SALES_BUCKETS
+
+    fresh_db().close()
+    seed_sales(args.rows, args.years * 365)
+    db = DatabaseManager(BENCH_DB)
+    with db.get_cursor() as cursor:
+        cursor.execute("ANALYZE TABLE sales")
+        cursor.fetchall()
+
+    today = datetime.combine(date.today(), datetime.min.time())
+    tomorrow = today + timedelta(days=1)
+    queries = [
+        ("分钟走势 DATE()=CURDATE()", LEGACY_MINUTE_SQL, None),
+        ("小时走势 HOUR() 全表", LEGACY_HOURLY_SQL, None),
+        ("分钟走势 范围", SQL_SALES_BUCKETS, (today, 60, today, tomorrow)),
+        ("小时走势 范围", SQL_SALES_BUCKETS, (today, 3600, today, tomorrow)),
+    ]
+
+    rows = []
+    with db.get_cursor() as cursor:
+        for label, sql, params in queries:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = cursor.fetchone()
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                samples.append(time.perf_counter() - start)
+            rows.append((label, plan['type'], plan['key'], plan['rows'], f"{percentile(samples, 0.5) * 1000:.1f}",
+                         f"{percentile(samples, 0.95) * 1000:.1f}"))
+    report(rows, ("查询", "type", "索引", "估计行数", "p50 ms", "p95 ms"))
+
+    # 两种写法统计的今日销售额必须一致
+    with db.get_cursor() as cursor:
+        cursor.execute(LEGACY_MINUTE_SQL)
+        legacy = sum(float(r['total']) for r in cursor.fetchall())
+    _, totals = SalesLogic().get_minute_sales_stats(today, tomorrow)
+    assert abs(legacy - sum(totals)) < 0.005, (legacy, sum(totals))
+    print(f"今日销售额一致：{legacy:.2f}")
+
+
+# ================= 看板增量统计 =================
+
+@bench('dashboard', "并发结账 + 改单 + 商品改分类期间反复刷新看板：增量统计 (get_dashboard_stats) 每轮与全量重载对比",
+       ('--rounds', dict(type=int, default=20, help="轮数")),
+       ('--threads', dict(type=int, default=6, help=f"并发收银线程数，加上刷新线程不超过连接池上限 {POOL_MAX_SIZE}")),
+       ('--ops', dict(type=int, default=50, help="每个线程每轮的操作数 (结账或改单)")),
+       ('--sku', dict(type=int, default=40, help="测试商品数")))
+def bench_dashboard(args):
+    import random
+    import threading
+    from backend import SalesLogic
+
+    if args.threads + 1 > POOL_MAX_SIZE:
+        sys.exit(f"--threads 不能超过 {POOL_MAX_SIZE - 1} (还有一个刷新线程)")
+    manager = fresh_db(stock=10 ** 9)
+    product_ids = seed_products(manager, args.sku, names=lambda i: (f"看板商品{i}", f"分类{i % 5}"))
+    sales = SalesLogic()
+    sales.get_dashboard_stats()  # 先全量初始化，之后都是增量
+    rng = random.Random(25)
+
+    lock = threading.Lock()
+
+    def till(seed, done):
+        local = random.Random(seed)
+        for _ in range(args.ops):
+            if local.random() < 0.7:
+                cart = [{'id': p_id, 'buy_qty': local.randint(1, 3)}
+                        for p_id in local.sample(product_ids, local.randint(1, 4))]
+                ok, _, _ = sales.checkout(CLERK_ID, cart, local.choice((None, MEMBER_ID)))
+                kind = 'checkout' if ok else 'failed'
+            else:
+                with sales.db.get_cursor() as cursor:
+                    cursor.execute("SELECT MAX(id) AS top FROM sales")
+                    top = cursor.fetchone()['top']
+                ok, _ = sales.modify_order_qty(local.randint(max(top - 200, 1), top), local.randint(1, 6), CLERK_ID)
+                kind = 'modify' if ok else 'failed'
+            with lock:
+                done[kind] += 1
+
+    def keys(data):
+        return {key: data[key] for key in ('stats', 'top5', 'labels', 'sizes', 'totals')}
+
+    rows = []
+    mismatches = 0
+    for round_no in range(1, args.rounds + 1):
+        # 商品改分类：之前卖出的仍算原分类，之后的按新分类
+        p_id = rng.choice(product_ids)
+        manager.cursor.execute("UPDATE products SET category = %s WHERE id = %s", (f"分类{rng.randrange(8)}", p_id))
+        manager.execute_query("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+
+        done = {'checkout': 0, 'modify': 0, 'failed': 0}
+        workers = [threading.Thread(target=till, args=(round_no * 100 + i, done)) for i in range(args.threads)]
+        stop = threading.Event()
+
+        def refresher():
+            # 写入进行中也在刷新，让增量统计遇到还没提交的 id (空洞)
+            while not stop.is_set():
+                sales.get_dashboard_stats()
+
+        polling = threading.Thread(target=refresher)
+        polling.start()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        stop.set()
+        polling.join()
+
+        start = time.perf_counter()
+        incremental = sales.get_dashboard_stats()
+        incremental_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        reloaded = SalesLogic().get_dashboard_stats()  # 新的 SalesAggregator：全量读汇总表
+        reload_ms = (time.perf_counter() - start) * 1000
+        same = keys(incremental) == keys(reloaded)
+        mismatches += not same
+        rows.append((round_no, done['checkout'], done['modify'], done['failed'], f"{incremental_ms:.1f}",
+                     f"{reload_ms:.1f}", "一致" if same else "不一致"))
+        if not same:
+            for key, value in keys(incremental).items():
+                if value != reloaded[key]:
+                    print(f"第 {round_no} 轮 {key}: 增量 {value} != 全量 {reloaded[key]}")
+    manager.close()
+
+    report(rows, ("轮", "结账", "改单", "失败", "增量 ms", "全量 ms", "结果"))
+    assert not mismatches, f"{mismatches} 轮增量统计与全量重载不一致"
+    print("增量统计与全量重载每轮一致")
+
+
+# ================= 流式读取 =================
+
+@bench('stream', "整张 sales 表的读取峰值内存：服务端游标 (stream) vs fetchall",
+       ('--rows', dict(type=int, default=10 ** 6, help="合成销售流水行数")))
+def bench_stream(args):
+    import resource
+
+    def peak_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    fresh_db().close()
+    seed_sales(args.rows, 365)
+    db = DatabaseManager(BENCH_DB)
+
+    # 峰值 RSS 只增不减，所以先测流式
+    base = peak_mb()
+    start = time.perf_counter()
+    count = sum(1 for _ in db.stream("SELECT * FROM sales"))
+    print(f"stream  : {count:,} 行，{time.perf_counter() - start:.1f}s，峰值 RSS {peak_mb():.0f} MB (起始 {base:.0f} MB)")
+
+    start = time.perf_counter()
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT * FROM sales")
+        rows = cursor.fetchall()
+    print(f"fetchall: {len(rows):,} 行，{time.perf_counter() - start:.1f}s，峰值 RSS {peak_mb():.0f} MB")
+
+
+# ================= 商品搜索 =================
+
+SEARCH_BRANDS = ["可口可乐", "百事可乐", "农夫山泉", "康师傅", "统一", "雪碧", "王老吉", "伊利", "蒙牛", "乐事",
+                 "奥利奥", "旺旺", "德芙", "青岛", "娃哈哈", "达利园", "三只松鼠", "良品铺子", "元气森林", "红牛"]
+SEARCH_KINDS = [("原味", "饮料"), ("无糖", "饮料"), ("柠檬味", "饮料"), ("纯牛奶", "乳品"), ("酸奶", "乳品"),
+                ("薯片", "零食"), ("饼干", "零食"), ("巧克力", "零食"), ("方便面", "速食"), ("啤酒", "酒水")]
+SEARCH_SIZES = ["330ml", "500ml", "1.25L", "2L", "100g", "200g", "6连包", "12瓶装"]
+# (说明, 关键字)；最后一条是拼音首字母，LIKE 查不到
+SEARCH_QUERIES = [("品牌", "可乐"), ("单字", "奶"), ("品类", "零食"), ("长关键字", "农夫山泉无糖"),
+                  ("无结果", "榴莲"), ("拼音首字母", "kkkl")]
+SQL_LEGACY_SEARCH = "SELECT * FROM products WHERE name LIKE %s OR category LIKE %s"
+
+
+def _search_product_name(i):
+    brand = SEARCH_BRANDS[i % len(SEARCH_BRANDS)]
+    kind, category = SEARCH_KINDS[i // len(SEARCH_BRANDS) % len(SEARCH_KINDS)]
+    size = SEARCH_SIZES[i // (len(SEARCH_BRANDS) * len(SEARCH_KINDS)) % len(SEARCH_SIZES)]
+    return f"{brand}{kind}{size}-{i}", category
+
+
+@bench('search', "大商品库的关键字搜索：LIKE '%关键字%' 全表扫描 vs 内存 n-gram / 拼音首字母索引",
+       ('--products', dict(type=int, default=100000, help="商品数")),
+       ('--repeat', dict(type=int, default=50, help="每个关键字的查询次数")))
+def bench_search(args):
+    from backend import ProductLogic
+
+    manager = fresh_db()
+    seed_products(manager, args.products, names=_search_product_name)
+    manager.close()
+    db = DatabaseManager(BENCH_DB)
+    logic = ProductLogic()
+    start = time.perf_counter()
+    logic.search_products("预热")  # 首次调用加载商品缓存、建索引
+    print(f"{args.products:,} 个商品，加载缓存并建索引 {time.perf_counter() - start:.1f}s")
+
+    rows = []
+    for label, keyword in SEARCH_QUERIES:
+        like = f"%{keyword}%"
+        sql_samples, index_samples = [], []
+        with db.get_cursor() as cursor:
+            for _ in range(args.repeat):
+                begin = time.perf_counter()
+                cursor.execute(SQL_LEGACY_SEARCH, (like, like))
+                sql_hits = cursor.fetchall()
+                sql_samples.append(time.perf_counter() - begin)
+        for _ in range(args.repeat):
+            begin = time.perf_counter()
+            index_hits = logic.search_products(keyword)
+            index_samples.append(time.perf_counter() - begin)
+        # 索引的结果必须覆盖 LIKE 的结果 (另外多出拼音首字母命中的)
+        missing = {r['id'] for r in sql_hits} - {r.id for r in index_hits}
+        assert not missing, f"{keyword!r}: 索引漏掉了 {sorted(missing)[:5]}"
+        rows.append((label, keyword, len(sql_hits), f"{percentile(sql_samples, 0.5) * 1000:.2f}",
+                     f"{percentile(sql_samples, 0.95) * 1000:.2f}", len(index_hits),
+                     f"{percentile(index_samples, 0.5) * 1000:.2f}", f"{percentile(index_samples, 0.95) * 1000:.2f}"))
+    report(rows, ("查询", "关键字", "LIKE 命中", "LIKE p50 ms", "LIKE p95 ms", "索引命中", "索引 p50 ms",
+                  "索引 p95 ms"))
+
+
+# ================= 界面 =================
+
+@bench('treeview', "大商品列表刷新耗时：清空重建 vs 按 iid 对齐 (sync_treeview)，不需要数据库，需要图形界面",
+       ('--rows', dict(type=int, default=20000, help="商品行数")),
+       ('--changed', dict(type=int, default=20, help="每次刷新有变化的行数")),
+       ('--repeat', dict(type=int, default=10, help="每种刷新方式执行次数")))
+def bench_treeview(args):
+    import random
+    import tkinter as tk
+    from tkinter import ttk
+    from widgets import sync_treeview, patch_treeview
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        sys.exit(f"没有可用的图形界面：{e}")
+    root.withdraw()
+    columns = ("id", "name", "category", "price", "stock")
+    rng = random.Random(9)
+    products = [{'id': i, 'name': f"测试商品{i}", 'category': f"分类{i % 20}", 'sell_price': 2.00, 'stock': 100}
+                for i in range(1, args.rows + 1)]
+
+    def row_func(p):
+        return (p['id'], p['name'], p['category'], f"{p['sell_price']}", p['stock']), ()
+
+    def iid_func(p):
+        return p['id']
+
+    def sell_some():
+        sold = rng.sample(products, args.changed)
+        for p in sold:
+            p['stock'] -= 1
+        return sold
+
+    def rebuild(tree, sold):
+        # 改造前的 refresh：删掉全部行再逐行插入
+        tree.delete(*tree.get_children())
+        for p in products:
+            tree.insert("", tk.END, values=row_func(p)[0])
+
+    def sync(tree, sold):
+        sync_treeview(tree, products, iid_func, row_func)
+
+    def patch(tree, sold):
+        patch_treeview(tree, sold, iid_func, row_func)
+
+    rows = []
+    for label, refresh in (("清空重建", rebuild), ("sync_treeview 全量对齐", sync), ("patch_treeview 只改售出行", patch)):
+        tree = ttk.Treeview(root, columns=columns, show="headings")
+        if refresh is rebuild:
+            rebuild(tree, [])
+        else:
+            sync_treeview(tree, products, iid_func, row_func)
+        root.update_idletasks()
+        samples = []
+        for _ in range(args.repeat):
+            sold = sell_some()
+            start = time.perf_counter()
+            refresh(tree, sold)
+            root.update_idletasks()
+            samples.append(time.perf_counter() - start)
+        tree.destroy()
+        rows.append((label, args.rows, f"{percentile(samples, 0.5) * 1000:.1f}",
+                     f"{percentile(samples, 0.95) * 1000:.1f}"))
+    root.destroy()
+    report(rows, ("刷新方式", "行数", "p50 ms", "p95 ms"))
+
+
+@bench('cart', "大购物车每次扫码加购的耗时：列表逐行查找 + 重算合计 vs Cart，不需要数据库",
+       ('--lines', dict(type=int, default=500, help="购物车行数")),
+       ('--scans', dict(type=int, default=5000, help="装满后再扫码加购的次数")))
+def bench_cart(args):
+    import random
+    from decimal import Decimal
+    from backend import Cart
+
+    def legacy_add(cart, p_id, name, price, qty, max_stock):
+        # 改造前 ClerkStation.add_item_to_cart_data + refresh_cart_view 里的合计
+        for item in cart:
+            if str(item['id']) == str(p_id):
+                item['buy_qty'] += qty
+                item['total'] = item['buy_qty'] * item['sell_price']
+                break
+        else:
+            cart.append({'id': p_id, 'name': name, 'sell_price': price, 'buy_qty': qty, 'total': price * qty,
+                         'max_stock': max_stock})
+        return sum(item['total'] for item in cart)
+
+    def cart_add(cart, p_id, name, price, qty, max_stock):
+        cart.add(p_id, name, price, qty, max_stock)
+        return cart.total
+
+    rng = random.Random(13)
+    price = Decimal('2.50')
+    scans = list(range(1, args.lines + 1)) + [rng.randint(1, args.lines) for _ in range(args.scans)]
+    rows = []
+    totals = []
+    for label, cart, add in (("列表", [], legacy_add), ("Cart", Cart(), cart_add)):
+        samples = []
+        for p_id in scans:
+            start = time.perf_counter()
+            total = add(cart, p_id, f"测试商品{p_id}", price, 1, 10 ** 6)
+            samples.append(time.perf_counter() - start)
+        totals.append(total)
+        rows.append((label, args.lines, len(scans), f"{percentile(samples, 0.5) * 1e6:.1f}",
+                     f"{percentile(samples, 0.95) * 1e6:.1f}", f"{sum(samples) * 1000:.1f}"))
+    assert totals[0] == totals[1], totals
+    report(rows, ("购物车", "行数", "扫码次数", "p50 us", "p95 us", "合计 ms"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准与回归检查")
+    parser.add_argument('--list', action='store_true', help="列出全部基准")
+    subparsers = parser.add_subparsers(dest='name')
+    for name, (_, description, arguments) in BENCHES.items():
+        sub = subparsers.add_parser(name, help=description, description=description)
+        for flag, options in arguments:
+            sub.add_argument(flag, **options)
+    args = parser.parse_args()
+
+    if args.list or not args.name:
+        for name, (_, description, _) in BENCHES.items():
+            print(f"{name:<12} {description}")
+        return
+    if BENCH_DB == 'convenience_store_db':
+        sys.exit("STORE_BENCH_DB 不能指向营业库")
+    BENCHES[args.name][0](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+收银服务客户端
+
+收银台的客户端模式：前台收银用到的会员查询 / 联想、结账、历史订单、改单都调用 checkout_server.py，
+收银台不连数据库，也不启动积分折算线程 (由收银服务折算)。登录和店长功能仍直连数据库。
+商品查询 (搜索、扫码、列表) 读本机的 RemoteProductCache，由后台线程经收银服务轮询刷新，界面线程上不走网络。
+例外：收银服务没启动 (连接被拒绝) 时，结账退回本机直连 (直连也失败会继续转为离线结账)。
+"""
+import http.client
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from backend import (
+    ProductCache, ProductLogic, SalesLogic, MemberLogic, ProductRecord, Cart, STOCK_POLL_LAG, _merge_quantities,
+)
+
+# 与收银服务约定的口令，每个请求放在 TOKEN_HEADER 头里
+SERVER_TOKEN = os.environ.get('STORE_SERVER_TOKEN', '')
+TOKEN_HEADER = 'X-Store-Token'
+
+PRICE_FIELDS = ('buy_price', 'sell_price')
+ORDER_MONEY_FIELDS = ('total_price', 'buy_price_snapshot')
+
+
+class CheckoutClient:
+    """JSON 接口调用，每个线程保持一条 keep-alive 连接"""
+
+    def __init__(self, base_url, timeout=10, token=SERVER_TOKEN):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.token = token
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def call(self, method, retry=True, **kwargs):
+        """
+        调用收银服务的一个方法，返回结果
+        :param retry: 连接中断时是否重发一次；只有查询这类可重复执行的请求才能重发
+        """
+        body = json.dumps(kwargs, ensure_ascii=False, default=str).encode('utf-8')
+        headers = {'Content-Type': 'application/json; charset=utf-8', TOKEN_HEADER: self.token}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request('POST', f"/api/{method}", body, headers)
+                response = conn.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt or not retry:
+                    raise
+        if response.status != 200:
+            raise Exception(payload.get('error') or f"收银服务返回 {response.status}")
+        return payload['result']
+
+
+def _product(row):
+    """JSON 中的商品 -> ProductRecord (价格恢复为 Decimal，日期恢复为 date)"""
+    if row is None:
+        return None
+    for field in PRICE_FIELDS:
+        if row[field] is not None:
+            row[field] = Decimal(row[field])
+    if row['expire_date']:
+        row['expire_date'] = date.fromisoformat(row['expire_date'])
+    return ProductRecord(row)
+
+
+def _order(row):
+    """JSON 中的订单行 -> 与 SalesLogic.get_all_orders 相同的类型"""
+    for field in ORDER_MONEY_FIELDS:
+        if row.get(field) is not None:
+            row[field] = Decimal(row[field])
+    row['sale_time'] = datetime.fromisoformat(row['sale_time'])
+    return row
+
+
+def _marks(marks):
+    """JSON 中的 {'version', 'now'} -> 与 SQL_CATALOG_VERSION 相同的类型"""
+    return {'version': marks['version'], 'now': datetime.fromisoformat(marks['now'])}
+
+
+class RemoteProductCache(ProductCache):
+    """
+    客户端模式的本地商品缓存：索引和查询沿用 ProductCache，搜索、扫码、商品列表都在本机内存里完成
+    后台线程每 CHECK_INTERVAL 秒经收银服务轮询版本号和库存变化；网络请求不在界面线程上，也不持有缓存锁，
+    收银服务慢或暂时连不上时继续用已有数据。只有第一次查询要等一次整份加载
+    """
+
+    def __init__(self, client):
+        super().__init__(None)
+        self.client = client
+        self._refresher = threading.Thread(target=self._run, name="remote-product-cache", daemon=True)
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._start_lock:
+            if not self._refresher.is_alive():
+                self._refresher.start()
+
+    def _ensure_fresh(self):
+        if self._synced_at is None:
+            self.misses += 1
+            self._load()
+        else:
+            self.hits += 1  # 新鲜度由后台线程保证，查询本身不访问收银服务
+        self.ensure_started()
+
+    def _fetch(self):
+        result = self.client.call('load_catalog')
+        return _marks(result['marks']), [_product(r) for r in result['products']]
+
+    def _load(self):
+        self._install(*self._fetch())
+
+    def refresh(self):
+        """检查一次版本号和库存；请求在锁外发出，取回后再合并"""
+        if self.version is not None:
+            result = self.client.call('poll_catalog', since=self._synced_at - STOCK_POLL_LAG)
+            with self._lock:
+                if self._merge_poll(_marks(result['marks']), result['stocks']):
+                    return
+        marks, records = self._fetch()
+        with self._lock:
+            self.misses += 1
+            self._install(marks, records)
+
+    def _run(self):
+        while True:
+            time.sleep(self.CHECK_INTERVAL)
+            try:
+                self.refresh()
+            except Exception:
+                pass  # 收银服务不可用等，继续用已有数据，下个周期再试
+
+
+_remote_caches = {}
+_remote_caches_lock = threading.Lock()
+
+
+def remote_product_cache(client):
+    """同一个收银服务共用一份本地缓存和刷新线程，重新登录不会再起一个"""
+    key = (client.host, client.port)
+    with _remote_caches_lock:
+        cache = _remote_caches.get(key)
+        if cache is None:
+            cache = _remote_caches[key] = RemoteProductCache(client)
+        return cache
+
+
+class RemoteProductLogic(ProductLogic):
+    """商品查询读本机的 RemoteProductCache (见 ProductLogic 的查询方法)，不再每次请求收银服务"""
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.cache = remote_product_cache(client)
+
+
+class RemoteSalesLogic(SalesLogic):
+    """结账走收银服务 (组提交)"""
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.product_cache = remote_product_cache(client)
+
+    def checkout(self, clerk_id, cart_items, member_id=None):
+        if isinstance(cart_items, Cart):
+            cart_items = cart_items.to_checkout_items()
+        try:
+            success, msg, receipt_data = self.client.call('checkout', retry=False, clerk_id=clerk_id,
+                                                          cart_items=cart_items, member_id=member_id)
+        except ConnectionRefusedError:
+            # 服务没启动，请求肯定没送达：退回本机直连
+            return super().checkout(clerk_id, cart_items, member_id)
+        except (OSError, http.client.HTTPException):
+            # 请求可能已经送达，不能自动重试，以免重复扣款
+            return False, "与收银服务的连接中断，请在历史订单中确认该单是否已提交", None
+        except Exception as e:
+            return False, str(e), None
+
+        if success:
+            # 先在本地扣减，界面马上看到；服务器上的实际库存由下一次轮询带回
+            self.product_cache.deduct_offline(_merge_quantities(cart_items))
+        if receipt_data:
+            receipt_data['total'] = Decimal(receipt_data['total'])
+            # 小票明细是原样回传的购物车行，调用方传的可能只有 id / buy_qty
+            for item in receipt_data['items']:
+                if item.get('sell_price') is not None:
+                    item['sell_price'] = Decimal(item['sell_price'])
+                if item.get('total') is not None:
+                    item['total'] = Decimal(item['total'])
+                elif item.get('sell_price') is not None:
+                    item['total'] = item['sell_price'] * int(item['buy_qty'])
+        return success, msg, receipt_data
+
+    def get_all_orders(self, clerk_id=None, limit=None, after_key=None):
+        return [_order(r) for r in self.client.call('get_all_orders', clerk_id=clerk_id, limit=limit,
+                                                     after_key=after_key)]
+
+    def modify_order_qty(self, sale_id, new_qty, operator_id):
+        try:
+            success, msg = self.client.call('modify_order_qty', retry=False, sale_id=sale_id, new_qty=new_qty,
+                                            operator_id=operator_id)
+        except (OSError, http.client.HTTPException):
+            return False, "与收银服务的连接中断，请刷新历史订单确认是否已修改"
+        except Exception as e:
+            return False, str(e)
+        return success, msg
+
+
+class RemoteMemberLogic(MemberLogic):
+    """会员查询 / 注册走收银服务"""
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    def get_member_by_phone(self, phone):
+        return self.client.call('get_member_by_phone', phone=phone)
+
+    def suggest_members(self, digits, limit=8):
+        return self.client.call('suggest_members', digits=digits, limit=limit)
+
+    def register_member(self, phone, name):
+        try:
+            return self.client.call('register_member', retry=False, phone=phone, name=name)
+        except Exception:
+            return False
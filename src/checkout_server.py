@@ -0,0 +1,267 @@
+"""
+多收银台收银服务
+
+收银台不再各自直连 MySQL，而是通过 HTTP/JSON 调用本服务 (客户端见 checkout_client.py)：
+    - 并发的相同读请求 (商品列表、手机号查会员等) 合并成一次查询 (single-flight)
+    - 各收银台的结账请求攒成小批，在一个事务里组提交 (见 AsyncSalesLogic.checkout_many)
+    - 整个服务只占用一个异步连接池，20+ 台收银机也不会撑爆数据库连接数
+    - 收银台前台用到的查询、改单、会员联想都在这里，收银台本身不连数据库 (登录和店长功能除外)，
+      积分流水也由本服务折算
+
+协议：POST /api/<方法名>，请求体为参数组成的 JSON 对象，响应 {"result": ...} 或 {"error": "..."}；
+GET /stats 查看合并与组提交的统计。每个请求都要带 X-Store-Token 头，与服务端的 STORE_SERVER_TOKEN (ASCII 字符) 一致，否则返回 401。
+
+启动：STORE_TERMINAL_ID=900 STORE_SERVER_TOKEN=xxxx python checkout_server.py --port 8765  (需要安装 aiomysql)
+默认只监听 127.0.0.1，收银台在其他机器上时用 --host (或环境变量 STORE_SERVER_HOST) 指定店内网卡地址。
+"""
+import asyncio
+import hmac
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+from async_backend import AsyncDatabase, AsyncProductLogic, AsyncSalesLogic, AsyncMemberLogic
+from backend import (
+    ProductRecord, SalesLogic, TX_METRICS, SQL_CATALOG_VERSION, SQL_STOCK_CHANGES, member_cache, points_materializer,
+)
+from checkout_client import SERVER_TOKEN, TOKEN_HEADER
+from order_id import default_terminal_id
+
+SERVER_HOST = os.environ.get('STORE_SERVER_HOST', '127.0.0.1')
+SERVER_PORT = 8765
+
+# 组提交参数：一批最多多少单；只有一单时最多再等多久 (秒) 凑批
+BATCH_MAX_SIZE = 64
+BATCH_MAX_WAIT = 0.002
+
+_STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 500: "Internal Server Error"}
+
+
+def _json_default(o):
+    if isinstance(o, ProductRecord):
+        return o.to_dict()
+    if isinstance(o, (Decimal, date, datetime)):
+        return str(o)
+    raise TypeError(f"无法序列化 {type(o).__name__}")
+
+
+class SingleFlight:
+    """相同 key 的并发调用只真正执行一次，其余等待同一个结果"""
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0  # 被合并掉的调用次数
+
+    async def do(self, key, func):
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # shield：某个等待者断开不会取消其他人共享的查询
+        return await asyncio.shield(future)
+
+
+class GroupCommitter:
+    """把各收银台的结账请求攒成小批，交给 checkout_many 一次提交"""
+
+    def __init__(self, sales, max_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT):
+        self.sales = sales
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self.batches = 0
+        self.orders = 0
+
+    async def checkout(self, clerk_id, cart_items, member_id=None):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((clerk_id, cart_items, member_id), future))
+        return await future
+
+    def _drain(self, batch):
+        while len(batch) < self.max_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def run(self):
+        while True:
+            batch = [await self._queue.get()]
+            self._drain(batch)
+            if len(batch) == 1 and self.max_wait:
+                # 上一批提交期间排队的请求会自然成批；空闲时只等一小会儿
+                await asyncio.sleep(self.max_wait)
+                self._drain(batch)
+
+            try:
+                results = await self.sales.checkout_many([order for order, _ in batch])
+            except Exception as e:
+                # 这一批整体失败也不能让循环退出，否则之后的结账请求永远等不到结果
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.orders += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class CheckoutServer:
+    """极简 HTTP/1.1 服务 (支持 keep-alive)，只处理本服务的 JSON 接口"""
+
+    def __init__(self, db, token=SERVER_TOKEN):
+        if not token:
+            raise ValueError("收银服务需要设置口令 (环境变量 STORE_SERVER_TOKEN)")
+        self.db = db
+        self.token = token.encode('utf-8')
+        self.products = AsyncProductLogic(db)
+        self.sales = AsyncSalesLogic(db, self.products.cache)
+        self.members = AsyncMemberLogic(db)
+        # 改单很少，直接在线程里调用同步版，不另写一套异步实现
+        self.sync_sales = SalesLogic()
+        self.flight = SingleFlight()
+        self.committer = GroupCommitter(self.sales)
+        # 方法名 -> (处理函数, 是否合并相同请求)
+        self.routes = {
+            'load_catalog': (self.load_catalog, True),
+            'poll_catalog': (self.poll_catalog, True),
+            'get_all_products': (self.products.get_all_products, True),
+            'get_products_by_ids': (self.products.get_products_by_ids, True),
+            'get_by_barcode': (self.products.get_by_barcode, True),
+            'get_expiring_products': (self.products.get_expiring_products, True),
+            'search_products': (self.products.search_products, True),
+            'get_low_stock_products': (self.products.get_low_stock_products, True),
+            'get_member_by_phone': (self.members.get_member_by_phone, True),
+            'suggest_members': (self.suggest_members, True),
+            'register_member': (self.members.register_member, False),
+            'checkout': (self.committer.checkout, False),
+            'get_all_orders': (self.sales.get_all_orders, True),
+            'modify_order_qty': (self.modify_order_qty, False),
+        }
+
+    async def load_catalog(self):
+        """整份商品目录和对应的版本号，收银台的本地缓存 (RemoteProductCache) 首次加载 / 版本变化时调用"""
+        cache = self.products.cache
+        await cache.refresh()
+        marks, records = cache.dump()
+        return {'marks': marks, 'products': records}
+
+    async def poll_catalog(self, since):
+        """版本号和 since 以来变过的库存，收银台每秒轮询一次"""
+        async with self.db.get_cursor() as cursor:
+            await cursor.execute(SQL_CATALOG_VERSION)
+            marks = await cursor.fetchone()
+            await cursor.execute(SQL_STOCK_CHANGES, (since,))
+            return {'marks': marks, 'stocks': await cursor.fetchall()}
+
+    async def suggest_members(self, digits, limit=8):
+        # 会员目录在内存里，只有首次加载 / 增量刷新时读库，放到线程里避免卡住事件循环
+        return await asyncio.to_thread(member_cache.suggest, digits, limit)
+
+    async def modify_order_qty(self, sale_id, new_qty, operator_id):
+        return await asyncio.to_thread(self.sync_sales.modify_order_qty, sale_id, new_qty, operator_id)
+
+    def stats(self):
+        return {
+            'reads': self.flight.calls,
+            'coalesced_reads': self.flight.shared,
+            'checkouts': self.committer.orders,
+            'commit_batches': self.committer.batches,
+            'avg_batch_size': round(self.committer.orders / self.committer.batches, 2) if self.committer.batches else 0,
+            'cache': self.products.cache.stats(),
+            'transactions': TX_METRICS.snapshot(),
+        }
+
+    async def dispatch(self, method, path, headers, body):
+        token = headers.get(TOKEN_HEADER.lower(), '').encode('utf-8')
+        if not hmac.compare_digest(token, self.token):
+            return 401, {'error': "口令错误"}
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats()
+        if method != 'POST' or not path.startswith('/api/'):
+            return 404, {'error': f"未知接口 {method} {path}"}
+        route = self.routes.get(path[len('/api/'):])
+        if route is None:
+            return 404, {'error': f"未知方法 {path}"}
+        func, coalesce = route
+        try:
+            kwargs = json.loads(body or b'{}')
+        except ValueError:
+            return 400, {'error': "请求体不是合法的 JSON"}
+
+        try:
+            if coalesce:
+                key = (path, json.dumps(kwargs, sort_keys=True))
+                result = await self.flight.do(key, lambda: func(**kwargs))
+            else:
+                result = await func(**kwargs)
+        except TypeError as e:
+            return 400, {'error': f"参数错误: {e}"}
+        except Exception as e:
+            return 500, {'error': str(e)}
+        return 200, {'result': result}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+                status, payload = await self.dispatch(method, path, headers, body)
+                data = json.dumps(payload, ensure_ascii=False, default=_json_default).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {_STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # 客户端断开或请求格式错误，直接关闭连接
+        finally:
+            writer.close()
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT):
+        await self.db.connect()
+        points_materializer.ensure_started()  # 结账只追加积分流水，由它折算进会员余额
+        committer = asyncio.ensure_future(self.committer.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"收银服务已启动: http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            committer.cancel()
+            await self.db.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="多收银台收银服务")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    try:
+        default_terminal_id()  # 订单号由本服务生成，同样需要唯一的收银台编号
+        server = CheckoutServer(AsyncDatabase())
+    except (RuntimeError, ValueError) as e:
+        raise SystemExit(e)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,150 @@
+"""
+登录凭据
+
+密码用 scrypt (标准库 hashlib，内存密集型) 加盐哈希后保存，格式：
+    scrypt$N$r$p$盐(base64)$哈希(base64)
+成本参数 N 可通过环境变量 STORE_SCRYPT_N 调整，python credentials.py 可以测出各档 N 的耗时，
+按登录允许的延迟挑选；旧参数 (或明文) 的密码在下次登录成功时自动按新参数重新哈希。
+
+登录成功后把会话缓存在内存里：同一账号在过期前重新登录 (交班、退出后再进) 只查一次账号、
+做一次 HMAC 校验，不再跑 scrypt；库里的密码哈希变了 (别的收银台改了密码) 或账号没了，会话随即作废。
+HMAC 密钥每次启动随机生成，会话不落盘。
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+SCRYPT_N = int(os.environ.get('STORE_SCRYPT_N', 2 ** 14))  # 约 16MB 内存，普通 PC 上几十毫秒
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+PREFIX = 'scrypt'
+
+SESSION_TTL = 15 * 60  # 会话有效期 (秒)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=HASH_BYTES)
+
+
+def hash_password(password, n=None, r=SCRYPT_R, p=SCRYPT_P):
+    """加盐哈希，返回可直接存进 users.password 的字符串"""
+    n = n or SCRYPT_N
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f"{PREFIX}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def is_hashed(stored):
+    return stored.startswith(PREFIX + '$')
+
+
+def verify_password(password, stored):
+    """
+    校验密码 (常量时间比较)
+    :return: (是否正确, 是否需要按当前参数重新哈希)
+    """
+    if not is_hashed(stored):
+        # 迁移前的明文密码
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8')), True
+    try:
+        _, n, r, p, salt, expected = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        digest = _scrypt(password, base64.b64decode(salt), n, r, p)
+    except ValueError:
+        return False, False
+    ok = hmac.compare_digest(digest, base64.b64decode(expected))
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# 账号不存在时也算一次哈希，避免通过响应时间判断账号是否存在
+_DUMMY_HASH = None
+
+
+def burn_time(password):
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = hash_password(secrets.token_hex(8))
+    verify_password(password, _DUMMY_HASH)
+
+
+class SessionCache:
+    """
+    最近登录成功的会话 (线程安全)
+    记下口令的 HMAC 和当时库里的密码哈希；重新登录时口令 HMAC 一致、且库里的哈希没有变过才算通过，
+    所以别的收银台改了密码或删了账号会立即生效，不用等会话过期
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._lock = threading.Lock()
+        self._by_username = {}  # 用户名 -> (口令 HMAC, 密码哈希, 用户信息, 过期时间)
+
+    def _password_mac(self, username, password):
+        return hmac.new(self._key, f"{username}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+
+    def remember(self, user, password, stored):
+        """登录成功后记下会话；stored 为此时 users.password 里的值"""
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._by_username[user['username']] = (self._password_mac(user['username'], password), stored,
+                                                   dict(user), expires)
+
+    def login(self, username, password, stored):
+        """
+        用缓存的会话快速重新登录
+        :param stored: 库里当前的密码哈希
+        :return: 口令一致、哈希未变且未过期时返回用户信息，否则返回 None
+        """
+        with self._lock:
+            entry = self._by_username.get(username)
+        if entry is None:
+            return None
+        password_mac, cached_stored, user, expires = entry
+        if expires < time.time() or not hmac.compare_digest(cached_stored, stored):
+            self.forget(username)
+            return None
+        if not hmac.compare_digest(password_mac, self._password_mac(username, password)):
+            return None
+        return dict(user)
+
+    def forget(self, username=None, user_id=None):
+        """删除用户或修改密码后作废其会话"""
+        with self._lock:
+            for name, (_, _, user, _) in list(self._by_username.items()):
+                if name == username or user['id'] == user_id:
+                    del self._by_username[name]
+
+
+if __name__ == '__main__':
+    # 按登录延迟预算挑选 N：列出各档 N 的单次哈希耗时
+    password = "benchmark-password"
+    for exponent in range(12, 19):
+        n = 2 ** exponent
+        start = time.perf_counter()
+        stored = hash_password(password, n=n)
+        elapsed = time.perf_counter() - start
+        assert verify_password(password, stored)[0]
+        mark = "  <- 当前" if n == SCRYPT_N else ""
+        print(f"N=2^{exponent:<2} 内存 {128 * n * SCRYPT_R / 2 ** 20:>4.0f} MB  耗时 {elapsed * 1e3:7.1f} ms{mark}")
+
+    sessions = SessionCache()
+    user = {'id': 1, 'username': 'demo', 'role': 'Clerk'}
+    sessions.remember(user, password, stored)
+    start = time.perf_counter()
+    for _ in range(10000):
+        assert sessions.login('demo', password, stored)
+    print(f"会话快速登录: {(time.perf_counter() - start) / 10000 * 1e6:.1f} µs/次")
+    assert sessions.login('demo', 'wrong', stored) is None
+    assert sessions.login('demo', password, hash_password(password)) is None  # 别处改过密码，会话作废
+    assert sessions.login('demo', password, stored) is None
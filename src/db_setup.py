@@ -1,5 +1,13 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
 import pymysql
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSCursor
+
+from credentials import hash_password, is_hashed
 
 DB_CONFIG = {
     'host': 'localhost',
@@ -9,7 +17,352 @@ DB_CONFIG = {
     'autocommit': True
 }
 
-DB_NAME = 'convenience_store_db'
+# 基准测试 (bench.py) 通过环境变量改用单独的测试库
+DB_NAME = os.environ.get('STORE_DB_NAME', 'convenience_store_db')
+
+# 连接池参数
+POOL_MAX_SIZE = 8        # 最大连接数
+POOL_MAX_IDLE = 300      # 空闲超过该秒数的连接直接丢弃
+POOL_TIMEOUT = 10        # 借连接的最长等待秒数
+
+STREAM_CHUNK_SIZE = 1000  # 服务端游标每次取的行数
+
+# 死锁 (1213) / 锁等待超时 (1205)：只是事务被回滚，连接本身仍然可用
+LOCK_ERROR_CODES = (1205, 1213)
+
+
+class ConnectionPool:
+    """
+    有界、线程安全的连接池
+    借出时 ping 一次做健康检查，归还时记录时间用于空闲淘汰
+    """
+
+    def __init__(self, db_name, max_size=POOL_MAX_SIZE, max_idle=POOL_MAX_IDLE, timeout=POOL_TIMEOUT):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []  # [(conn, 归还时间)]，后进先出，热连接优先复用
+        self._size = 0  # 当前存在的连接数 (空闲 + 借出)
+        self._cond = threading.Condition()
+        # 统计
+        self.opened = 0
+        self.checkouts = 0
+
+    def _open(self):
+        config = DB_CONFIG.copy()
+        config['database'] = self.db_name
+        conn = pymysql.connect(**config)
+        with self._cond:
+            self.opened += 1
+        return conn
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        """淘汰空闲过久的连接（需持有锁）"""
+        fresh = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.max_idle:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                fresh.append((conn, last_used))
+        self._idle = fresh
+
+    def acquire(self):
+        """借出一个可用连接，池满时等待"""
+        deadline = time.monotonic() + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                self._evict_idle(time.monotonic())
+                if self._idle:
+                    conn = self._idle.pop()[0]
+                    break
+                if self._size < self.max_size:
+                    self._size += 1  # 先占位，在锁外建连接
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("数据库连接池已满，等待超时")
+                self._cond.wait(remaining)
+            self.checkouts += 1
+
+        try:
+            if conn is None:
+                return self._open()
+            # 健康检查：断开的连接直接换新的
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except Exception:
+                self._discard(conn)
+                return self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        """归还连接"""
+        with self._cond:
+            if broken or not conn.open:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._cond:
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        """连接池统计：累计新建连接数 / 累计借出次数"""
+        with self._cond:
+            return {
+                'opened': self.opened,
+                'checkouts': self.checkouts,
+                'size': self._size,
+                'idle': len(self._idle),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# ================= 数据库迁移 =================
+# 每一步迁移都必须是幂等的：重复执行不报错、不重复建索引/加列
+
+def _index_exists(cursor, table, index_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (table, index_name))
+    return cursor.fetchone() is not None
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+        (table, column))
+    return cursor.fetchone() is not None
+
+
+def _add_index(cursor, table, index_name, columns, unique=False):
+    if not _index_exists(cursor, table, index_name):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        cursor.execute(f"ALTER TABLE {table} ADD {kind} {index_name} ({columns})")
+
+
+def _m001_sales_indexes(cursor):
+    """销售流水与修改日志的热点查询索引"""
+    # 报表/分钟走势按时间范围过滤
+    _add_index(cursor, 'sales', 'idx_sales_time', 'sale_time')
+    # 订单号归并、小票
+    _add_index(cursor, 'sales', 'idx_sales_order', 'order_id')
+    # 店员查看自己的订单，按时间倒序
+    _add_index(cursor, 'sales', 'idx_sales_user_time', 'user_id, sale_time')
+    # 会员消费记录
+    _add_index(cursor, 'sales', 'idx_sales_member_time', 'member_id, sale_time')
+    _add_index(cursor, 'modification_logs', 'idx_logs_time', 'log_time')
+    _add_index(cursor, 'modification_logs', 'idx_logs_sale', 'sale_id')
+
+
+def _m002_product_indexes(cursor):
+    """商品表的查询索引"""
+    _add_index(cursor, 'products', 'idx_products_name', 'name')
+    _add_index(cursor, 'products', 'idx_products_category', 'category')
+    # 临期查询
+    _add_index(cursor, 'products', 'idx_products_expire', 'expire_date')
+    # 低库存预警 (stock < min_stock_alert) 走覆盖索引
+    _add_index(cursor, 'products', 'idx_products_stock_alert', 'stock, min_stock_alert')
+
+
+def _m003_sales_rollups(cursor):
+    """销售汇总表：结账时同事务维护，报表直接读汇总"""
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sales_daily_product (
+        sale_date DATE NOT NULL,
+        product_id INT NOT NULL,
+        qty INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        profit DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (sale_date, product_id),
+        INDEX idx_sdp_product (product_id)
+    )""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sales_hourly_category (
+        sale_hour DATETIME NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        qty INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        profit DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (sale_hour, category),
+        INDEX idx_shc_category (category)
+    )""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sales_daily_store (
+        sale_date DATE NOT NULL PRIMARY KEY,
+        qty INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        profit DECIMAL(14, 2) NOT NULL DEFAULT 0
+    )""")
+    # 历史数据在 _m010 表结构定型后回填
+
+
+ROLLUP_TABLES = ('sales_daily_product', 'sales_hourly_category', 'sales_daily_store')
+
+# 三张汇总表分别由 sales 原始流水聚合而来 (分类按销售时的分类快照)
+ROLLUP_SOURCES = {
+    'sales_daily_product': """
+        SELECT DATE(s.sale_time) AS k1, s.product_id AS k2,
+               SUM(s.quantity) AS qty, SUM(s.total_price) AS revenue,
+               SUM((s.sell_price_snapshot - s.buy_price_snapshot) * s.quantity) AS profit
+        FROM sales s
+        GROUP BY k1, k2""",
+    'sales_hourly_category': """
+        SELECT DATE_FORMAT(s.sale_time, '%Y-%m-%d %H:00:00') AS k1, COALESCE(s.category_snapshot, p.category) AS k2,
+               SUM(s.quantity) AS qty, SUM(s.total_price) AS revenue,
+               SUM((s.sell_price_snapshot - s.buy_price_snapshot) * s.quantity) AS profit
+        FROM sales s
+        JOIN products p ON s.product_id = p.id
+        GROUP BY k1, k2""",
+    'sales_daily_store': """
+        SELECT DATE(s.sale_time) AS k1,
+               SUM(s.quantity) AS qty, SUM(s.total_price) AS revenue,
+               SUM((s.sell_price_snapshot - s.buy_price_snapshot) * s.quantity) AS profit
+        FROM sales s
+        GROUP BY k1""",
+}
+
+ROLLUP_KEYS = {
+    'sales_daily_product': ('sale_date', 'product_id'),
+    'sales_hourly_category': ('sale_hour', 'category'),
+    'sales_daily_store': ('sale_date', None),
+}
+
+
+def _backfill_rollups(cursor):
+    """用 sales 原始流水重建全部汇总表 (全部写进 0 号分片)"""
+    for table in ROLLUP_TABLES:
+        k1, k2 = ROLLUP_KEYS[table]
+        columns = f"{k1}, {k2}, qty, revenue, profit" if k2 else f"{k1}, qty, revenue, profit"
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"INSERT INTO {table} ({columns}) {ROLLUP_SOURCES[table]}")
+
+
+def _m004_catalog_version(cursor):
+    """商品目录版本号：商品增删改、导入时 +1，各收银台据此判断缓存是否需要整体重新加载"""
+    cursor.execute("""CREATE TABLE IF NOT EXISTS catalog_version (
+        id TINYINT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )""")
+    cursor.execute("INSERT IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+
+
+def _m005_product_barcode(cursor):
+    """商品条形码，扫码枪直接按条码加购"""
+    if not _column_exists(cursor, 'products', 'barcode'):
+        cursor.execute("ALTER TABLE products ADD COLUMN barcode VARCHAR(32) DEFAULT NULL AFTER id")
+    _add_index(cursor, 'products', 'uk_products_barcode', 'barcode', unique=True)
+
+
+def _m006_points_ledger(cursor):
+    """会员积分流水：结账只追加流水，由后台线程定期折算进 members.points"""
+    cursor.execute("""CREATE TABLE IF NOT EXISTS points_ledger (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        member_id INT NOT NULL,
+        delta INT NOT NULL,
+        reason VARCHAR(20) NOT NULL,
+        order_id VARCHAR(50) DEFAULT NULL,
+        folded TINYINT NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_ledger_member (member_id, id),
+        INDEX idx_ledger_pending (folded, member_id)
+    )""")
+
+
+def _m007_password_hash(cursor):
+    """密码改为 scrypt 加盐哈希：加宽字段，一次性把现有明文密码重新哈希"""
+    cursor.execute("ALTER TABLE users MODIFY password VARCHAR(255) NOT NULL")
+    cursor.execute("SELECT id, password FROM users")
+    for row in cursor.fetchall():
+        if not is_hashed(row['password']):
+            cursor.execute("UPDATE users SET password=%s WHERE id=%s", (hash_password(row['password']), row['id']))
+
+
+def _m008_modification_qty(cursor):
+    """改单日志记下改前 / 改后数量，看板据此增量修正统计"""
+    if not _column_exists(cursor, 'modification_logs', 'old_qty'):
+        cursor.execute("ALTER TABLE modification_logs ADD COLUMN old_qty INT DEFAULT NULL, "
+                       "ADD COLUMN new_qty INT DEFAULT NULL")
+
+
+def _m009_sale_category(cursor):
+    """销售流水记下销售时的商品分类，商品改分类后分类汇总仍按原分类统计"""
+    if not _column_exists(cursor, 'sales', 'category_snapshot'):
+        cursor.execute("ALTER TABLE sales ADD COLUMN category_snapshot VARCHAR(50) DEFAULT NULL")
+    cursor.execute("UPDATE sales s JOIN products p ON s.product_id = p.id "
+                   "SET s.category_snapshot = p.category WHERE s.category_snapshot IS NULL")
+
+
+def _m010_rollup_shards(cursor):
+    """
+    汇总表主键加上分片号：每笔结账随机累加到同一键的某一个分片，
+    并发结账不再抢同一行 (例如当天的全店汇总)，读的时候按键 SUM 所有分片
+    """
+    for table in ROLLUP_TABLES:
+        if not _column_exists(cursor, table, 'shard'):
+            keys = ", ".join(k for k in ROLLUP_KEYS[table] if k)
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN shard TINYINT NOT NULL DEFAULT 0, "
+                           f"DROP PRIMARY KEY, ADD PRIMARY KEY ({keys}, shard)")
+    # 分类改按销售时的快照统计，重建一次
+    _backfill_rollups(cursor)
+
+
+def _m011_product_updated_at(cursor):
+    """商品行的最后修改时间：结账不再改目录版本号，各收银台按它轮询最近变过的库存"""
+    if not _column_exists(cursor, 'products', 'updated_at'):
+        cursor.execute("ALTER TABLE products ADD COLUMN updated_at DATETIME(6) NOT NULL "
+                       "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)")
+    _add_index(cursor, 'products', 'idx_products_updated', 'updated_at')
+
+
+# (版本号, 说明, 迁移函数)，版本号必须递增
+MIGRATIONS = [
+    (1, "sales/modification_logs 索引", _m001_sales_indexes),
+    (2, "products 索引", _m002_product_indexes),
+    (3, "销售汇总表", _m003_sales_rollups),
+    (4, "商品目录版本号", _m004_catalog_version),
+    (5, "商品条形码", _m005_product_barcode),
+    (6, "会员积分流水", _m006_points_ledger),
+    (7, "密码哈希", _m007_password_hash),
+    (8, "改单日志数量", _m008_modification_qty),
+    (9, "销售流水分类快照", _m009_sale_category),
+    (10, "汇总表分片", _m010_rollup_shards),
+    (11, "商品修改时间", _m011_product_updated_at),
+]
+
+
+def get_pool(db_name=DB_NAME):
+    """同一个库在进程内共享一个连接池"""
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(db_name)
+        return pool
+
 
 class DatabaseManager:
     def __init__(self, db_name=DB_NAME):
@@ -17,6 +370,82 @@ class DatabaseManager:
         self.conn = None
         self.cursor = None
 
+    @property
+    def pool(self):
+        return get_pool(self.db_name)
+
+    @contextmanager
+    def get_cursor(self, cursor_class=DictCursor):
+        """从连接池借一个连接，返回游标，退出时自动归还"""
+        pool = self.pool
+        conn = pool.acquire()
+        broken = False
+        try:
+            with conn.cursor(cursor_class) as cursor:
+                yield cursor
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            broken = not (e.args and e.args[0] in LOCK_ERROR_CODES)
+            raise
+        finally:
+            pool.release(conn, broken=broken)
+
+    @contextmanager
+    def transaction(self):
+        """事务上下文：正常退出提交，异常回滚"""
+        with self.get_cursor() as cursor:
+            conn = cursor.connection
+            conn.begin()
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                try:
+                    conn.rollback()
+                except pymysql.Error:
+                    pass
+                raise
+
+    @contextmanager
+    def snapshot(self, cursor_class=DictCursor):
+        """
+        只读一致性快照：块内的多条查询看到同一时刻已提交的数据
+        cursor_class 传 SSCursor 时可以在快照里逐块读大结果集 (读完一条查询的结果再执行下一条)
+        """
+        with self.get_cursor(cursor_class) as cursor:
+            conn = cursor.connection
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+            try:
+                yield cursor
+            finally:
+                try:
+                    conn.commit()
+                except pymysql.Error:
+                    pass
+
+    def stream(self, sql, params=None, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        服务端游标 (SSCursor) 逐块读取查询结果的生成器，每行是一个具名元组 (row.id / row[0])
+        内存占用与结果集大小无关；迭代期间一直占用一条连接，不要在迭代中再做写操作
+        中途停止迭代时直接丢弃这条连接，而不是把剩下的结果读完
+        """
+        pool = self.pool
+        conn = pool.acquire()
+        finished = False
+        try:
+            cursor = conn.cursor(SSCursor)
+            cursor.execute(sql, params)
+            row_type = namedtuple('Row', [col[0] for col in cursor.description], rename=True)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row_type._make(row)
+            cursor.close()
+            finished = True
+        finally:
+            pool.release(conn, broken=not finished)
+
     def connect(self, use_db=True):
         """建立数据库连接"""
         if self.conn and self.conn.open:
@@ -57,6 +486,8 @@ class DatabaseManager:
 
         self._create_tables()
 
+        self.migrate()
+
         self._seed_data()
 
         self.close()
@@ -67,7 +498,7 @@ class DatabaseManager:
             """CREATE TABLE IF NOT EXISTS users (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 username VARCHAR(50) NOT NULL UNIQUE,
-                password VARCHAR(100) NOT NULL,
+                password VARCHAR(255) NOT NULL,
                 role VARCHAR(20) NOT NULL,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )""",
@@ -115,6 +546,73 @@ class DatabaseManager:
         for sql in tables:
             self.execute_query(sql)
 
+    def migrate(self):
+        """按版本顺序执行尚未应用的迁移，返回本次应用的版本号"""
+        self.connect()
+        self.execute_query("""CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+        # 多个收银台同时启动时，只允许一个进程执行迁移
+        self.cursor.execute("SELECT GET_LOCK('schema_migrate', 30) AS locked")
+        if not self.cursor.fetchone()['locked']:
+            raise TimeoutError("等待数据库迁移锁超时")
+        try:
+            self.cursor.execute("SELECT version FROM schema_version")
+            applied = {row['version'] for row in self.cursor.fetchall()}
+
+            done = []
+            for version, description, step in MIGRATIONS:
+                if version in applied:
+                    continue
+                step(self.cursor)
+                self.cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                                    (version, description))
+                done.append(version)
+            return done
+        finally:
+            self.cursor.execute("SELECT RELEASE_LOCK('schema_migrate')")
+
+    def backfill_rollups(self):
+        """重建销售汇总表（应在无人收银时执行）"""
+        self.connect()
+        self.conn.begin()
+        try:
+            _backfill_rollups(self.cursor)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def check_rollups(self):
+        """
+        对比汇总表与 sales 原始流水
+        :return: 不一致项列表 [(表名, 键, 汇总表值, 原始流水值)]，为空表示一致
+        """
+        self.connect()
+        mismatches = []
+        for table in ROLLUP_TABLES:
+            k1, k2 = ROLLUP_KEYS[table]
+            key_cols = f"{k1} AS k1, {k2} AS k2" if k2 else f"{k1} AS k1"
+            group = "k1, k2" if k2 else "k1"
+            self.cursor.execute(f"SELECT {key_cols}, SUM(qty) AS qty, SUM(revenue) AS revenue, SUM(profit) AS profit "
+                                f"FROM {table} GROUP BY {group}")
+            rollup = {(str(r['k1']), r.get('k2')): (int(r['qty']), r['revenue'], r['profit'])
+                      for r in self.cursor.fetchall()}
+            self.cursor.execute(ROLLUP_SOURCES[table])
+            raw = {(str(r['k1']), r.get('k2')): (int(r['qty']), r['revenue'], r['profit'])
+                   for r in self.cursor.fetchall()}
+
+            zero = (0, 0, 0)
+            for key in rollup.keys() | raw.keys():
+                got = rollup.get(key, zero)
+                expected = raw.get(key, zero)
+                if tuple(map(float, got)) != tuple(map(float, expected)):
+                    mismatches.append((table, key, got, expected))
+        return mismatches
+
     def _seed_data(self):
         """重置并填充测试数据"""
         self.execute_query("SET FOREIGN_KEY_CHECKS = 0")
@@ -123,11 +621,15 @@ class DatabaseManager:
         self.execute_query("TRUNCATE TABLE products")
         self.execute_query("TRUNCATE TABLE users")
         self.execute_query("TRUNCATE TABLE members")
+        self.execute_query("TRUNCATE TABLE points_ledger")
+        for table in ROLLUP_TABLES:
+            self.execute_query(f"TRUNCATE TABLE {table}")
         self.execute_query("SET FOREIGN_KEY_CHECKS = 1")
 
 
         self.execute_query(
-            "INSERT INTO users (id, username, password, role) VALUES (1, '1', '1', 'Manager'), (2, '2', '2', 'Clerk')")
+            "INSERT INTO users (id, username, password, role) VALUES (1, '1', %s, 'Manager'), (2, '2', %s, 'Clerk')",
+            (hash_password('1'), hash_password('2')))
 
 
         self.execute_query(
@@ -136,27 +638,29 @@ class DatabaseManager:
 
 
         products_sql = """
-        INSERT INTO products (id, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date) VALUES
-        (1, '可口可乐', '饮料', 2.00, 3.50, 100, 20, '2026-12-31'),
-        (2, '康师傅红烧牛肉面', '食品', 3.50, 5.00, 50, 10, '2026-06-30'),
-        (3, '晨光笔记本', '文具', 5.00, 8.00, 5, 10, NULL),
-        (4, '乐事薯片(原味)', '零食', 4.00, 7.00, 80, 15, '2026-03-15'),
-        (5, '农夫山泉', '饮料', 1.00, 2.00, 120, 20, '2027-01-01'),
-        (6, '德芙巧克力', '零食', 8.00, 12.00, 40, 10, '2026-10-01'),
-        (7, '中华铅笔(HB)', '文具', 0.50, 1.00, 200, 50, NULL)
+        INSERT INTO products (id, barcode, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date) VALUES
+        (1, '6954767410173', '可口可乐', '饮料', 2.00, 3.50, 100, 20, '2026-12-31'),
+        (2, '6900873000012', '康师傅红烧牛肉面', '食品', 3.50, 5.00, 50, 10, '2026-06-30'),
+        (3, '6921734900012', '晨光笔记本', '文具', 5.00, 8.00, 5, 10, NULL),
+        (4, '6924743915763', '乐事薯片(原味)', '零食', 4.00, 7.00, 80, 15, '2026-03-15'),
+        (5, '6921168509256', '农夫山泉', '饮料', 1.00, 2.00, 120, 20, '2027-01-01'),
+        (6, '6914973600010', '德芙巧克力', '零食', 8.00, 12.00, 40, 10, '2026-10-01'),
+        (7, '6901234567892', '中华铅笔(HB)', '文具', 0.50, 1.00, 200, 50, NULL)
         """
         self.execute_query(products_sql)
+        # 商品表被重置，让各收银台的商品缓存失效
+        self.execute_query("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
 
 
         sales_sql = """
-        INSERT INTO sales (order_id, product_id, user_id, quantity, buy_price_snapshot, sell_price_snapshot, total_price, sale_time, member_id) VALUES
-        ('20251001083001', 5, 2, 2, 1.00, 2.00, 4.00, CONCAT(CURDATE(), ' 08:30:00'), 1),
-        ('20251001083002', 2, 2, 1, 3.50, 5.00, 5.00, CONCAT(CURDATE(), ' 08:30:00'), 1),
-        ('20251001121501', 3, 2, 5, 5.00, 8.00, 40.00, CONCAT(CURDATE(), ' 12:15:00'), NULL),
-        ('20251001154501', 1, 2, 10, 2.00, 3.50, 35.00, CONCAT(CURDATE(), ' 15:45:00'), 2),
-        ('20251001154501', 4, 2, 5, 4.00, 7.00, 35.00, CONCAT(CURDATE(), ' 15:45:00'), 2),
-        ('20251001200001', 6, 2, 3, 8.00, 12.00, 36.00, CONCAT(CURDATE(), ' 20:00:00'), NULL),
-        ('20251001223001', 1, 2, 1, 2.00, 3.50, 3.50, CONCAT(CURDATE(), ' 22:30:00'), NULL)
+        INSERT INTO sales (order_id, product_id, user_id, quantity, buy_price_snapshot, sell_price_snapshot, total_price, sale_time, member_id, category_snapshot) VALUES
+        ('20251001083001', 5, 2, 2, 1.00, 2.00, 4.00, CONCAT(CURDATE(), ' 08:30:00'), 1, '饮料'),
+        ('20251001083002', 2, 2, 1, 3.50, 5.00, 5.00, CONCAT(CURDATE(), ' 08:30:00'), 1, '食品'),
+        ('20251001121501', 3, 2, 5, 5.00, 8.00, 40.00, CONCAT(CURDATE(), ' 12:15:00'), NULL, '文具'),
+        ('20251001154501', 1, 2, 10, 2.00, 3.50, 35.00, CONCAT(CURDATE(), ' 15:45:00'), 2, '饮料'),
+        ('20251001154501', 4, 2, 5, 4.00, 7.00, 35.00, CONCAT(CURDATE(), ' 15:45:00'), 2, '零食'),
+        ('20251001200001', 6, 2, 3, 8.00, 12.00, 36.00, CONCAT(CURDATE(), ' 20:00:00'), NULL, '零食'),
+        ('20251001223001', 1, 2, 1, 2.00, 3.50, 3.50, CONCAT(CURDATE(), ' 22:30:00'), NULL, '饮料')
         """
         self.execute_query(sales_sql)
 
@@ -164,7 +668,26 @@ class DatabaseManager:
         self.execute_query(
             "INSERT INTO modification_logs (sale_id, operator_id, action_type, details, log_time) VALUES (1, 2, 'MODIFY', '将数量从1修改为2', NOW())")
 
+        _backfill_rollups(self.cursor)
+
 
 if __name__ == '__main__':
+    import sys
+
     manager = DatabaseManager(DB_NAME)
-    manager.init_database(hard_reset=True)
+    if '--migrate' in sys.argv:
+        # 只升级表结构，不动现有数据
+        print(f"已应用迁移: {manager.migrate()}")
+        manager.close()
+    elif '--backfill-rollups' in sys.argv:
+        manager.backfill_rollups()
+        print("汇总表已重建")
+        manager.close()
+    elif '--check-rollups' in sys.argv:
+        problems = manager.check_rollups()
+        for table, key, got, expected in problems:
+            print(f"[{table}] {key}: 汇总={got} 流水={expected}")
+        print("汇总表与流水一致" if not problems else f"发现 {len(problems)} 处不一致")
+        manager.close()
+    else:
+        manager.init_database(hard_reset=True)
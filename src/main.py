@@ -1,13 +1,23 @@
+import os
 import ttkbootstrap as ttk
 import tkinter.ttk as tk_ttk
 import tkinter as tk
 import matplotlib.pyplot as plt
 from ttkbootstrap.constants import *
 from tkinter import simpledialog
-from tkinter import messagebox, Toplevel
+from tkinter import messagebox, Toplevel, filedialog
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from backend import AuthLogic, ProductLogic, SalesLogic, UserLogic, MemberLogic
+from backend import AuthLogic, ProductLogic, SalesLogic, UserLogic, MemberLogic, Cart, points_materializer
+from db_setup import DatabaseManager, DB_NAME
 from datetime import datetime, timedelta
+from widgets import BackgroundRunner, VirtualTreeview, sync_treeview, put_treeview_row, drop_treeview_row
+from checkout_client import SERVER_TOKEN, CheckoutClient, RemoteProductLogic, RemoteSalesLogic, RemoteMemberLogic
+from product_io import import_products, export_products
+from analytics import SalesAnalytics, WINDOW_DAYS as ANALYTICS_WINDOW_DAYS
+from order_id import default_terminal_id
+
+# 收银服务地址 (如 http://192.168.1.10:8765)：设置后收银台走客户端模式，为空则直连数据库
+SERVER_URL = os.environ.get('STORE_SERVER_URL')
 
 
 class LoginFrame(ttk.Frame):
@@ -51,13 +61,21 @@ class LoginFrame(ttk.Frame):
         self.entry_pass.bind("<Return>", lambda event: self.attempt_login())
 
         # 登录按钮
-        btn_login = ttk.Button(container, text="立即登录", bootstyle="primary", command=self.attempt_login, width=20)
-        btn_login.pack(pady=(20, 0))
+        self.btn_login = ttk.Button(container, text="立即登录", bootstyle="primary", command=self.attempt_login, width=20)
+        self.btn_login.pack(pady=(20, 0))
 
         self.auth = AuthLogic()
+        # 密码校验 (scrypt) 要几十毫秒，放到后台线程，避免界面卡住
+        self.bg = BackgroundRunner(self, max_workers=1)
+
+    def destroy(self):
+        self.bg.shutdown()
+        super().destroy()
 
     def attempt_login(self):
         """处理登录逻辑"""
+        if self.btn_login.instate(['disabled']):
+            return  # 上一次登录还在校验
         username = self.entry_user.get().strip()
         password = self.entry_pass.get().strip()
 
@@ -65,12 +83,15 @@ class LoginFrame(ttk.Frame):
             messagebox.showwarning("提示", "请输入账号和密码")
             return
 
-        user = self.auth.login(username, password)
+        self.btn_login.configure(state=DISABLED, text="登录中...")
+        self.bg.submit("login", lambda: self.auth.login(username, password), self._on_login_done)
 
+    def _on_login_done(self, user):
         if user:
             # 登录成功，调用主程序的回调函数，传入用户信息
             self.login_callback(user)
         else:
+            self.btn_login.configure(state=NORMAL, text="立即登录")
             messagebox.showerror("登录失败", "账号或密码错误")
 
 
@@ -88,10 +109,15 @@ class ManagerDashboard(ttk.Frame):
         self.sales_logic = SalesLogic()
         self.user_logic = UserLogic()
         self.member_logic = MemberLogic()
+        # 报表数据：默认由 SalesLogic 增量统计全部历史；设置了统计窗口 (STORE_ANALYTICS_DAYS) 时改用本地列存缓存
+        self.analytics = SalesAnalytics() if ANALYTICS_WINDOW_DAYS else None
 
         # 标志位：防止重复初始化
         self.is_chart_initialized = False
 
+        # 报表查询放到后台线程，避免界面卡顿
+        self.bg = BackgroundRunner(self)
+
         self._init_header(logout_callback)
 
         self.notebook = ttk.Notebook(self)
@@ -128,11 +154,14 @@ class ManagerDashboard(ttk.Frame):
         ttk.Button(header, text="注销退出", bootstyle="danger-outline",
                    command=logout_callback).pack(side=RIGHT)
 
+    def destroy(self):
+        self.bg.shutdown()
+        super().destroy()
+
     def on_tab_change(self, event):
         """切换到报表页刷新数据"""
         if self.notebook.index(self.notebook.select()) == 1:
-            # 延时
-            self.after(50, self.refresh_report_data)
+            self.refresh_report_data()
 
     # ================= Tab 1: 商品管理 =================
     def _init_product_tab(self):
@@ -161,11 +190,23 @@ class ManagerDashboard(ttk.Frame):
                                      command=self.show_expiring_goods)
         self.btn_expire.pack(side=LEFT, padx=10)
 
+        ttk.Button(toolbar, text="批量导入", bootstyle="secondary", command=self.import_products_file).pack(
+            side=LEFT, padx=10)
+        ttk.Button(toolbar, text="导出商品", bootstyle="secondary-outline", command=self.export_products_file).pack(
+            side=LEFT)
+
         ttk.Label(toolbar, text="* 红色高亮代表库存不足", bootstyle="danger", font=("微软雅黑", 9)).pack(side=RIGHT)
 
         # --- 3. 表格区域 ---
         cols = ("id", "name", "category", "in_price", "out_price", "stock", "alert", "expire")
-        self.tree_prod = ttk.Treeview(self.tab_product, columns=cols, show="headings", selectmode="browse")
+        # 分页虚拟列表：只加载可视范围附近的数据
+        self.prod_list = VirtualTreeview(
+            self.tab_product, cols,
+            fetch_page=lambda after, limit: self.prod_logic.get_all_products(limit=limit, after_key=after),
+            key_func=lambda p: p['id'],
+            row_func=self._product_row,
+            runner=self.bg, selectmode="browse")
+        self.tree_prod = self.prod_list.tree
 
         headers = ["ID", "商品名称", "分类", "进价", "售价", "库存", "预警线", "临期时间"]
 
@@ -183,11 +224,7 @@ class ManagerDashboard(ttk.Frame):
             # 3. 临期 (黄色背景)
             self.tree_prod.tag_configure("expiring", background="#FFF8DC", foreground="#FF8C00")
 
-        scroll = ttk.Scrollbar(self.tab_product, orient=VERTICAL, command=self.tree_prod.yview)
-        self.tree_prod.configure(yscrollcommand=scroll.set)
-
-        self.tree_prod.pack(side=LEFT, fill=BOTH, expand=True)
-        scroll.pack(side=RIGHT, fill=Y)
+        self.prod_list.pack(fill=BOTH, expand=True)
 
         # 右键菜单
         self.menu_prod = tk.Menu(self, tearoff=0)
@@ -213,26 +250,18 @@ class ManagerDashboard(ttk.Frame):
             messagebox.showinfo("结果", "没有过期或临期的商品。")
             return
 
-            # 2. 清空列表
-        for item in self.tree_prod.get_children():
-            self.tree_prod.delete(item)
-
+        # 2. 显示查询结果
         today = datetime.now().date()  # 获取今天日期用于比对
 
-        for p in products:
+        def expiring_row(p):
             # 逻辑判断：给不同的 tag
-            tags = ()
-            p_date = p['expire_date']
-
-            if p_date < today:
+            if p['expire_date'] < today:
                 tags = ("expired",)  # 已过期
             else:
                 tags = ("expiring",)  # 快过期
+            return self._product_row(p)[0], tags
 
-            self.tree_prod.insert("", END, values=(
-                p['id'], p['name'], p['category'], p['buy_price'], p['sell_price'],
-                p['stock'], p['min_stock_alert'], p['expire_date']
-            ), tags=tags)
+        self.prod_list.show_rows(products, expiring_row)
 
         # 3. 按钮变身
         self.btn_expire.configure(
@@ -243,38 +272,38 @@ class ManagerDashboard(ttk.Frame):
 
         messagebox.showwarning("预警", f"注意：发现 {len(products)} 个风险商品（含过期）！")
 
-    def refresh_product_list(self):
-        """刷新列表"""
-        for item in self.tree_prod.get_children():
-            self.tree_prod.delete(item)
-
-        products = self.prod_logic.get_all_products()
+    @staticmethod
+    def _product_row(p):
+        """商品行 -> (表格各列的值, 标签)"""
+        tags = []  # 使用列表以便叠加多个标签
         today = datetime.now().date()  # 获取今天
 
-        for p in products:
-            tags = []  # 使用列表以便叠加多个标签
-
-            # 1. 库存预警逻辑
-            if p['stock'] < p['min_stock_alert']:
-                tags.append("low_stock")
-
-            # 2. 保质期逻辑
-            if p['expire_date']:  # 如果有保质期
-                if p['expire_date'] < today:
-                    tags.append("expired")  # 优先显示过期色
-                elif p['expire_date'] <= today + timedelta(days=7):
-                    tags.append("expiring")
+        # 1. 库存预警逻辑
+        if p['stock'] < p['min_stock_alert']:
+            tags.append("low_stock")
+
+        # 2. 保质期逻辑
+        if p['expire_date']:  # 如果有保质期
+            if p['expire_date'] < today:
+                tags.append("expired")  # 优先显示过期色
+            elif p['expire_date'] <= today + timedelta(days=7):
+                tags.append("expiring")
+
+        values = (
+            p['id'],
+            p['name'],
+            p['category'],
+            p['buy_price'],
+            p['sell_price'],
+            p['stock'],
+            p['min_stock_alert'],
+            p['expire_date']
+        )
+        return values, tuple(tags)  # 转回 tuple
 
-            self.tree_prod.insert("", END, values=(
-                p['id'],
-                p['name'],
-                p['category'],
-                p['buy_price'],
-                p['sell_price'],
-                p['stock'],
-                p['min_stock_alert'],
-                p['expire_date']
-            ), tags=tuple(tags))  # 转回 tuple
+    def refresh_product_list(self):
+        """刷新列表"""
+        self.prod_list.reload()
 
         # 重置按钮
         if hasattr(self, 'btn_expire'):
@@ -284,6 +313,32 @@ class ManagerDashboard(ttk.Frame):
                 command=self.show_expiring_goods
             )
 
+    def import_products_file(self):
+        """批量导入商品 (CSV / Excel)，后台执行"""
+        path = filedialog.askopenfilename(title="选择商品表", filetypes=[("商品表", "*.csv *.xlsx"), ("所有文件", "*.*")])
+        if not path:
+            return
+        add_stock = messagebox.askyesno("导入方式", "已有商品的库存是否累加？\n\n是：累加 (进货单)\n否：覆盖 (盘点表)")
+        self.bg.submit("product-import", lambda: import_products(path, add_stock=add_stock), self._on_import_done,
+                       lambda e: messagebox.showerror("导入失败", str(e)))
+
+    def _on_import_done(self, result):
+        self.refresh_product_list()
+        msg = f"写入 {result['written']} 行，耗时 {result['seconds']:.1f} 秒"
+        if result['errors']:
+            lines = "\n".join(f"第 {n} 行: {reason}" for n, reason in result['errors'][:10])
+            msg += f"\n\n跳过 {len(result['errors'])} 行：\n{lines}"
+        messagebox.showinfo("导入完成", msg)
+
+    def export_products_file(self):
+        """导出全部商品到 CSV，后台执行"""
+        path = filedialog.asksaveasfilename(title="导出商品", defaultextension=".csv", filetypes=[("CSV", "*.csv")])
+        if not path:
+            return
+        self.bg.submit("product-export", lambda: export_products(path),
+                       lambda n: messagebox.showinfo("导出完成", f"已导出 {n} 个商品"),
+                       lambda e: messagebox.showerror("导出失败", str(e)))
+
     def search_mgr_products(self):
         """店长端搜索逻辑"""
         keyword = self.search_var.get().strip()
@@ -291,21 +346,11 @@ class ManagerDashboard(ttk.Frame):
             self.refresh_product_list()
             return
 
-        # 1. 清空表格
-        for item in self.tree_prod.get_children():
-            self.tree_prod.delete(item)
-
-        # 2. 调用后端的搜索
+        # 1. 调用后端的搜索
         products = self.prod_logic.search_products(keyword)
 
-        # 3. 填充数据
-        for p in products:
-            tags = ("low_stock",) if p['stock'] < p['min_stock_alert'] else ()
-            self.tree_prod.insert("", END, values=(
-                p['id'], p['name'], p['category'],
-                p['buy_price'], p['sell_price'],
-                p['stock'], p['min_stock_alert']
-            ), tags=tags)
+        # 2. 填充数据
+        self.prod_list.show_rows(products)
 
     def delete_product(self):
         selection = self.tree_prod.selection()
@@ -321,21 +366,26 @@ class ManagerDashboard(ttk.Frame):
     def popup_edit_product(self):
         selection = self.tree_prod.selection()
         if not selection: return
-        vals = self.tree_prod.item(selection[0], "values")
-        data = {'id': vals[0], 'name': vals[1], 'category': vals[2], 'buy': vals[3], 'sell': vals[4], 'stock': vals[5],
-                'alert': vals[6]}
+        p_id = self.tree_prod.item(selection[0], "values")[0]
+        found = self.prod_logic.get_products_by_ids([p_id])
+        if not found: return
+        p = found[0]
+        data = {'id': p['id'], 'name': p['name'], 'category': p['category'], 'buy': p['buy_price'],
+                'sell': p['sell_price'], 'stock': p['stock'], 'alert': p['min_stock_alert'],
+                'expire': p['expire_date'], 'barcode': p['barcode']}
         self._show_product_dialog("修改商品", data)
 
     def _show_product_dialog(self, title, data=None):
         dlg = Toplevel(self)
         dlg.title(title)
-        dlg.geometry("400x700")
+        dlg.geometry("400x780")
         x = self.winfo_rootx() + 100
         y = self.winfo_rooty() + 100
         dlg.geometry(f"+{x}+{y}")
         dlg.grab_set()
 
         fields = [
+            ("条形码(可选)", "barcode"),
             ("商品名称", "name"),
             ("分类", "category"),
             ("进货价", "buy"),
@@ -372,13 +422,14 @@ class ManagerDashboard(ttk.Frame):
                 expire = entries['expire'].get().strip()
                 if not expire:
                     expire = None  # 如果没填就是 None
+                barcode = entries['barcode'].get().strip() or None
 
                 if data:
                     # 调用更新方法
-                    self.prod_logic.update_product(data['id'], name, cat, buy, sell, stock, alert, expire)
+                    self.prod_logic.update_product(data['id'], name, cat, buy, sell, stock, alert, expire, barcode)
                 else:
                     # 调用新增方法
-                    self.prod_logic.add_product(name, cat, buy, sell, stock, alert, expire)
+                    self.prod_logic.add_product(name, cat, buy, sell, stock, alert, expire, barcode)
 
                 messagebox.showinfo("成功", "保存成功！")
                 dlg.destroy()
@@ -401,6 +452,8 @@ class ManagerDashboard(ttk.Frame):
         self.lbl_profit = ttk.Label(card_frame, text="净利润: --", font=("微软雅黑", 12), bootstyle="warning")
         self.lbl_profit.pack(side=LEFT, padx=20)
         ttk.Button(card_frame, text="刷新数据", command=self.refresh_report_data).pack(side=RIGHT)
+        self.lbl_report_status = ttk.Label(card_frame, text="", font=("微软雅黑", 9), bootstyle="secondary")
+        self.lbl_report_status.pack(side=RIGHT, padx=10)
 
         # 2. 上下分栏
         main_pane = tk_ttk.PanedWindow(self.tab_report, orient=VERTICAL)
@@ -438,16 +491,33 @@ class ManagerDashboard(ttk.Frame):
         tk_widget.place(relx=0, rely=0, relwidth=1, relheight=1)
 
     def refresh_report_data(self):
-        """刷新数据"""
+        """刷新数据：后台查询，查完回到主线程绘制"""
+        self.lbl_report_status.config(text="数据加载中...")
+        self.bg.submit("report", self._load_report_data, self._render_report_data, self._on_report_error)
+
+    def _load_report_data(self):
+        """在工作线程执行，只做数据库查询和数据整理，不碰任何控件 (只读取上次刷新之后的新数据)"""
+        if self.analytics:
+            return self.analytics.dashboard(granularity=5)
+        return self.sales_logic.get_dashboard_stats(granularity=5)
+
+    def _on_report_error(self, e):
+        self.lbl_report_status.config(text="加载失败")
+        print(f"报表刷新报错: {e}")
+
+    def _render_report_data(self, data):
+        """回到主线程后绘制"""
+        self.lbl_report_status.config(text="")
+
         # 1. 刷新文字
-        stats = self.sales_logic.get_profit_stats()
-        self.lbl_revenue.config(text=f"总销售额: ¥{stats['total_revenue']:.2f}")
+        stats = data['stats']
+        scope = f"近{data['window_days']}天" if data.get('window_days') else "总"
+        self.lbl_revenue.config(text=f"{scope}销售额: ¥{stats['total_revenue']:.2f}")
         self.lbl_profit.config(text=f"净利润: ¥{stats['total_profit']:.2f}")
 
         # 2. 刷新排行
         for i in self.tree_rank.get_children(): self.tree_rank.delete(i)
-        top5 = self.sales_logic.get_top_selling_products()
-        for p in top5:
+        for p in data['top5']:
             self.tree_rank.insert("", END, values=(p['name'], p['total_qty']))
 
         # 3. 刷新图表
@@ -455,13 +525,11 @@ class ManagerDashboard(ttk.Frame):
             self.ax1.clear()
             self.ax2.clear()
 
-            pie_data = self.sales_logic.get_category_pie_data()
-            times_str, totals = self.sales_logic.get_minute_sales_stats()
+            labels, sizes = data['labels'], data['sizes']
+            x_minutes, totals = data['x_minutes'], data['totals']
 
             # 左图
-            if pie_data:
-                labels = [d['category'] for d in pie_data]
-                sizes = [float(d['value']) for d in pie_data]
+            if sizes:
                 self.ax1.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, wedgeprops={'width': 0.4})
                 self.ax1.set_title("分类占比")
             else:
@@ -469,12 +537,7 @@ class ManagerDashboard(ttk.Frame):
                 self.ax1.axis('off')
 
             # 右图
-            x_minutes = []
-            for t in times_str:
-                h, m = map(int, t.split(':'))
-                x_minutes.append(h * 60 + m)
-
-            if x_minutes:
+            if any(totals):
                 self.ax2.plot(x_minutes, totals, marker='.', markersize=8, linestyle='-', color='#e74c3c',
                               linewidth=1.5)
                 self.ax2.fill_between(x_minutes, totals, color='#e74c3c', alpha=0.1)
@@ -484,14 +547,14 @@ class ManagerDashboard(ttk.Frame):
             self.ax2.set_xlim(0, 1440)
             self.ax2.set_ylim(bottom=0)
             ticks = [0, 240, 480, 720, 960, 1200, 1440]
-            labels = ["00:00", "04:00", "08:00", "12:00", "16:00", "20:00", "24:00"]
+            tick_labels = ["00:00", "04:00", "08:00", "12:00", "16:00", "20:00", "24:00"]
             self.ax2.set_xticks(ticks)
-            self.ax2.set_xticklabels(labels)
+            self.ax2.set_xticklabels(tick_labels)
             self.ax2.set_title("今日销售走势")
             self.ax2.grid(True, linestyle='--', alpha=0.5)
 
-            # 只重绘，不调整布局
-            self.canvas.draw()
+            # 只重绘，不调整布局；交给空闲时绘制，不阻塞事件处理
+            self.canvas.draw_idle()
 
         except Exception as e:
             print(f"图表刷新报错: {e}")
@@ -500,7 +563,15 @@ class ManagerDashboard(ttk.Frame):
     def _init_orders_tab(self):
         ttk.Label(self.tab_orders, text="历史订单流水", font=("微软雅黑", 10, "bold")).pack(anchor=W, pady=5)
         cols = ("oid", "time", "clerk", "prod", "qty", "total")
-        self.tree_orders = ttk.Treeview(self.tab_orders, columns=cols, show="headings", height=8)
+        self.orders_list = VirtualTreeview(
+            self.tab_orders, cols,
+            fetch_page=lambda after, limit: self.sales_logic.get_all_orders(limit=limit, after_key=after),
+            key_func=lambda o: (o['sale_time'], o['id']),
+            iid_func=lambda o: o['id'],
+            row_func=lambda o: ((o['order_id'], o['sale_time'], o['clerk_name'], o['product_name'],
+                                 o['quantity'], f"{o['total_price']}"), ()),
+            runner=self.bg, height=8)
+        self.tree_orders = self.orders_list.tree
         self.tree_orders.heading("oid", text="订单号");
         self.tree_orders.heading("time", text="时间")
         self.tree_orders.heading("clerk", text="操作员");
@@ -509,30 +580,31 @@ class ManagerDashboard(ttk.Frame):
         self.tree_orders.heading("total", text="金额")
         self.tree_orders.column("oid", width=120);
         self.tree_orders.column("prod", width=100)
-        self.tree_orders.pack(fill=X, pady=(0, 10))
+        self.orders_list.pack(fill=X, pady=(0, 10))
 
         ttk.Label(self.tab_orders, text="订单修改记录", font=("微软雅黑", 10, "bold"),
                   bootstyle="danger").pack(anchor=W, pady=5)
         log_cols = ("time", "op", "prod", "detail", "oid")
-        self.tree_logs = ttk.Treeview(self.tab_orders, columns=log_cols, show="headings", height=6)
+        self.logs_list = VirtualTreeview(
+            self.tab_orders, log_cols,
+            fetch_page=lambda after, limit: self.sales_logic.get_modification_logs(limit=limit, after_key=after),
+            key_func=lambda l: (l['log_time'], l['id']),
+            iid_func=lambda l: l['id'],
+            row_func=lambda l: ((l['log_time'], l['operator'], l['product'], l['details'], l['order_id']), ()),
+            runner=self.bg, height=6)
+        self.tree_logs = self.logs_list.tree
         self.tree_logs.heading("time", text="修改时间");
         self.tree_logs.heading("op", text="修改人")
         self.tree_logs.heading("prod", text="涉及商品");
         self.tree_logs.heading("detail", text="修改内容")
         self.tree_logs.heading("oid", text="关联订单")
-        self.tree_logs.pack(fill=BOTH, expand=True)
+        self.logs_list.pack(fill=BOTH, expand=True)
         ttk.Button(self.tab_orders, text="刷新列表", command=self.refresh_orders_logs).pack(pady=5)
         self.refresh_orders_logs()
 
     def refresh_orders_logs(self):
-        for i in self.tree_orders.get_children(): self.tree_orders.delete(i)
-        orders = self.sales_logic.get_all_orders()
-        for o in orders: self.tree_orders.insert("", END, values=(
-        o['order_id'], o['sale_time'], o['clerk_name'], o['product_name'], o['quantity'], f"{o['total_price']}"))
-        for i in self.tree_logs.get_children(): self.tree_logs.delete(i)
-        logs = self.sales_logic.get_modification_logs()
-        for l in logs: self.tree_logs.insert("", END, values=(
-        l['log_time'], l['operator'], l['product'], l['details'], l['order_id']))
+        self.orders_list.reload()
+        self.logs_list.reload()
 
     # ================= Tab 4: 人员管理 =================
     def _init_staff_tab(self):
@@ -598,11 +670,22 @@ class ClerkStation(ttk.Frame):
         self.pack(fill=BOTH, expand=True)
         self.user_info = user_info
 
-        self.product_logic = ProductLogic()
-        self.sales_logic = SalesLogic()
+        if SERVER_URL:
+            # 客户端模式：查商品、查会员、结账都走收银服务
+            client = CheckoutClient(SERVER_URL)
+            self.product_logic = RemoteProductLogic(client)
+            self.sales_logic = RemoteSalesLogic(client)
+            self.member_logic = RemoteMemberLogic(client)
+        else:
+            self.product_logic = ProductLogic()
+            self.sales_logic = SalesLogic()
+            self.member_logic = MemberLogic()
         self.user_logic = UserLogic()
 
-        self.cart_data = []
+        self.cart = Cart()  # 按商品 id 存放，加购/撤销只改动一行
+
+        # 列表数据在后台线程加载
+        self.bg = BackgroundRunner(self)
 
         # 顶部栏
         self._init_header(logout_callback)
@@ -623,9 +706,15 @@ class ClerkStation(ttk.Frame):
 
         # 绑定事件：切换标签时自动刷新数据
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_change)
-        self.member_logic = MemberLogic()  # 初始化
         self.current_member = None  # 存储当前交易的会员
 
+    def destroy(self):
+        self.after_cancel(self._sync_job)
+        self.bg.shutdown()
+        # bind_all 绑在整个应用上，退出登录后不解绑会继续调用已销毁的收银台
+        self.unbind_all("<Control-z>")
+        super().destroy()
+
     def on_tab_change(self, event):
         """切换标签页时的刷新逻辑"""
         # 获取当前选中的 Tab 索引
@@ -644,6 +733,32 @@ class ClerkStation(ttk.Frame):
                   font=("微软雅黑", 12, "bold"), bootstyle="primary").pack(side=LEFT)
         ttk.Button(header, text="登出", bootstyle="danger-outline-small",
                    command=logout_callback).pack(side=RIGHT)
+        # 离线订单同步状态
+        self.lbl_sync = ttk.Label(header, text="", font=("微软雅黑", 9))
+        self.lbl_sync.pack(side=RIGHT, padx=10)
+        self._sync_job = self.after(1000, self.poll_offline_status)
+
+    OFFLINE_POLL_MS = 3000
+
+    def poll_offline_status(self):
+        """定时刷新离线订单的同步状态 (在后台线程读取)"""
+        self.bg.submit("offline-status", self.sales_logic.get_offline_status, self._show_offline_status,
+                       lambda e: self._schedule_offline_poll())
+
+    def _schedule_offline_poll(self):
+        self._sync_job = self.after(self.OFFLINE_POLL_MS, self.poll_offline_status)
+
+    def _show_offline_status(self, status):
+        if status['pending']:
+            state = "离线" if not status['online'] else "同步中"
+            self.lbl_sync.config(text=f"{state}：{status['pending']} 单待同步", bootstyle="warning")
+        elif not status['online']:
+            self.lbl_sync.config(text="数据库未连接，离线收银中", bootstyle="warning")
+        elif status['conflict']:
+            self.lbl_sync.config(text=f"{status['conflict']} 笔离线订单有冲突，请联系店长", bootstyle="danger")
+        else:
+            self.lbl_sync.config(text="")
+        self._schedule_offline_poll()
 
     # ================= Tab 1: 收银台逻辑 =================
     def _init_cashier_ui(self):
@@ -672,13 +787,22 @@ class ClerkStation(ttk.Frame):
         entry_search.pack(side=LEFT, fill=X, expand=True, padx=(0, 5))
         # 绑定回车搜索
         entry_search.bind("<Return>", lambda e: self.search_products())
+        # 搜索走内存索引，可以边输入边搜索 (支持拼音首字母，如 kkkl)
+        self.search_var.trace_add("write", lambda *args: self.search_products())
 
         ttk.Button(search_frame, text="搜索", command=self.search_products, bootstyle="info").pack(side=LEFT)
         ttk.Button(search_frame, text="重置", command=self.refresh_product_list, bootstyle="secondary-outline").pack(side=LEFT, padx=5)
 
         # 商品表格
         columns = ("id", "name", "category", "price", "stock")
-        self.tree_products = ttk.Treeview(self.left_frame, columns=columns, show="headings", selectmode="browse")
+        self.product_list = VirtualTreeview(
+            self.left_frame, columns,
+            fetch_page=lambda after, limit: self.product_logic.get_all_products(limit=limit, after_key=after),
+            key_func=lambda p: p['id'],
+            # 收银端只需要显示基础信息，通常不需要显示进价和保质期
+            row_func=lambda p: ((p['id'], p['name'], p['category'], f"{p['sell_price']}", p['stock']), ()),
+            runner=self.bg, selectmode="browse")
+        self.tree_products = self.product_list.tree
 
         self.tree_products.heading("id", text="ID")
         self.tree_products.heading("name", text="商品名称")
@@ -692,23 +816,39 @@ class ClerkStation(ttk.Frame):
         self.tree_products.column("price", width=60, anchor=E)
         self.tree_products.column("stock", width=60, anchor=CENTER)
 
-        scrollbar = ttk.Scrollbar(self.left_frame, orient=VERTICAL, command=self.tree_products.yview)
-        self.tree_products.configure(yscrollcommand=scrollbar.set)
-
-        self.tree_products.pack(side=LEFT, fill=BOTH, expand=True)
-        scrollbar.pack(side=RIGHT, fill=Y)
+        self.product_list.pack(fill=BOTH, expand=True)
 
         # 双击添加商品
         self.tree_products.bind("<Double-1>", self.on_add_to_cart)
 
     def _init_cart_area(self):
+        # 扫码收银：扫码枪相当于快速键入条码再回车
+        scan_frame = ttk.Labelframe(self.right_frame, text="扫码收银", padding=10, bootstyle="success")
+        scan_frame.pack(fill=X, pady=(0, 10))
+
+        self.scan_var = tk.StringVar()
+        self.entry_scan = ttk.Entry(scan_frame, textvariable=self.scan_var, width=18)
+        self.entry_scan.pack(side=LEFT, padx=5)
+        self.entry_scan.bind("<Return>", self.on_scan)
+
+        self.scan_mode_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(scan_frame, text="扫码模式", variable=self.scan_mode_var, command=self._focus_scan,
+                        bootstyle="success-round-toggle").pack(side=LEFT, padx=5)
+
+        self.lbl_scan_info = ttk.Label(scan_frame, text="", font=("微软雅黑", 9))
+        self.lbl_scan_info.pack(side=LEFT, padx=10)
+        self.after_idle(self._focus_scan)
+
         mem_frame = ttk.Labelframe(self.right_frame, text="会员服务", padding=10, bootstyle="info")
         mem_frame.pack(fill=X, pady=(0, 10))
 
         self.mem_var = tk.StringVar()
-        entry_mem = ttk.Entry(mem_frame, textvariable=self.mem_var, width=15)
-        entry_mem.pack(side=LEFT, padx=5)
-        entry_mem.bind("<Return>", lambda e: self.check_member())
+        # 输入手机号前几位或尾号 4 位即可联想，按 ↓ 选择
+        self.combo_mem = ttk.Combobox(mem_frame, textvariable=self.mem_var, width=15)
+        self.combo_mem.pack(side=LEFT, padx=5)
+        self.combo_mem.bind("<Return>", lambda e: self.check_member())
+        self.combo_mem.bind("<KeyRelease>", self.suggest_members)
+        self.combo_mem.bind("<<ComboboxSelected>>", lambda e: self.check_member())
 
         ttk.Button(mem_frame, text="识别", command=self.check_member, bootstyle="info-outline").pack(side=LEFT)
 
@@ -735,6 +875,9 @@ class ClerkStation(ttk.Frame):
         btn_frame = ttk.Frame(self.right_frame)
         btn_frame.pack(fill=X, pady=5)
         ttk.Button(btn_frame, text="移出商品", bootstyle="warning-link", command=self.remove_from_cart).pack(side=RIGHT)
+        ttk.Button(btn_frame, text="撤销 (Ctrl+Z)", bootstyle="secondary-link", command=self.undo_cart).pack(side=RIGHT)
+        self.tree_cart.bind("<Delete>", lambda e: self.remove_from_cart())
+        self.bind_all("<Control-z>", lambda e: self.undo_cart())
 
         footer_frame = ttk.Frame(self.right_frame, padding=10, bootstyle="light")
         footer_frame.pack(fill=X, pady=10)
@@ -753,7 +896,17 @@ class ClerkStation(ttk.Frame):
         ttk.Button(toolbar, text="刷新列表", command=self.refresh_my_orders).pack(side=RIGHT)
 
         cols = ("id", "oid", "time", "prod", "qty", "total")
-        self.tree_history = ttk.Treeview(self.tab_history, columns=cols, show="headings")
+        # 传入 current_user_id 只查自己的订单
+        self.history_list = VirtualTreeview(
+            self.tab_history, cols,
+            fetch_page=lambda after, limit: self.sales_logic.get_all_orders(
+                clerk_id=self.user_info['id'], limit=limit, after_key=after),
+            key_func=lambda o: (o['sale_time'], o['id']),
+            iid_func=lambda o: o['id'],
+            row_func=lambda o: ((o['id'], o['order_id'], o['sale_time'],
+                                 o['product_name'], o['quantity'], o['total_price']), ()),
+            runner=self.bg)
+        self.tree_history = self.history_list.tree
         self.tree_history.heading("id", text="流水号")
         self.tree_history.heading("oid", text="订单号")
         self.tree_history.heading("time", text="时间")
@@ -763,20 +916,10 @@ class ClerkStation(ttk.Frame):
 
         self.tree_history.column("id", width=50)
         self.tree_history.column("qty", width=50)
-        self.tree_history.pack(fill=BOTH, expand=True)
+        self.history_list.pack(fill=BOTH, expand=True)
 
     def refresh_my_orders(self):
-        # 清空列表
-        for i in self.tree_history.get_children():
-            self.tree_history.delete(i)
-
-        # 传入 current_user_id 只查自己的订单
-        orders = self.sales_logic.get_all_orders(clerk_id=self.user_info['id'])
-        for o in orders:
-            self.tree_history.insert("", END, values=(
-                o['id'], o['order_id'], o['sale_time'],
-                o['product_name'], o['quantity'], o['total_price']
-            ))
+        self.history_list.reload()
 
     def modify_selected_order(self):
         selection = self.tree_history.selection()
@@ -804,21 +947,7 @@ class ClerkStation(ttk.Frame):
 
     # ================= 辅助逻辑 (收银相关) =================
     def refresh_product_list(self):
-
-        for item in self.tree_products.get_children():
-            self.tree_products.delete(item)
-
-        products = self.product_logic.get_all_products()
-
-        for p in products:
-            # 收银端只需要显示基础信息，通常不需要显示进价和保质期
-            self.tree_products.insert("", END, values=(
-                p['id'],
-                p['name'],
-                p['category'],
-                f"{p['sell_price']}",
-                p['stock']
-            ))
+        self.product_list.reload()
 
     def show_expiring_goods(self):
         """显示临期商品"""
@@ -845,21 +974,9 @@ class ClerkStation(ttk.Frame):
             self.refresh_product_list()
             return
 
-        # 注意：使用 tree_products
-        for item in self.tree_products.get_children():
-            self.tree_products.delete(item)
-
         # 注意：使用 product_logic
         products = self.product_logic.search_products(keyword)
-
-        for p in products:
-            self.tree_products.insert("", END, values=(
-                p['id'],
-                p['name'],
-                p['category'],
-                f"{p['sell_price']}",
-                p['stock']
-            ))
+        self.product_list.show_rows(products)
 
     def on_add_to_cart(self, event):
         selection = self.tree_products.selection()
@@ -881,44 +998,71 @@ class ClerkStation(ttk.Frame):
             self.add_item_to_cart_data(p_id, p_name, p_price, qty, p_stock)
 
     def add_item_to_cart_data(self, p_id, name, price, qty, max_stock):
-        found = False
-        for item in self.cart_data:
-            if str(item['id']) == str(p_id):
-                new_qty = item['buy_qty'] + qty
-                if new_qty > max_stock:
-                    messagebox.showwarning("提示", f"库存不足！最多只能购买 {max_stock} 件")
-                    return
-                item['buy_qty'] = new_qty
-                item['total'] = item['buy_qty'] * item['sell_price']
-                found = True
-                break
-
-        if not found:
-            self.cart_data.append({
-                'id': p_id, 'name': name, 'sell_price': price,
-                'buy_qty': qty, 'total': price * qty, 'max_stock': max_stock
-            })
-
-        self.refresh_cart_view()
+        try:
+            line = self.cart.add(p_id, name, price, qty, max_stock)
+        except ValueError as e:
+            messagebox.showwarning("提示", str(e))
+            return False
+        self.refresh_cart_line(line['id'])
+        return True
+
+    def on_scan(self, event=None):
+        """扫码枪输入：条码 + 回车，直接加 1 件，不弹窗"""
+        code = self.scan_var.get().strip()
+        self.scan_var.set("")
+        if not code:
+            return
+        p = self.product_logic.get_by_barcode(code)
+        if not p:
+            self.bell()
+            self.lbl_scan_info.config(text=f"未找到条码 {code}", bootstyle="danger")
+            return
+        if self.add_item_to_cart_data(p['id'], p['name'], p['sell_price'], 1, p['stock']):
+            self.lbl_scan_info.config(text=f"{p['name']} +1", bootstyle="success")
+        self._focus_scan()
+
+    def _focus_scan(self):
+        """扫码模式下焦点始终回到扫码框"""
+        if self.scan_mode_var.get():
+            self.entry_scan.focus_set()
 
     def remove_from_cart(self):
         selection = self.tree_cart.selection()
         if not selection: return
-        idx = self.tree_cart.index(selection[0])
-        del self.cart_data[idx]
-        self.refresh_cart_view()
+        # 购物车行的 iid 就是商品 id
+        p_id = int(selection[0])
+        self.cart.remove(p_id)
+        self.refresh_cart_line(p_id)
+
+    def undo_cart(self):
+        """撤销上一次加购 / 移出"""
+        p_id = self.cart.undo()
+        if p_id is None:
+            self.bell()
+            return
+        self.refresh_cart_line(p_id)
+        self._focus_scan()
+
+    @staticmethod
+    def _cart_row(item):
+        return (item['name'], item['buy_qty'], f"¥{item['total']:.2f}"), ()
+
+    def refresh_cart_line(self, p_id):
+        """只刷新一行购物车，合计直接取 Cart 维护的值"""
+        line = self.cart.get(p_id)
+        if line is None:
+            drop_treeview_row(self.tree_cart, p_id)
+        else:
+            put_treeview_row(self.tree_cart, line, lambda item: item['id'], self._cart_row)
+        self.lbl_total_price.config(text=f"总计: ¥{self.cart.total:.2f}")
 
     def refresh_cart_view(self):
-        for item in self.tree_cart.get_children():
-            self.tree_cart.delete(item)
-        total_amount = 0.0
-        for item in self.cart_data:
-            self.tree_cart.insert("", END, values=(item['name'], item['buy_qty'], f"¥{item['total']:.2f}"))
-            total_amount += item['total']
-        self.lbl_total_price.config(text=f"总计: ¥{total_amount:.2f}")
+        # 整体重画 (结账清空后使用)，差量更新只改动有变化的行
+        sync_treeview(self.tree_cart, list(self.cart), lambda item: item['id'], self._cart_row)
+        self.lbl_total_price.config(text=f"总计: ¥{self.cart.total:.2f}")
 
     def checkout(self):
-        if not self.cart_data:
+        if not len(self.cart):
             messagebox.showwarning("提示", "购物车是空的")
             return
 
@@ -931,18 +1075,22 @@ class ClerkStation(ttk.Frame):
 
         clerk_id = self.user_info['id']
         # 调用修改后的 backend checkout，接收3个返回值
-        success, msg, receipt_data = self.sales_logic.checkout(clerk_id, self.cart_data, member_id)
+        success, msg, receipt_data = self.sales_logic.checkout(clerk_id, self.cart.to_checkout_items(), member_id)
 
         if success:
             messagebox.showinfo("成功", msg)
             self.show_receipt(receipt_data)  # 打印小票
-            self.cart_data = []
+            sold_ids = [item['id'] for item in self.cart]
+            self.cart.clear()
             self.refresh_cart_view()
-            self.refresh_product_list()
+            # 只刷新卖出商品的库存，不重建整个商品列表
+            self.bg.submit("patch-stock", lambda: self.product_logic.get_products_by_ids(sold_ids),
+                           self.product_list.patch_rows)
             # 重置会员状态
             self.current_member = None
             self.lbl_member_info.config(text="未登录", bootstyle="secondary")
             self.mem_var.set("")
+            self._focus_scan()
         else:
             messagebox.showerror("失败", msg)
 
@@ -982,16 +1130,41 @@ class ClerkStation(ttk.Frame):
         本次积分: {data['member_points']}
         """
 
+        if data.get('offline'):
+            content += "\n        (离线订单，联网后同步)\n"
+
         content += "\n    *** 谢谢惠顾 欢迎下次光临 ***"
 
         txt.insert(END, content)
         txt.config(state=DISABLED)  # 只读
 
+    def suggest_members(self, event):
+        """边输入边联想 (后台查内存目录，首次使用时会加载会员)"""
+        if event.keysym in ("Return", "Up", "Down", "Escape"):
+            return
+        digits = self.mem_var.get().strip()
+        if len(digits) < 3 or not digits.isdigit():
+            self.combo_mem.configure(values=[])
+            return
+        self.bg.submit("member-suggest", lambda: self.member_logic.suggest_members(digits),
+                       self._show_member_suggestions)
+
+    def _show_member_suggestions(self, members):
+        self.combo_mem.configure(values=[f"{m['phone']} {m['name']}" for m in members])
+        if members:
+            self.lbl_member_info.config(text=f"匹配 {len(members)} 位会员，按 ↓ 选择", bootstyle="secondary")
+
     def check_member(self):
-        phone = self.mem_var.get().strip()
+        phone = self.mem_var.get().strip().split(' ')[0]  # 下拉选项是 "手机号 昵称"
         if not phone: return
         member = self.member_logic.get_member_by_phone(phone)
+        if not member:
+            # 只输入了部分号码 (如尾号) 且只匹配到一位会员时直接识别
+            matches = self.member_logic.suggest_members(phone, limit=2)
+            if len(matches) == 1:
+                member = self.member_logic.get_member_by_phone(matches[0]['phone'])
         if member:
+            self.mem_var.set(member['phone'])
             self.current_member = member
             self.lbl_member_info.config(text=f"VIP: {member['name']} | 积分: {member['points']}", bootstyle="success")
             messagebox.showinfo("成功", f"欢迎会员：{member['name']}")
@@ -1081,5 +1254,31 @@ class MainApp(ttk.Window):
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="便利店管理系统")
+    parser.add_argument('--server', help="收银服务地址，收银台以客户端模式运行")
+    args = parser.parse_args()
+    if args.server:
+        SERVER_URL = args.server
+    if SERVER_URL and not SERVER_TOKEN:
+        raise SystemExit("客户端模式需要设置与收银服务相同的口令 (环境变量 STORE_SERVER_TOKEN)")
+
+    # 订单号里带收银台编号，没配置就不启动，免得两台收银机生成相同的订单号
+    try:
+        default_terminal_id()
+    except RuntimeError as e:
+        raise SystemExit(e)
+
+    # 启动前把表结构升级到最新版本（已是最新时不做任何事）
+    try:
+        DatabaseManager(DB_NAME).migrate()
+    except Exception as e:
+        print(f"[Migrate Error] {e}")
+
+    if not SERVER_URL:
+        # 结账只追加积分流水，直连模式由各收银台折算；客户端模式由收银服务折算
+        points_materializer.ensure_started()
+
     app = MainApp()
     app.mainloop()
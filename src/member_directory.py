@@ -0,0 +1,133 @@
+"""
+会员目录
+
+收银台输入手机号时的联想查询：手机号排成有序数组，前缀查询用二分找到区间；
+另建 "手机尾号后 4 位" 索引，顾客只记得尾号时也能查到。全部在内存中完成，不访问数据库。
+"""
+import bisect
+
+SUFFIX_LEN = 4  # 尾号索引的位数
+
+
+class MemberDirectory:
+    """
+    手机号有序数组 + 尾号索引
+    非线程安全，由 MemberLogic 的锁保护
+    """
+
+    def __init__(self):
+        self._phones = []  # 升序手机号
+        self._members = {}  # 手机号 -> (id, 昵称, 积分)
+        self._phone_by_id = {}  # id -> 手机号
+        self._by_suffix = {}  # 尾号 -> [手机号]
+        self.max_id = 0  # 批量加载到的最大会员 id (增量加载的水位线，put 不改它)
+
+    def __len__(self):
+        return len(self._members)
+
+    def rebuild(self, members):
+        """members: 可迭代的 (id, 手机号, 昵称, 积分)"""
+        self._members = {}
+        self._phone_by_id = {}
+        self._by_suffix = {}
+        self.max_id = 0
+        for m_id, phone, name, points in members:
+            self._members[phone] = (m_id, name, points)
+            self._phone_by_id[m_id] = phone
+            self.max_id = max(self.max_id, m_id)
+        self._phones = sorted(self._members)
+        for phone in self._phones:
+            self._by_suffix.setdefault(phone[-SUFFIX_LEN:], []).append(phone)
+
+    def put(self, m_id, phone, name, points):
+        """新增或更新一个会员"""
+        old_phone = self._phone_by_id.get(m_id)
+        if old_phone is not None and old_phone != phone:
+            self._remove_phone(old_phone)
+        if phone not in self._members:
+            bisect.insort(self._phones, phone)
+            bisect.insort(self._by_suffix.setdefault(phone[-SUFFIX_LEN:], []), phone)
+        self._members[phone] = (m_id, name, points)
+        self._phone_by_id[m_id] = phone
+
+    def _remove_phone(self, phone):
+        self._members.pop(phone)
+        self._phones.pop(bisect.bisect_left(self._phones, phone))
+        siblings = self._by_suffix[phone[-SUFFIX_LEN:]]
+        siblings.pop(bisect.bisect_left(siblings, phone))
+        if not siblings:
+            del self._by_suffix[phone[-SUFFIX_LEN:]]
+
+    def add_points(self, m_id, delta):
+        """积分变动后同步，不认识的会员忽略"""
+        phone = self._phone_by_id.get(m_id)
+        if phone is not None:
+            m_id, name, points = self._members[phone]
+            self._members[phone] = (m_id, name, points + delta)
+
+    def get(self, phone):
+        """精确查找，返回会员 dict 或 None"""
+        member = self._members.get(phone)
+        if member is None:
+            return None
+        return self._to_dict(phone, member)
+
+    def _to_dict(self, phone, member):
+        m_id, name, points = member
+        return {'id': m_id, 'phone': phone, 'name': name, 'points': points}
+
+    def suggest(self, digits, limit=8):
+        """
+        联想查询：手机号前缀匹配在前，尾号匹配在后 (输入正好 4 位时)
+        :return: 会员 dict 列表，最多 limit 个
+        """
+        digits = digits.strip()
+        if not digits:
+            return []
+        found = []
+        start = bisect.bisect_left(self._phones, digits)
+        for phone in self._phones[start:start + limit]:
+            if not phone.startswith(digits):
+                break
+            found.append(phone)
+        if len(digits) == SUFFIX_LEN and len(found) < limit:
+            seen = set(found)
+            found += [p for p in self._by_suffix.get(digits, ()) if p not in seen][:limit - len(found)]
+        return [self._to_dict(phone, self._members[phone]) for phone in found]
+
+
+if __name__ == '__main__':
+    # 基准：100 万会员的加载耗时、内存占用和联想查询延迟
+    import random
+    import time
+    import tracemalloc
+
+    total = 1_000_000
+    rng = random.Random(1)
+    rows = [(i, f"13{n:09d}", f"会员{i}", rng.randrange(5000))
+            for i, n in enumerate(rng.sample(range(10 ** 9), total), start=1)]
+
+    start = time.perf_counter()
+    directory = MemberDirectory()
+    directory.rebuild(rows)
+    print(f"加载 {len(directory):,} 个会员: {time.perf_counter() - start:.2f}s")
+    tracemalloc.start()
+    MemberDirectory().rebuild(rows)
+    print(f"索引内存 (峰值，不含原始行): {tracemalloc.get_traced_memory()[1] / 2 ** 20:.0f} MB")
+    tracemalloc.stop()
+
+    queries = [rows[rng.randrange(total)][1] for _ in range(10_000)]
+    for label, make in (("前缀 3 位", lambda p: p[:3]), ("前缀 7 位", lambda p: p[:7]),
+                        ("尾号 4 位", lambda p: p[-4:]), ("完整号码", lambda p: p)):
+        keys = [make(p) for p in queries]
+        start = time.perf_counter()
+        hits = sum(len(directory.suggest(k)) for k in keys)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: 平均 {elapsed / len(keys) * 1e6:.1f} µs/次，平均 {hits / len(keys):.1f} 条")
+
+    start = time.perf_counter()
+    for i in range(1000):
+        directory.put(total + 1 + i, f"170{i:08d}", "新会员", 0)
+    print(f"增量注册: 平均 {(time.perf_counter() - start):.3f} ms/个")
+    assert directory.get("17000000007")['name'] == "新会员"
+    assert any(m['phone'] == queries[0] for m in directory.suggest(queries[0][-4:], limit=10 ** 6))
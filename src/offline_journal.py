@@ -0,0 +1,209 @@
+"""
+离线收银日志
+
+数据库连不上 (或选择排队模式) 时，收银台把已完成的订单先写进本地 SQLite 日志 (WAL 模式，
+每次提交都落盘) 后立即返回，不再等待 MySQL。后台回放线程按写入顺序把订单补录到 MySQL：
+以订单号做幂等判断，同一订单重复回放不会重复扣库存；回放中发现的问题 (库存被扣成负数、
+商品已被删除等) 记为冲突，留给店长处理。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+JOURNAL_PATH = os.environ.get(
+    'STORE_OFFLINE_JOURNAL',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offline_journal.db'))
+
+# 日志状态
+PENDING = 'pending'  # 待回放
+APPLIED = 'applied'  # 已补录
+CONFLICT = 'conflict'  # 已补录但有冲突 / 无法补录
+
+
+class OfflineJournal:
+    """
+    本地持久化的订单日志 (线程安全)
+    每条记录以订单号为主键，payload 为订单内容的 JSON
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT NOT NULL UNIQUE,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TEXT NOT NULL,
+            applied_at TEXT,
+            message TEXT
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_status ON journal (status, seq)")
+
+    def append(self, entry):
+        """写入一笔订单，提交 (落盘) 后才返回"""
+        payload = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO journal (order_id, payload, created_at) VALUES (?, ?, ?)",
+                (entry['order_id'], payload, datetime.now().isoformat(sep=' ', timespec='seconds')))
+
+    def pending(self, limit=100):
+        """按写入顺序取待回放的订单"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM journal WHERE status = ? ORDER BY seq LIMIT ?", (PENDING, limit)).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def mark(self, order_id, status, message=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE journal SET status = ?, applied_at = ?, message = ? WHERE order_id = ?",
+                (status, datetime.now().isoformat(sep=' ', timespec='seconds'), message, order_id))
+
+    def conflicts(self, limit=100):
+        """最近的冲突记录 [(订单号, 说明, 补录时间)]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT order_id, message, applied_at FROM journal WHERE status = ? ORDER BY seq DESC LIMIT ?",
+                (CONFLICT, limit)).fetchall()
+
+    def counts(self):
+        """各状态的订单数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall()
+        counts = {PENDING: 0, APPLIED: 0, CONFLICT: 0}
+        counts.update(rows)
+        return counts
+
+    def purge_applied(self, before):
+        """删除 before 之前已补录成功的记录，返回删除条数"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM journal WHERE status = ? AND applied_at < ?",
+                                     (APPLIED, before.isoformat(sep=' ', timespec='seconds')))
+            return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _is_os_error(e):
+    return isinstance(e, OSError)
+
+
+class JournalReplayer(threading.Thread):
+    """
+    后台回放线程
+    apply_func(entry) 在 MySQL 中补录一笔订单，返回冲突说明列表 (空列表表示无冲突)；
+    抛出的异常 retry_if(异常) 为真 (连接断开、死锁等) 时订单保持待回放，稍后重试，
+    其他异常说明这笔订单本身无法补录，记为冲突，避免堵住后面的订单
+    """
+
+    def __init__(self, journal, apply_func, retry_if=_is_os_error, interval=2.0, batch_size=100):
+        super().__init__(name="journal-replayer", daemon=True)
+        self.journal = journal
+        self.apply_func = apply_func
+        self.retry_if = retry_if
+        self.interval = interval
+        self.batch_size = batch_size
+        self.online = True  # 最近一次访问数据库是否成功
+        self.last_error = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self):
+        """有新订单写入，尽快回放"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def run(self):
+        delay = self.interval
+        while not self._stopped.is_set():
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.replay_pending()
+                delay = self.interval
+            except Exception as e:
+                if not self.retry_if(e):
+                    raise
+                # 数据库不可用：退避重试，最长 30 秒
+                self.online = False
+                self.last_error = str(e)
+                delay = min(delay * 2, 30.0)
+
+    def replay_pending(self):
+        """回放所有待回放的订单，返回回放条数；数据库不可用时抛出 retry_if 认可的异常"""
+        done = 0
+        while True:
+            batch = self.journal.pending(self.batch_size)
+            if not batch:
+                # 积压的离线订单全部补录完，收银台才恢复直连数据库，避免新订单抢在旧订单前面扣库存
+                self.online = True
+                self.last_error = None
+                return done
+            for entry in batch:
+                try:
+                    conflicts = self.apply_func(entry)
+                except Exception as e:
+                    if self.retry_if(e):
+                        raise
+                    self.journal.mark(entry['order_id'], CONFLICT, f"无法补录: {e}")
+                else:
+                    if conflicts:
+                        self.journal.mark(entry['order_id'], CONFLICT, "; ".join(conflicts))
+                    else:
+                        self.journal.mark(entry['order_id'], APPLIED)
+                done += 1
+
+
+if __name__ == '__main__':
+    # 自检：回放过程中模拟数据库断开再恢复，检查每笔订单恰好补录一次 (对真实 MySQL 断连见 bench.py outage)
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), 'journal.db')
+    journal = OfflineJournal(path)
+    total = 2000
+    start = time.perf_counter()
+    for i in range(total):
+        journal.append({'order_id': f"T{i:06d}", 'items': [{'id': 1, 'qty': 1}]})
+    print(f"写入 {total} 笔，每笔约 {(time.perf_counter() - start) / total * 1e3:.2f} ms")
+
+    applied = {}
+    calls = [0]
+
+    def flaky_apply(entry):
+        calls[0] += 1
+        if 500 <= calls[0] < 503:
+            raise ConnectionError("模拟数据库断开")
+        if entry['order_id'] in applied:
+            return []  # 幂等：已补录过的订单直接跳过
+        applied[entry['order_id']] = True
+        return ["库存为负"] if entry['order_id'].endswith('999') else []
+
+    replayer = JournalReplayer(journal, flaky_apply, retry_if=lambda e: isinstance(e, ConnectionError),
+                               interval=0.05)
+    replayer.start()
+    while journal.counts()[PENDING]:
+        time.sleep(0.05)
+    replayer.stop()
+
+    counts = journal.counts()
+    assert len(applied) == total, "有订单未补录"
+    assert counts[APPLIED] + counts[CONFLICT] == total
+    assert counts[CONFLICT] == 2
+    print(f"回放完成：{counts}，期间断开重试 {calls[0] - total} 次")
@@ -0,0 +1,117 @@
+"""
+订单号生成器
+
+订单号格式 (共 30 位数字):
+    YYYYMMDDHHMMSSfff  毫秒时间戳 (17位)
+    TTT                收银台编号 (3位)
+    PPPPPPP            进程号 (7位)
+    SSS                同一毫秒内的序号 (3位)
+
+时间在最前，按字符串排序即按时间排序；收银台 + 进程号区分不同的生成者，
+序号区分同一毫秒内的订单，所以全程不需要访问数据库。
+收银台编号必须通过环境变量 STORE_TERMINAL_ID 为每台收银机 (每个容器) 分别配置，没有配置时拒绝生成订单号。
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+SEQ_LIMIT = 1000  # 每毫秒最多 1000 个序号，用完借用下一毫秒
+
+
+def _check_terminal_id(terminal_id):
+    try:
+        value = int(terminal_id)
+    except (TypeError, ValueError):
+        value = -1
+    if not 0 <= value < 1000:
+        raise RuntimeError(f"收银台编号必须是 0-999 的整数，当前为 {terminal_id!r}")
+    return value
+
+
+def default_terminal_id():
+    """
+    收银台编号：读环境变量 STORE_TERMINAL_ID，未配置时抛出 RuntimeError
+    不再由主机名推导：20 台收银机按主机名散列到 1000 个编号，约 17% 的概率撞号；
+    容器里的进程号又往往相同，撞号后订单号就可能重复
+    """
+    env = os.environ.get('STORE_TERMINAL_ID', '').strip()
+    if not env:
+        raise RuntimeError("未配置收银台编号：请为每台收银机设置不同的环境变量 STORE_TERMINAL_ID (0-999)")
+    return _check_terminal_id(env)
+
+
+class OrderIdGenerator:
+    """
+    单调递增、跨进程/跨收银台唯一的订单号生成器 (线程安全)
+    """
+
+    def __init__(self, terminal_id=None):
+        self.terminal_id = default_terminal_id() if terminal_id is None else _check_terminal_id(terminal_id)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = 0
+        self._seq = 0
+
+    def next_id(self):
+        """生成下一个订单号"""
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # fork 出来的子进程不能沿用父进程的状态
+                self._pid = pid
+                self._last_ms = 0
+                self._seq = 0
+
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._seq = 0
+            else:
+                # 同一毫秒内，或系统时钟回拨：沿用上次的时间继续递增
+                self._seq += 1
+                if self._seq >= SEQ_LIMIT:
+                    self._last_ms += 1
+                    self._seq = 0
+
+            ms = self._last_ms
+            seq = self._seq
+
+        stamp = datetime.fromtimestamp(ms / 1000).strftime('%Y%m%d%H%M%S')
+        return f"{stamp}{ms % 1000:03d}{self.terminal_id:03d}{pid % 10_000_000:07d}{seq:03d}"
+
+
+_default_generator = None
+_default_lock = threading.Lock()
+
+
+def next_order_id():
+    """使用进程内默认生成器生成订单号 (首次调用时读取收银台编号)"""
+    global _default_generator
+    if _default_generator is None:
+        with _default_lock:
+            if _default_generator is None:
+                _default_generator = OrderIdGenerator()
+    return _default_generator.next_id()
+
+
+def _stress_worker(count):
+    return [next_order_id() for _ in range(count)]
+
+
+if __name__ == '__main__':
+    # 生成器自检：多进程同时取号，检查是否重复、是否单调 (真实结账的多收银机压测见 bench.py orderid)
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.environ.setdefault('STORE_TERMINAL_ID', '1')  # 子进程继承
+    workers, per_worker = 8, 50_000
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batches = list(pool.map(_stress_worker, [per_worker] * workers))
+    elapsed = time.perf_counter() - start
+
+    all_ids = [oid for batch in batches for oid in batch]
+    assert len(all_ids) == len(set(all_ids)), "存在重复订单号"
+    for batch in batches:
+        assert batch == sorted(batch), "同一进程内订单号不单调"
+    print(f"{len(all_ids)} 个订单号，无重复，耗时 {elapsed:.2f}s，约 {len(all_ids) / elapsed:,.0f} 个/秒")
@@ -0,0 +1,294 @@
+"""
+商品批量导入 / 导出
+
+导入：按块流式读取 CSV (或 XLSX)，逐行校验，每 BATCH_SIZE 行用一条多行
+INSERT ... ON DUPLICATE KEY UPDATE 写入，一批一个事务；有 id 或条码相同的商品则更新，否则新增。
+导出：商品、销售记录经 DatabaseManager.stream (服务端游标) 边读边写，不会把整张表读进内存。
+
+命令行：
+    python product_io.py import 供应商价目表.csv [--encoding gbk] [--add-stock]
+    python product_io.py export-products 商品.csv
+    python product_io.py export-sales 销售.csv [--start 2024-01-01] [--end 2024-02-01]
+"""
+import csv
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from backend import PRODUCT_FIELDS, run_transaction, _bump_catalog_version
+from db_setup import DatabaseManager, DB_NAME
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+BATCH_SIZE = 1000  # 每个事务写入的行数
+# 销售导出的表头，与 export_sales 的 SELECT 列一一对应
+SALES_EXPORT_FIELDS = ('id', 'order_id', 'sale_time', 'product_id', 'product_name', 'user_id', 'member_id',
+                       'quantity', 'buy_price_snapshot', 'sell_price_snapshot', 'total_price')
+EXPORT_CHUNK = 2000  # 导出时每次从服务端游标取的行数，也是进度回调的间隔
+
+# 列的取值范围：超出的行在校验时就拒绝，不要等写库时整批失败 (前面的批次已经提交)
+MAX_PRICE = Decimal('99999999.99')  # DECIMAL(10, 2)
+MAX_INT = 2 ** 31 - 1  # INT
+
+# 表头别名 (供应商的表格常用中文表头)
+HEADER_ALIASES = {
+    '商品id': 'id', 'id': 'id',
+    '条码': 'barcode', '条形码': 'barcode', 'barcode': 'barcode',
+    '商品名称': 'name', '名称': 'name', 'name': 'name',
+    '分类': 'category', 'category': 'category',
+    '进价': 'buy_price', 'buy_price': 'buy_price',
+    '售价': 'sell_price', 'sell_price': 'sell_price',
+    '库存': 'stock', 'stock': 'stock',
+    '预警线': 'min_stock_alert', 'min_stock_alert': 'min_stock_alert',
+    '临期时间': 'expire_date', '保质期至': 'expire_date', 'expire_date': 'expire_date',
+}
+REQUIRED_FIELDS = ('name', 'category', 'buy_price', 'sell_price')
+
+SQL_UPSERT_PRODUCT = """
+INSERT INTO products (id, barcode, name, category, buy_price, sell_price, stock, min_stock_alert, expire_date)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    barcode = COALESCE(VALUES(barcode), barcode), name = VALUES(name), category = VALUES(category),
+    buy_price = VALUES(buy_price), sell_price = VALUES(sell_price), stock = {stock},
+    min_stock_alert = VALUES(min_stock_alert), expire_date = VALUES(expire_date)
+"""
+
+
+# ================= 读取 =================
+def _read_csv(path, encoding):
+    with open(path, newline='', encoding=encoding) as f:
+        yield from csv.reader(f)
+
+
+def _read_xlsx(path):
+    if openpyxl is None:
+        raise Exception("读取 Excel 需要安装 openpyxl：pip install openpyxl")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if v is None else v for v in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(path, encoding='utf-8-sig'):
+    """逐行产出 (行号, {字段: 原始值})，第一行为表头"""
+    rows = _read_xlsx(path) if path.lower().endswith(('.xlsx', '.xlsm')) else _read_csv(path, encoding)
+    header = None
+    for line_no, row in enumerate(rows, start=1):
+        if header is None:
+            header = [HEADER_ALIASES.get(str(h).strip().lower()) for h in row]
+            missing = [f for f in REQUIRED_FIELDS if f not in header]
+            if missing:
+                raise Exception(f"表头缺少必填列: {', '.join(missing)}")
+            continue
+        if not any(str(v).strip() for v in row):
+            continue  # 空行
+        yield line_no, {field: value for field, value in zip(header, row) if field}
+
+
+# ================= 校验 =================
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def _number(text, label, value):
+    """文本 -> 有限的 Decimal (NaN、Infinity 之类一律拒绝)"""
+    try:
+        number = Decimal(text)
+    except ArithmeticError:
+        raise ValueError(f"{label}不是数字: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"{label}不是数字: {value!r}")
+    return number
+
+
+def _decimal(value, label):
+    number = _number(_text(value), label, value)
+    if number < 0:
+        raise ValueError(f"{label}不能为负数")
+    # 先比较再取整：太大的数 quantize 会溢出，舍入后超过上限的也要拒绝
+    if number >= MAX_PRICE + Decimal('0.005'):
+        raise ValueError(f"{label}超出范围 (最大 {MAX_PRICE})")
+    return number.quantize(Decimal('0.01'))
+
+
+def _int(value, label, default):
+    text = _text(value)
+    if not text:
+        return default
+    number = _number(text, label, value)
+    if number != number.to_integral_value():
+        raise ValueError(f"{label}不是整数: {value!r}")
+    if abs(number) > MAX_INT:
+        raise ValueError(f"{label}超出范围 (最大 {MAX_INT})")
+    return int(number)
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _text(value)
+    if not text:
+        return None
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"临期时间格式不对: {value!r}")
+
+
+def parse_product(raw):
+    """校验一行并转换为 SQL_UPSERT_PRODUCT 的参数，不合法时抛 ValueError"""
+    name = _text(raw.get('name'))
+    category = _text(raw.get('category'))
+    if not name:
+        raise ValueError("商品名称为空")
+    if not category:
+        raise ValueError("分类为空")
+    if len(name) > 100 or len(category) > 50:
+        raise ValueError("商品名称或分类过长")
+    barcode = _text(raw.get('barcode')) or None
+    if barcode and len(barcode) > 32:
+        raise ValueError("条码过长")
+    product_id = _int(raw.get('id'), "id", None)
+    if product_id is not None and product_id <= 0:
+        raise ValueError("id 必须是正整数")
+    stock = _int(raw.get('stock'), "库存", 0)
+    if stock < 0:
+        raise ValueError("库存不能为负数")
+    return (product_id, barcode, name, category,
+            _decimal(raw.get('buy_price'), "进价"), _decimal(raw.get('sell_price'), "售价"),
+            stock, _int(raw.get('min_stock_alert'), "预警线", 10), _date(raw.get('expire_date')))
+
+
+# ================= 导入 =================
+def import_products(path, encoding='utf-8-sig', add_stock=False, batch_size=BATCH_SIZE, progress=None, db=None):
+    """
+    流式导入商品
+    :param add_stock: True 时已有商品的库存累加 (进货单)，False 时覆盖 (盘点表)
+    :param progress: progress(已写入行数, 错误行数)，每批调用一次
+    :return: {'written': 写入行数, 'errors': [(行号, 原因)], 'seconds': 耗时}
+    """
+    db = db or DatabaseManager(DB_NAME)
+    sql = SQL_UPSERT_PRODUCT.format(stock="stock + VALUES(stock)" if add_stock else "VALUES(stock)")
+    start = time.perf_counter()
+    written = 0
+    errors = []
+    batch = []
+
+    def flush(cursor):
+        cursor.executemany(sql, batch)
+        _bump_catalog_version(cursor)  # 每批都让各收银台的商品缓存失效
+
+    for line_no, raw in read_rows(path, encoding):
+        try:
+            batch.append(parse_product(raw))
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+        if len(batch) >= batch_size:
+            run_transaction(db, flush, 'import_products')
+            written += len(batch)
+            batch = []
+            if progress:
+                progress(written, len(errors))
+    if batch:
+        run_transaction(db, flush, 'import_products')
+        written += len(batch)
+        if progress:
+            progress(written, len(errors))
+    return {'written': written, 'errors': errors, 'seconds': time.perf_counter() - start}
+
+
+# ================= 导出 =================
+def _export(path, header, sql, params=(), progress=None, db=None):
+    """流式导出查询结果到 CSV (带 BOM，Excel 直接打开不乱码)，返回行数"""
+    db = db or DatabaseManager(DB_NAME)
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in db.stream(sql, params, EXPORT_CHUNK):
+            writer.writerow(row)
+            count += 1
+            if progress and count % EXPORT_CHUNK == 0:
+                progress(count, 0)
+    if progress:
+        progress(count, 0)
+    return count
+
+
+def export_products(path, progress=None, db=None):
+    """导出全部商品 (表头与导入格式一致，可以改完再导回来)"""
+    return _export(path, PRODUCT_FIELDS, f"SELECT {', '.join(PRODUCT_FIELDS)} FROM products ORDER BY id", (),
+                   progress, db)
+
+
+def export_sales(path, start=None, end=None, progress=None, db=None):
+    """导出销售记录，可按销售时间 [start, end) 过滤"""
+    sql = """
+    SELECT s.id, s.order_id, s.sale_time, s.product_id, p.name AS product_name, s.user_id, s.member_id,
+           s.quantity, s.buy_price_snapshot, s.sell_price_snapshot, s.total_price
+    FROM sales s
+    JOIN products p ON s.product_id = p.id
+    """
+    conditions = []
+    params = []
+    if start:
+        conditions.append("s.sale_time >= %s")
+        params.append(start)
+    if end:
+        conditions.append("s.sale_time < %s")
+        params.append(end)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY s.id"
+    return _export(path, SALES_EXPORT_FIELDS, sql, params, progress, db)
+
+
+def _print_progress(done, errors):
+    rate = done / max(time.perf_counter() - _started, 1e-6)
+    message = f"\r已处理 {done:,} 行"
+    if errors:
+        message += f"，错误 {errors} 行"
+    print(message + f" ({rate:,.0f} 行/秒)", end="", file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="商品批量导入 / 导出")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_import = sub.add_parser('import', help="导入商品 (CSV / XLSX)")
+    p_import.add_argument('path')
+    p_import.add_argument('--encoding', default='utf-8-sig', help="CSV 编码，Excel 另存的中文 CSV 一般是 gbk")
+    p_import.add_argument('--add-stock', action='store_true', help="已有商品库存累加而不是覆盖")
+    p_import.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    p_products = sub.add_parser('export-products', help="导出商品")
+    p_products.add_argument('path')
+    p_sales = sub.add_parser('export-sales', help="导出销售记录")
+    p_sales.add_argument('path')
+    p_sales.add_argument('--start', type=date.fromisoformat)
+    p_sales.add_argument('--end', type=date.fromisoformat)
+    args = parser.parse_args()
+
+    _started = time.perf_counter()
+    if args.command == 'import':
+        result = import_products(args.path, args.encoding, args.add_stock, args.batch_size, _print_progress)
+        print(f"\n导入完成：写入 {result['written']:,} 行，错误 {len(result['errors'])} 行，"
+              f"耗时 {result['seconds']:.1f}s")
+        for line_no, reason in result['errors'][:20]:
+            print(f"  第 {line_no} 行: {reason}")
+        if len(result['errors']) > 20:
+            print(f"  ... 其余 {len(result['errors']) - 20} 行略")
+    elif args.command == 'export-products':
+        print(f"\n导出 {export_products(args.path, _print_progress):,} 个商品")
+    else:
+        print(f"\n导出 {export_sales(args.path, args.start, args.end, _print_progress):,} 条销售记录")
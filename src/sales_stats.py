@@ -0,0 +1,247 @@
+"""
+店长看板的增量统计
+
+记住已经统计到的 sales.id 与 modification_logs.id (高水位)，每次刷新只读取之后的新流水和改单记录，
+把差额累加到总额、利润、各商品销量/销售额、各分类销售额和今日分钟走势上，刷新成本只与新增的业务量有关。
+分类按每笔流水的分类快照累计，商品后来改了分类或被删除，已经卖出的部分仍算在原分类里 (与汇总表口径一致)。
+
+自增 id 的分配顺序和提交顺序不一定一致：刷新时 id 105 已提交而 104 还没提交，直接把高水位推到 105
+就会漏掉 104。所以高水位以下缺的 id 记为 "空洞"，之后每次刷新再查一遍，超过 GAP_TIMEOUT 仍未出现的
+(事务已回滚) 才放弃；改单记录的 id 同样处理。新流水与改单记录必须在同一个一致性快照里读取。
+"""
+import heapq
+import time
+from datetime import date
+from decimal import Decimal
+
+GAP_TIMEOUT = 600  # 秒
+ZERO = Decimal('0')
+
+
+class SalesAggregator:
+    """看板统计的内存状态，非线程安全"""
+
+    def __init__(self):
+        self.sales_hw = 0
+        self.log_hw = 0
+        self.gaps = {}  # 可能还未提交的 sales.id -> 发现时间
+        self.log_gaps = {}  # 可能还未提交的 modification_logs.id -> 发现时间
+        self.by_product = {}  # 商品 id -> [销量, 销售额, 利润]
+        self.by_category = {}  # 分类快照 -> 销售额
+        self.revenue = ZERO
+        self.profit = ZERO
+        self.day = None
+        self.minutes = {}  # 当天第几分钟 -> 销售额
+        self.needs_reload = True
+
+    def load(self, products, categories, minutes, sales_hw, log_hw, recent_ids, day, scan_from=0, now=None,
+             recent_log_ids=None, log_scan_from=0):
+        """
+        全量初始化 (数据同样来自一个一致性快照)
+        :param products: [(商品 id, 销量, 销售额, 利润)]
+        :param categories: [(分类快照, 销售额)]
+        :param minutes: [(当天第几分钟, 销售额)]
+        :param recent_ids: (scan_from, sales_hw] 内已可见的 sales.id，其余的 id 记为初始空洞
+        :param recent_log_ids: (log_scan_from, log_hw] 内已可见的 modification_logs.id，None 表示不找改单空洞
+        """
+        now = time.monotonic() if now is None else now
+        self.by_product = {p_id: [int(qty), Decimal(revenue), Decimal(profit)]
+                           for p_id, qty, revenue, profit in products}
+        self.revenue = sum((e[1] for e in self.by_product.values()), ZERO)
+        self.profit = sum((e[2] for e in self.by_product.values()), ZERO)
+        self.by_category = {category: Decimal(revenue) for category, revenue in categories}
+        self.day = day
+        self.minutes = {int(m): Decimal(v) for m, v in minutes}
+        self.sales_hw = sales_hw
+        self.log_hw = log_hw
+        recent = set(recent_ids)
+        self.gaps = {i: now for i in range(scan_from + 1, sales_hw) if i not in recent}
+        self.log_gaps = {}
+        if recent_log_ids is not None:
+            recent = set(recent_log_ids)
+            self.log_gaps = {i: now for i in range(log_scan_from + 1, log_hw) if i not in recent}
+        self.needs_reload = False
+
+    def _add(self, row, qty, revenue):
+        profit = (row['sell_price_snapshot'] - row['buy_price_snapshot']) * qty
+        entry = self.by_product.setdefault(row['product_id'], [0, ZERO, ZERO])
+        entry[0] += qty
+        entry[1] += revenue
+        entry[2] += profit
+        self.by_category[row['category']] = self.by_category.get(row['category'], ZERO) + revenue
+        self.revenue += revenue
+        self.profit += profit
+        sale_time = row['sale_time']
+        if sale_time.date() == self.day:
+            minute = sale_time.hour * 60 + sale_time.minute
+            self.minutes[minute] = self.minutes.get(minute, ZERO) + revenue
+
+    def fold(self, sales, logs, today=None, now=None):
+        """
+        累加一次刷新读到的数据
+        :param sales: id 大于高水位或位于空洞中的流水 (id, product_id, quantity, total_price, 价格快照, sale_time,
+                      category 分类快照)
+        :param logs: id 大于高水位或位于空洞中的改单记录，关联了流水的 product_id / 价格快照 / sale_time / category，
+                     另有 old_qty、new_qty
+        """
+        now = time.monotonic() if now is None else now
+        today = today or date.today()
+        if today != self.day:
+            self.day = today
+            self.minutes = {}
+
+        prev_hw = self.sales_hw
+        prev_gaps = set(self.gaps)
+        seen = set()
+        for row in sales:
+            seen.add(row['id'])
+            self.gaps.pop(row['id'], None)
+            self._add(row, row['quantity'], row['total_price'])
+
+        self.sales_hw = self._advance(self.gaps, prev_hw, (row['id'] for row in sales), now)
+
+        for log in logs:
+            self.log_gaps.pop(log['id'], None)
+            sale_id = log['sale_id']
+            if sale_id in seen or sale_id > prev_hw or sale_id in prev_gaps:
+                continue  # 这笔流水本次才读到，读到的已经是改后的数量
+            if log['old_qty'] is None or log['new_qty'] is None:
+                self.needs_reload = True  # 老版本程序写的日志没有数量，只能全量重算
+                continue
+            diff = log['new_qty'] - log['old_qty']
+            self._add(log, diff, log['sell_price_snapshot'] * diff)
+        self.log_hw = self._advance(self.log_gaps, self.log_hw, (log['id'] for log in logs), now)
+
+        for gaps in (self.gaps, self.log_gaps):
+            for gap_id, found_at in list(gaps.items()):
+                if now - found_at > GAP_TIMEOUT:
+                    del gaps[gap_id]
+
+    @staticmethod
+    def _advance(gaps, prev_hw, ids, now):
+        """把高水位推到本次读到的最大 id，中间没读到的记为空洞，返回新高水位"""
+        new_ids = {i for i in ids if i > prev_hw}
+        if not new_ids:
+            return prev_hw
+        top = max(new_ids)
+        for missing in range(prev_hw + 1, top):
+            if missing not in new_ids:
+                gaps[missing] = now
+        return top
+
+    def snapshot(self, products, granularity=5, top_n=5):
+        """
+        看板数据，结构与 ManagerDashboard 绘图需要的一致
+        :param products: {商品 id: 商品记录}，只用于显示商品名
+        """
+        def name_of(p_id):
+            product = products.get(p_id)
+            return product['name'] if product else f"#{p_id}"
+
+        sold = [(p_id, e) for p_id, e in self.by_product.items() if e[0] > 0]
+        top = heapq.nlargest(top_n, sold, key=lambda item: (item[1][0], -item[0]))
+
+        categories = [c for c in sorted(self.by_category) if self.by_category[c]]
+
+        bucket_count = 24 * 60 // granularity
+        totals = [0.0] * bucket_count
+        for minute, revenue in sorted(self.minutes.items()):
+            totals[minute // granularity] += float(revenue)
+
+        return {
+            "stats": {'total_revenue': self.revenue, 'total_profit': self.profit},
+            "top5": [{'name': name_of(p_id), 'total_qty': e[0]} for p_id, e in top],
+            "labels": categories,
+            "sizes": [float(self.by_category[c]) for c in categories],
+            "x_minutes": list(range(0, 24 * 60, granularity)),
+            "totals": totals,
+        }
+
+
+if __name__ == '__main__':
+    # 正确性自检：随机结账、改单 (提交顺序打乱、部分回滚) 和商品改分类，每次刷新后和全量重算对比
+    import random
+    from datetime import datetime, timedelta
+
+    rng = random.Random(7)
+    products = {p: {'name': f"商品{p}", 'category': f"分类{p % 4}"} for p in range(1, 30)}
+    committed = {}  # 已提交的流水 id -> 行
+    pending = []  # 已分配 id、尚未提交的流水
+    logs = {}  # 已提交的改单记录 id -> 行
+    pending_logs = []  # 已分配 id、尚未提交的改单 (id, sale_id, new_qty)
+    next_id = [1]
+    next_log = [1]
+    clock = [0.0]
+    today = date.today()
+    base_time = datetime.combine(today, datetime.min.time())
+
+    def new_sale():
+        sell = Decimal(rng.randrange(100, 2000)) / 100
+        row = {'id': next_id[0], 'product_id': rng.randrange(1, 30), 'quantity': rng.randrange(1, 5),
+               'buy_price_snapshot': sell - Decimal(rng.randrange(0, 90)) / 100, 'sell_price_snapshot': sell,
+               'sale_time': base_time + timedelta(minutes=rng.randrange(-3 * 1440, 1440))}
+        row['category'] = products[row['product_id']]['category']  # 分类快照
+        row['total_price'] = row['sell_price_snapshot'] * row['quantity']
+        next_id[0] += 1
+        return row
+
+    def modify():
+        if not committed:
+            return
+        pending_logs.append((next_log[0], rng.choice(list(committed)), rng.randrange(1, 8)))
+        next_log[0] += 1
+
+    def commit_modify():
+        log_id, sale_id, new_qty = pending_logs.pop(rng.randrange(len(pending_logs)))  # 乱序提交
+        if rng.random() < 0.1:
+            return  # 回滚
+        row = committed[sale_id]
+        logs[log_id] = dict(row, id=log_id, sale_id=sale_id, old_qty=row['quantity'], new_qty=new_qty)
+        row['quantity'] = new_qty
+        row['total_price'] = row['sell_price_snapshot'] * new_qty
+
+    def full_recompute():
+        agg = SalesAggregator()
+        per_product = {}
+        per_category = {}
+        minutes = {}
+        for row in committed.values():
+            per_category[row['category']] = per_category.get(row['category'], ZERO) + row['total_price']
+            e = per_product.setdefault(row['product_id'], [0, ZERO, ZERO])
+            e[0] += row['quantity']
+            e[1] += row['total_price']
+            e[2] += (row['sell_price_snapshot'] - row['buy_price_snapshot']) * row['quantity']
+            if row['sale_time'].date() == today:
+                m = row['sale_time'].hour * 60 + row['sale_time'].minute
+                minutes[m] = minutes.get(m, ZERO) + row['total_price']
+        agg.load([(p, *e) for p, e in per_product.items()], per_category.items(), minutes.items(), max(committed, default=0),
+                 max(logs, default=0), committed, today)
+        return agg.snapshot(products)
+
+    incremental = SalesAggregator()
+    incremental.load([], [], [], 0, 0, [], today)
+    for step in range(3000):
+        action = rng.random()
+        if action < 0.5:
+            pending.append(new_sale())
+        elif action < 0.75 and pending:
+            row = pending.pop(rng.randrange(len(pending)))  # 乱序提交
+            if rng.random() < 0.1:
+                continue  # 回滚，留下永久空洞
+            committed[row['id']] = row
+        elif action < 0.83:
+            modify()
+        elif action < 0.9 and pending_logs:
+            commit_modify()
+        elif action < 0.92:
+            products[rng.randrange(1, 30)]['category'] = f"分类{rng.randrange(6)}"  # 已卖出的仍算在原分类
+        else:
+            clock[0] += 1  # 每次刷新间隔 1 秒，挂起的事务都远小于 GAP_TIMEOUT
+            # 同一快照里：高水位之后的新流水和改单记录 + 空洞里已经提交的
+            visible = [dict(r) for i, r in sorted(committed.items())
+                       if i > incremental.sales_hw or i in incremental.gaps]
+            visible_logs = [l for i, l in sorted(logs.items()) if i > incremental.log_hw or i in incremental.log_gaps]
+            incremental.fold(visible, visible_logs, today, clock[0])
+            got, expected = incremental.snapshot(products), full_recompute()
+            assert got == expected, f"第 {step} 步不一致"
+    print(f"通过：{len(committed)} 笔流水，{len(logs)} 次改单，剩余空洞 {len(incremental.gaps)} + {len(incremental.log_gaps)} 个")
@@ -0,0 +1,142 @@
+"""
+商品搜索索引
+
+内存倒排索引：对商品名、分类以及商品名的拼音首字母切 1/2 字 n-gram，
+查询时先用 n-gram 求交集得到候选，再逐个校验并排序。
+收银员既可以输入汉字 ("可乐")，也可以输入拼音首字母 ("kkkl")。
+
+拼音首字母优先使用 pypinyin (可选依赖)，没有安装时用 GB2312 一级汉字的
+拼音区间表推算，常用字都能覆盖。
+"""
+import heapq
+from bisect import bisect_right
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+# GB2312 一级汉字按拼音排序，每个声母字母的起始编码
+_GB2312_INITIALS = [
+    (0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'),
+    (0xB7A2, 'f'), (0xB8C1, 'g'), (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'),
+    (0xC0AC, 'l'), (0xC2E8, 'm'), (0xC4C3, 'n'), (0xC5B6, 'o'), (0xC5BE, 'p'),
+    (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'), (0xCBFA, 't'), (0xCDDA, 'w'),
+    (0xCEF4, 'x'), (0xD1B9, 'y'), (0xD4D1, 'z'),
+]
+_GB2312_CODES = [code for code, _ in _GB2312_INITIALS]
+_GB2312_LEVEL1_END = 0xD7F9
+
+
+def _char_initial(ch):
+    if ch.isascii():
+        return ch.lower() if ch.isalnum() else ''
+    try:
+        raw = ch.encode('gb2312')
+    except UnicodeEncodeError:
+        return ''
+    if len(raw) != 2:
+        return ''
+    code = (raw[0] << 8) | raw[1]
+    if code < _GB2312_CODES[0] or code > _GB2312_LEVEL1_END:
+        return ''  # 标点、全角字符、二级汉字
+    return _GB2312_INITIALS[bisect_right(_GB2312_CODES, code) - 1][1]
+
+
+def pinyin_initials(text):
+    """汉字转拼音首字母，字母数字原样保留 (小写)，其余字符丢弃"""
+    if lazy_pinyin is not None:
+        parts = lazy_pinyin(text, style=Style.FIRST_LETTER, errors=lambda s: list(s))
+        return ''.join(p[0].lower() for p in parts if p and p[0].isascii() and p[0].isalnum())
+    return ''.join(_char_initial(ch) for ch in text)
+
+
+def _grams(text):
+    """1 字和 2 字 n-gram"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class SearchIndex:
+    """
+    商品名 / 分类 / 拼音首字母 的 n-gram 倒排索引
+    非线程安全，由 ProductCache 的锁保护
+    """
+
+    def __init__(self):
+        self._docs = {}  # id -> (商品名, 分类, 拼音首字母)，均为小写
+        self._postings = {}  # n-gram -> {id}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def rebuild(self, products):
+        """products: 可迭代的 (id, 商品名, 分类)"""
+        self._docs = {}
+        self._postings = {}
+        for p_id, name, category in products:
+            self.add(p_id, name, category)
+
+    def add(self, p_id, name, category):
+        """新增或更新一个商品"""
+        if p_id in self._docs:
+            self.remove(p_id)
+        name = (name or '').lower()
+        category = (category or '').lower()
+        doc = (name, category, pinyin_initials(name))
+        self._docs[p_id] = doc
+        for field in doc:
+            for gram in _grams(field):
+                self._postings.setdefault(gram, set()).add(p_id)
+
+    def remove(self, p_id):
+        doc = self._docs.pop(p_id, None)
+        if doc is None:
+            return
+        for field in doc:
+            for gram in _grams(field):
+                ids = self._postings.get(gram)
+                if ids is not None:
+                    ids.discard(p_id)
+                    if not ids:
+                        del self._postings[gram]
+
+    def search(self, keyword, limit=None):
+        """
+        返回按相关度排序的商品 id
+        排序：商品名前缀 > 商品名包含 > 拼音首字母前缀 > 拼音首字母包含 > 分类包含，
+        同一档里名字越短越靠前
+        """
+        query = keyword.strip().lower()
+        if not query:
+            return []
+
+        grams = [query] if len(query) == 1 else {query[i:i + 2] for i in range(len(query) - 1)}
+        postings = []
+        for gram in grams:
+            ids = self._postings.get(gram)
+            if not ids:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+
+        scored = []
+        for p_id in candidates:
+            name, category, initials = self._docs[p_id]
+            if name.startswith(query):
+                rank = 0
+            elif query in name:
+                rank = 1
+            elif initials.startswith(query):
+                rank = 2
+            elif query in initials:
+                rank = 3
+            elif query in category:
+                rank = 4
+            else:
+                continue  # n-gram 命中但不是连续子串
+            scored.append((rank, len(name), p_id))
+        scored = heapq.nsmallest(limit, scored) if limit else sorted(scored)
+        return [p_id for _, _, p_id in scored]
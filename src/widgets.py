@@ -0,0 +1,311 @@
+import tkinter as tk
+import ttkbootstrap as ttk
+from ttkbootstrap.constants import *
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundRunner:
+    """
+    后台执行器：耗时的数据库查询放到工作线程，结果通过 after() 交回 Tk 主线程
+    同一个 key 只保留最新一次请求，旧请求的结果直接丢弃
+    """
+
+    POLL_MS = 16  # 约一帧
+
+    def __init__(self, widget, max_workers=2):
+        self.widget = widget
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ui-worker")
+        self._latest = {}
+
+    def submit(self, key, func, on_done, on_error=None):
+        """后台执行 func()，完成后在主线程调用 on_done(结果) 或 on_error(异常)"""
+        old = self._latest.get(key)
+        if old is not None:
+            old.cancel()  # 还没开始跑的直接取消，已经在跑的等结果出来后丢弃
+        future = self.executor.submit(func)
+        self._latest[key] = future
+        self._poll(key, future, on_done, on_error)
+
+    def _poll(self, key, future, on_done, on_error):
+        if not future.done():
+            try:
+                self.widget.after(self.POLL_MS, self._poll, key, future, on_done, on_error)
+            except tk.TclError:
+                pass  # 界面已销毁
+            return
+
+        if self._latest.get(key) is not future:
+            return  # 已被更新的请求取代
+        del self._latest[key]
+
+        try:
+            result = future.result()
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            else:
+                print(f"[Background Error] {e}")
+            return
+        on_done(result)
+
+    def shutdown(self):
+        self._latest.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _rendered_cache(tree):
+    """记录每个 iid 上次写入的 (values, tags)，对比时不必再向 Tk 查询"""
+    cache = getattr(tree, "_sync_rendered", None)
+    if cache is None:
+        cache = tree._sync_rendered = {}
+    return cache
+
+
+def _normalize(values, tags):
+    return tuple("" if v is None else str(v) for v in values), tuple(tags)
+
+
+def sync_treeview(tree, rows, iid_func, row_func):
+    """
+    按 iid 把 Treeview 对齐到 rows：
+    新行插入、消失的行删除、值有变化的行原地更新，没变化的行不动
+    :param iid_func: 行 -> 唯一键 (作为 Treeview 的 iid)
+    :param row_func: 行 -> (values, tags)
+    :return: 实际改动的行数
+    """
+    cache = _rendered_cache(tree)
+    wanted = []
+    for row in rows:
+        values, tags = _normalize(*row_func(row))
+        wanted.append((str(iid_func(row)), values, tags))
+    wanted_ids = {iid for iid, _, _ in wanted}
+
+    existing = tree.get_children()
+    stale = [iid for iid in existing if iid not in wanted_ids]
+    if stale:
+        tree.delete(*stale)
+        for iid in stale:
+            cache.pop(iid, None)
+
+    # 保留下来的行如果相对顺序没变，只需在正确位置插入新行；否则逐行移动
+    kept = [iid for iid in existing if iid in wanted_ids]
+    kept_set = set(kept)
+    reorder = kept != [iid for iid, _, _ in wanted if iid in kept_set]
+
+    changed = len(stale)
+    for index, (iid, values, tags) in enumerate(wanted):
+        if iid in kept_set:
+            if reorder:
+                tree.move(iid, "", index)
+            if cache.get(iid) != (values, tags):
+                tree.item(iid, values=values, tags=tags)
+                cache[iid] = (values, tags)
+                changed += 1
+        else:
+            tree.insert("", index, iid=iid, values=values, tags=tags)
+            cache[iid] = (values, tags)
+            changed += 1
+    return changed
+
+
+def patch_treeview(tree, rows, iid_func, row_func):
+    """只更新 rows 中已经显示在 Treeview 里的行 (例如结账后刷新库存)"""
+    cache = _rendered_cache(tree)
+    changed = 0
+    for row in rows:
+        iid = str(iid_func(row))
+        if not tree.exists(iid):
+            continue
+        values, tags = _normalize(*row_func(row))
+        if cache.get(iid) != (values, tags):
+            tree.item(iid, values=values, tags=tags)
+            cache[iid] = (values, tags)
+            changed += 1
+    return changed
+
+
+def put_treeview_row(tree, row, iid_func, row_func):
+    """单行增改：已有的行原地更新，没有的行追加到末尾"""
+    cache = _rendered_cache(tree)
+    iid = str(iid_func(row))
+    values, tags = _normalize(*row_func(row))
+    if not tree.exists(iid):
+        tree.insert("", END, iid=iid, values=values, tags=tags)
+    elif cache.get(iid) != (values, tags):
+        tree.item(iid, values=values, tags=tags)
+    else:
+        return False
+    cache[iid] = (values, tags)
+    return True
+
+
+def drop_treeview_row(tree, iid):
+    """单行删除"""
+    iid = str(iid)
+    _rendered_cache(tree).pop(iid, None)
+    if tree.exists(iid):
+        tree.delete(iid)
+        return True
+    return False
+
+
+class VirtualTreeview(ttk.Frame):
+    """
+    分页虚拟列表
+    只在内存和 Treeview 里保留可视范围附近的 max_pages 页数据，
+    滚到底部时按键集分页 (after_key) 取下一页，滚回顶部时重新取被丢掉的上一页
+    """
+
+    EDGE = 0.02  # 滚动条距离两端多近时触发翻页
+
+    def __init__(self, master, columns, fetch_page, key_func, row_func, iid_func=None,
+                 page_size=200, max_pages=3, runner=None, **tree_kw):
+        """
+        :param fetch_page: fetch_page(after_key, limit) -> 行列表，after_key 为 None 表示第一页
+        :param key_func: 行 -> 分页键，需与后端排序一致
+        :param row_func: 行 -> (values, tags)
+        :param iid_func: 行 -> 唯一键，作为 Treeview 的 iid，默认同 key_func
+        :param runner: BackgroundRunner，传入时在后台线程取数据
+        """
+        super().__init__(master)
+        self.fetch_page = fetch_page
+        self.key_func = key_func
+        self.row_func = row_func
+        self.iid_func = iid_func or key_func
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.runner = runner
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", **tree_kw)
+        self.scrollbar = ttk.Scrollbar(self, orient=VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(side=LEFT, fill=BOTH, expand=True)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+
+        self._pages = []  # [(起始键, 行列表)]
+        self._front_keys = []  # 被丢掉的前面几页的起始键，回滚时重新取
+        self._has_more = False
+        self._loading = False
+        self._static = False  # 显示搜索结果等一次性数据时不分页
+        self._static_row_func = None
+        self._generation = 0
+
+    # ---------- 对外接口 ----------
+    def reload(self):
+        """从第一页重新加载"""
+        self._generation += 1
+        self._static = False
+        self._static_row_func = None
+        self._pages = []
+        self._front_keys = []
+        self._has_more = False
+        self._fetch(None, self._on_first_page)
+
+    def show_rows(self, rows, row_func=None):
+        """直接显示一组数据 (搜索结果等)，不再分页"""
+        self._generation += 1
+        self._static = True
+        self._loading = False
+        self._pages = [(None, list(rows))]
+        self._front_keys = []
+        self._has_more = False
+        self._static_row_func = row_func
+        self._render()
+        self.tree.yview_moveto(0)
+
+    def rows(self):
+        """当前窗口内的全部行"""
+        return [row for _, page in self._pages for row in page]
+
+    def patch_rows(self, rows, row_func=None):
+        """用新数据替换窗口内同 iid 的行，只重绘这些行"""
+        fresh = {str(self.iid_func(row)): row for row in rows}
+        for _, page in self._pages:
+            for i, row in enumerate(page):
+                new_row = fresh.get(str(self.iid_func(row)))
+                if new_row is not None:
+                    page[i] = new_row
+        return patch_treeview(self.tree, rows, self.iid_func, row_func or self._row_func)
+
+    # ---------- 分页 ----------
+    def _fetch(self, after_key, callback):
+        self._loading = True
+        generation = self._generation
+
+        def deliver(rows):
+            if generation != self._generation:
+                return  # 列表已被 reload/show_rows 重置
+            self._loading = False
+            callback(after_key, rows)
+
+        def on_error(e):
+            self._loading = False
+            print(f"[VirtualTreeview] 加载失败: {e}")
+
+        fetch = lambda: self.fetch_page(after_key, self.page_size)
+        if self.runner:
+            self.runner.submit(f"vlist-{id(self)}", fetch, deliver, on_error)
+        else:
+            try:
+                rows = fetch()
+            except Exception as e:
+                on_error(e)
+                return
+            deliver(rows)
+
+    def _on_first_page(self, start_key, rows):
+        self._pages = [(start_key, rows)]
+        self._has_more = len(rows) >= self.page_size
+        self._render()
+        self.tree.yview_moveto(0)
+
+    def _on_next_page(self, start_key, rows):
+        self._has_more = len(rows) >= self.page_size
+        if not rows:
+            return
+        top = self._top_index()
+        self._pages.append((start_key, rows))
+        dropped = 0
+        if len(self._pages) > self.max_pages:
+            first_key, first_rows = self._pages.pop(0)
+            self._front_keys.append(first_key)
+            dropped = len(first_rows)
+        self._render()
+        self._move_to_index(top - dropped)
+
+    def _on_prev_page(self, start_key, rows):
+        self._front_keys.pop()
+        top = self._top_index()
+        self._pages.insert(0, (start_key, rows))
+        if len(self._pages) > self.max_pages:
+            self._pages.pop()
+            self._has_more = True
+        self._render()
+        self._move_to_index(top + len(rows))
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._static or self._loading or not self._pages:
+            return
+        if float(last) >= 1 - self.EDGE and self._has_more:
+            last_page = self._pages[-1][1]
+            self._fetch(self.key_func(last_page[-1]), self._on_next_page)
+        elif float(first) <= self.EDGE and self._front_keys:
+            self._fetch(self._front_keys[-1], self._on_prev_page)
+
+    # ---------- 绘制 ----------
+    def _row_func(self, row):
+        return (self._static_row_func or self.row_func)(row)
+
+    def _render(self):
+        # 差量更新：翻页/刷新时只改动真正变化的行
+        sync_treeview(self.tree, self.rows(), self.iid_func, self._row_func)
+
+    def _top_index(self):
+        total = len(self.tree.get_children())
+        return int(float(self.tree.yview()[0]) * total)
+
+    def _move_to_index(self, index):
+        total = len(self.tree.get_children())
+        if total:
+            self.tree.yview_moveto(max(index, 0) / total)